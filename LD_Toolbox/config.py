@@ -6,11 +6,51 @@ environment
 # Enter the full path to the PLSS feature class being used.
 PLSS = r'C:\Users\logans1\Legal_Description_to_Feature\BLM_CO_PLSS_Intersected_Survey_Grid.gdb\BLM_Colorado_PLSS_Intersected___Survey_Grid'
 
+# Where the layers are read and written: 'arcpy' for geodatabases in ArcGIS Pro,
+# or 'sqlite' to run offline on SQLite files (the PLSS, GIS layer and output
+# gdb paths are then a SQLite file, or a file joined with the table name).
+FEATURE_STORE = 'arcpy'
+
 # Setup for the log file and audit file
 # Original - LOG_FILE_FOLDER = r'D:\Projects\CSLB\logs'
 LOG_FILE_FOLDER = r'C:\Users\logans1\Legal_Description_to_Feature\logs'
 LOG_FILE_NAME = 'Lease_Updates'
 AUDIT_FILE_NAME = 'PLSS_Audit_Records'
+# Also write the audit records, with a summary of the counts, to an Excel file
+AUDIT_XLSX_SUMMARY = False
+
+# Legal description parses are cached in this SQLite file in the log folder.
+# Set USE_PARSE_CACHE to False to parse every description from scratch.
+USE_PARSE_CACHE = True
+PARSE_CACHE_NAME = 'LD_Parse_Cache.sqlite'
+
+# Worker processes for the first/second division checks of new records.
+# 1 runs the checks in the main process.
+DIVISION_CHECK_WORKERS = 1
+
+# Collect timings of the legal description parser stages and the pattern
+# keys matched. Written to a JSON file in the report folder at the end of
+# the run.
+PARSER_INSTRUMENTATION = False
+
+# Read only the FIELD_MAPPING columns of the Excel file, row by row.
+# Set EXCEL_STREAMING to False to load them with pandas instead.
+EXCEL_STREAMING = True
+
+# Keep a snapshot of the Excel data read, so a rerun against the same
+# workbook skips the Excel parse. Snapshots go in this folder under the log
+# folder; the least recently used are removed past EXCEL_SNAPSHOT_MAX_MB.
+USE_EXCEL_SNAPSHOTS = True
+EXCEL_SNAPSHOT_FOLDER = 'Excel_Snapshots'
+EXCEL_SNAPSHOT_MAX_MB = 500
+
+# Delta mode only applies attribute updates to transactions that changed
+# since the last successful run, and rebuilds the geometry of those whose
+# legal description changed. The transaction hashes of that run are kept
+# in this JSON file in the log folder. Records not yet in the GIS layer are
+# always processed.
+DELTA_MODE = False
+DELTA_STATE_NAME = 'LD_Delta_State.json'
 
 
 #<<<<<<<<<<<<<<< Following items are not environment specific and usually do not need updates >>>>>>>>>>>>>>>
@@ -18,6 +58,8 @@ AUDIT_FILE_NAME = 'PLSS_Audit_Records'
 # Field to use to match and dissolve the PLSS polygons. This should match the column name in the Excel file.
 DISSOLVE_FIELD = 'Transaction Number'
 ACRES_FIELD = 'Acreage'
+# Consolidated acres within this of the Excel total are not reported as a mismatch
+ACRES_TOLERANCE = 0.000001
 
 # Mapping of the Excel column headings to the attribute names in the GIS layer
 # WARNING: Some of these keys are hard coded in the script. Check before updating.
@@ -51,6 +93,58 @@ EXCEL_DATATYPES = {
     'End Date (Letter Merge)': 'Timestamp',
 }
 
+# How the records of a transaction are combined into the one GIS record.
+# Excel columns not listed keep the value of the transaction's first record.
+#   'first'       value of the first record
+#   'sum'         total, None if no record has a value (numeric GIS field)
+#   'join_unique' distinct values in record order, joined by CONSOLIDATION_SEPARATOR
+#                 (the GIS field needs to be text and long enough)
+#   'min', 'max'  smallest/largest value, e.g. earliest start date
+# The run stops before any change to the GIS layer if a rule does not fit
+# its field, e.g. 'Section#': 'join_unique' on a LONG Section field.
+CONSOLIDATION_RULES = {
+    'Acreage': 'sum',
+    # 'Legal Description': 'join_unique',
+    # 'Start Date (Letter Merge)': 'min',
+    # 'End Date (Letter Merge)': 'max'
+    }
+CONSOLIDATION_SEPARATOR = '; '
+
+# First divisions (FRSTDIVID values) read per PLSS query. Keeps the IN lists
+# of the queries within what the database takes.
+PLSS_QUERY_BATCH_SIZE = 500
+# PLSS features read are kept in memory for the later records of the same
+# first division, up to about this much. The least recently used go first.
+PLSS_INDEX_MAX_MB = 256
+
+# How the PLSS features of each transaction are dissolved:
+#   'pairwise'  temp PLSS layer dissolved with PairwiseDissolve
+#   'inprocess' in memory as the records are looked up (no temp layers).
+#               Check it against 'pairwise' output with
+#               ld_benchmark.py dissolve before switching to it.
+DISSOLVE_ENGINE = 'pairwise'
+# Coordinates are snapped to this before the in-process dissolve, in the
+# units of the GIS layer. Match the layer's XY resolution.
+DISSOLVE_XY_RESOLUTION = 0.0001
+# Vertices and edges closer than this are merged by the in-process
+# dissolve, in the units of the GIS layer. Match the layer's XY tolerance,
+# the cluster tolerance PairwiseDissolve uses.
+DISSOLVE_XY_TOLERANCE = 0.001
+# Temp layers (pairwise engine) are kept in the memory workspace up to about
+# this much, then in a scratch gdb made for the run next to the output gdb.
+# Either way they are deleted at the end of the run.
+SCRATCH_MEMORY_MB = 512
+
+# The PLSS features of each first division and set of second divisions are
+# kept dissolved in this SQLite file in the log folder, so later runs skip
+# the PLSS read and most of the dissolve for the same parcels ('inprocess'
+# DISSOLVE_ENGINE only). The cache is
+# cleared when the PLSS layer changes, and trimmed to GEOMETRY_CACHE_MAX_MB,
+# least recently used first.
+USE_GEOMETRY_CACHE = True
+GEOMETRY_CACHE_NAME = 'LD_Geometry_Cache.sqlite'
+GEOMETRY_CACHE_MAX_MB = 200
+
 UPDATE_FIELDS = [
     'Lease Type',
     'Lease Subtype',
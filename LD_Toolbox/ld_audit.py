@@ -0,0 +1,132 @@
+'''
+Audit file of the records that could not be processed or need review
+
+Records are written to the CSV as each stage reports them and flushed,
+so memory use does not grow with the number of records and a run that
+stops partway still leaves the records found so far. Counts per stage,
+severity and code are kept as the records go by.
+'''
+import csv
+import os
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+import openpyxl
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Stages of main reporting records
+STAGE_LEASE_DATA = 'Lease data'
+STAGE_DELTA = 'Delta'
+STAGE_FIRST_DIV = 'First Division'
+STAGE_SECOND_DIV = 'Second Division'
+STAGE_PLSS = 'PLSS lookup'
+STAGE_ACRES = 'Acres'
+
+ERROR = 'ERROR'
+WARNING = 'WARNING'
+AUDIT = 'AUDIT'
+
+MESSAGE_FIELD = 'Error/Audit Messages'
+AUDIT_FIELDS = ['Stage', 'Severity', 'Code']
+
+# Excel sheet row limit, less the heading
+XLSX_MAX_RECORDS = 1048575
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class AuditStore:
+    '''
+    CSV audit file: the original record values, the message, then the
+    stage, severity and message code. mirror_log, if given, is called
+    with each record (values and message) as it is added.
+    '''
+    def __init__(self, audit_file:str, col_names:List[str], mirror_log:Callable = None):
+        self.audit_file = audit_file
+        self.col_names = col_names[:]
+        self.mirror_log = mirror_log
+        self.counts = Counter()
+        self.code_counts = Counter()
+
+        self._csv_file = open(audit_file, 'w', encoding='UTF-8', newline='')
+        self._writer = csv.writer(self._csv_file)
+        self._writer.writerow(self.field_names)
+        self._csv_file.flush()
+
+    def __str__(self):
+        return f'audit_file: {self.audit_file}; records: {self.record_count}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def field_names(self) -> List[str]:
+        return self.col_names + [MESSAGE_FIELD] + AUDIT_FIELDS
+
+    @property
+    def record_count(self) -> int:
+        return sum(self.counts.values())
+
+    def add_records(self, stage:str, severity:str, code:str, records:List[list]) -> None:
+        '''
+        Write records given as the record values with the message last,
+        the form the checks return them in
+        '''
+        for record in records:
+            self._writer.writerow(list(record) + [stage, severity, code])
+            if self.mirror_log is not None:
+                self.mirror_log(record)
+
+        self.counts[(stage, severity)] += len(records)
+        self.code_counts[(stage, severity, code)] += len(records)
+        self._csv_file.flush()
+
+    def add(self, stage:str, severity:str, code:str, record_values:list, message:str) -> None:
+        '''
+        Write one record
+        '''
+        record = list(record_values)
+        record.append(message)
+        self.add_records(stage, severity, code, [record])
+
+    def get_stage_count(self, stage:str, severity:str = None) -> int:
+        '''
+        Records of the stage so far, of any or the given severity
+        '''
+        return sum(count for (count_stage, count_severity), count in self.counts.items()
+                   if count_stage == stage and (severity is None or count_severity == severity))
+
+    def get_counts(self) -> Dict[Tuple[str, str, str], int]:
+        '''
+        Records so far by (stage, severity, code)
+        '''
+        return dict(self.code_counts)
+
+    def close(self) -> None:
+        if not self._csv_file.closed:
+            self._csv_file.close()
+
+    def write_summary(self, xlsx_file:str) -> None:
+        '''
+        Excel copy of the audit file: a Summary sheet of the counts and a
+        Records sheet, streamed from the CSV (left out past the sheet row
+        limit). Closes the store.
+        '''
+        self.close()
+
+        workbook = openpyxl.Workbook(write_only=True)
+        summary_sheet = workbook.create_sheet('Summary')
+        summary_sheet.append(AUDIT_FIELDS + ['Count'])
+        for (stage, severity, code), count in self.code_counts.items():
+            summary_sheet.append([stage, severity, code, count])
+
+        if self.record_count <= XLSX_MAX_RECORDS:
+            records_sheet = workbook.create_sheet('Records')
+            with open(self.audit_file, encoding='UTF-8', newline='') as csv_file:
+                for row in csv.reader(csv_file):
+                    records_sheet.append(row)
+
+        temp_file = f'{xlsx_file}.{os.getpid()}.tmp'
+        workbook.save(temp_file)
+        os.replace(temp_file, xlsx_file)
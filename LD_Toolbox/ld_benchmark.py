@@ -0,0 +1,718 @@
+'''
+Benchmarks for the legal description parser
+
+Runs offline, without arcpy. The legal descriptions are read once from the
+Netsuite extracts shipped with the repo and kept in a local JSON cache.
+
+Each parser stage is timed over the descriptions (descriptions/sec, p50 and
+p99 latency) and the parse results are compared against a stored snapshot,
+so a speed change that also changes the results is caught.
+
+The consistency benchmark times ld_checks.check_lease_update_data on
+synthetic lease data of growing size, after checking it against the
+original per-transaction loop on a small set.
+
+The pipeline benchmark runs the whole script (main) on the SQLite feature
+store, against a synthetic PLSS layer covering the sections of the extract
+and a GIS layer seeded with some of its transactions.
+
+The dissolve benchmark times the in-process dissolve (ld_dissolve) on the
+temp PLSS features of a pipeline run with the pairwise engine, against the
+store's dissolve, and checks each transaction's area and vertices against
+the temp dissolve layer of that run. With --store arcpy (ArcGIS Pro) the
+features are copied to a file gdb and checked against PairwiseDissolve
+output instead. It then checks fixtures the PLSS grid does not have
+(edges off the axes, near-coincident vertices, holes, overlapping pieces)
+against their expected areas and parts, and against PairwiseDissolve on
+the arcpy store.
+
+Usage:
+    python ld_benchmark.py parser
+    python ld_benchmark.py parser --update-snapshot
+    python ld_benchmark.py consistency
+    python ld_benchmark.py pipeline [--excel FILE] [--profile] [--dissolve-engine inprocess|pairwise]
+    python ld_benchmark.py dissolve [--store sqlite|arcpy] [--gdb GDB]
+'''
+import argparse
+import cProfile
+import json
+import math
+import os
+import pstats
+import statistics
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import ld_checks
+import ld_dissolve
+import ld_divisions
+import ld_excel
+import ld_geometry
+import ld_parser
+import ld_store
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+MODULE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+EXCEL_FILES = [
+    os.path.join(MODULE_FOLDER, '..', 'ALL_Netsuite_Active_Leases.xlsx'),
+    os.path.join(MODULE_FOLDER, '..', 'Netsuite_Active_Leases.xlsx')
+    ]
+CACHE_FOLDER = os.path.join(MODULE_FOLDER, '.benchmark_cache')
+SNAPSHOT_FILE = os.path.join(MODULE_FOLDER, 'ld_parser_snapshot.json')
+
+LEGAL_DESCRIPTION_FIELD = 'Legal Description'
+
+PIPELINE_FOLDER = os.path.join(CACHE_FOLDER, 'pipeline')
+SECTION_SIZE = 1600.0
+TOWNSHIP_SIZE = SECTION_SIZE * 6
+MERIDIAN_OFFSET = 10000000.0
+
+# Fields of the lease layer in Monthly Lease Update.gdb (Lease_Update_7_3_2023),
+# by the GIS names of FIELD_MAPPING
+LEASE_LAYER_FIELDS = {
+    'Lease_Type': ('Lease_Type', ld_store.TEXT, 1000),
+    'Lease_Subt': ('Lease_Subt', ld_store.TEXT, 1000),
+    'Transact_1': ('Transact_1', ld_store.TEXT, 1000),
+    'Lessee_Nam': ('Lessee_Nam', ld_store.TEXT, 1000),
+    'Legacy_Lea': ('Legacy_Lea', ld_store.TEXT, 1000),
+    'Lease_Star': ('Lease_Star', ld_store.DATE),
+    'Lease_End_': ('Lease_End_', ld_store.DATE),
+    'ns_int_id': ('ns_int_id', ld_store.DOUBLE),
+    'Lease_Term': ('Lease_Term', ld_store.LONG),
+    'Administra': ('Administra', ld_store.TEXT, 1000),
+    'District': ('District', ld_store.TEXT, 1000),
+    'Lease_Stat': ('Lease_Stat', ld_store.TEXT, 1000),
+    'Meridian': ('Meridian', ld_store.TEXT, 1000),
+    'Township': ('Township', ld_store.TEXT, 1000),
+    'Range': ('Range', ld_store.TEXT, 1000),
+    'Section': ('Section', ld_store.LONG),
+    'GIS_Legal': ('GIS_Legal', ld_store.TEXT, 1000),
+    'Acreage': ('Acreage', ld_store.DOUBLE)
+    }
+
+# Dissolve fixtures, placed in NAD83 / UTM zone 13N (the arcpy store's
+# spatial reference for the dissolve benchmark)
+BENCHMARK_SPATIAL_REFERENCE = 26913
+FIXTURE_ORIGIN = (500000.0, 4400000.0)
+FIXTURE_SPACING = 5000.0
+FIXTURE_FIELD = 'Fixture'
+# Fixture areas are checked to within this fraction
+FIXTURE_AREA_TOLERANCE = 0.000001
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def load_descriptions(excel_files:List[str] = None) -> List[str]:
+    '''
+    Legal descriptions from the Excel files, in file and row order. Read
+    from the local cache unless one of the files has changed.
+    '''
+    if excel_files is None:
+        excel_files = EXCEL_FILES
+
+    source_stamp = [[os.path.basename(excel_file), os.path.getsize(excel_file), os.path.getmtime(excel_file)] for excel_file in excel_files]
+    cache_file = os.path.join(CACHE_FOLDER, 'descriptions.json')
+
+    if os.path.exists(cache_file):
+        with open(cache_file, encoding='UTF-8') as json_file:
+            cached = json.load(json_file)
+        if cached['source'] == source_stamp:
+            return cached['descriptions']
+
+    descriptions = []
+    for excel_file in excel_files:
+        excel_data = pd.read_excel(excel_file, usecols=[LEGAL_DESCRIPTION_FIELD])
+        excel_data = excel_data.astype(object).where(excel_data.notna(), None)
+        descriptions.extend(excel_data[LEGAL_DESCRIPTION_FIELD].to_list())
+
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    with open(cache_file, 'w', encoding='UTF-8') as json_file:
+        json.dump({'source': source_stamp, 'descriptions': descriptions}, json_file)
+
+    return descriptions
+
+
+def _parse_or_error(search_str:str) -> None:
+    ''' get_2nd_div, with parse errors being a normal outcome '''
+    try:
+        ld_parser.get_2nd_div(search_str)
+    except ValueError:
+        pass
+
+
+def _stage_inputs(descriptions:List[str]) -> Dict[str, list]:
+    '''
+    Input of each parser stage, found by running the stages in the same
+    order as ld_parser._parse_for_search_items
+    '''
+    stage_inputs = {
+        'get_2nd_div': descriptions,
+        '_check_for_all_values': descriptions,
+        '_known_pattern_search': [],
+        '_aliquot_search': [],
+        '_lot_list_search': [],
+        '_evaluate_remaining_words': []
+        }
+
+    for description in descriptions:
+        if not isinstance(description, str) or ld_parser._check_for_all_values(description):
+            continue
+
+        stage_str = ld_parser.canonicalize_description(description)
+        for stage_name in ['_known_pattern_search', '_aliquot_search', '_lot_list_search']:
+            stage_inputs[stage_name].append(stage_str)
+            stage_str = getattr(ld_parser, stage_name)(stage_str)[0]
+        stage_inputs['_evaluate_remaining_words'].append(stage_str)
+
+    return stage_inputs
+
+
+def time_function(func:Callable, inputs:list) -> Dict[str, float]:
+    '''
+    Time each call of the function. Returns the number of inputs,
+    descriptions per second and the p50/p99 latency in microseconds.
+    '''
+    latencies = []
+    for input_value in inputs:
+        start = time.perf_counter_ns()
+        func(input_value)
+        latencies.append(time.perf_counter_ns() - start)
+
+    if len(latencies) == 0:
+        return {'count': 0, 'per_sec': 0.0, 'p50_us': 0.0, 'p99_us': 0.0}
+
+    total_ns = sum(latencies)
+    latencies.sort()
+
+    return {
+        'count': len(latencies),
+        'per_sec': len(latencies) / (total_ns / 1e9) if total_ns > 0 else float('inf'),
+        'p50_us': statistics.median(latencies) / 1000,
+        'p99_us': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] / 1000
+        }
+
+
+def benchmark_parser(descriptions:List[str]) -> Dict[str, Dict[str, float]]:
+    '''
+    Timings for get_2nd_div and each of its stages
+    '''
+    stage_inputs = _stage_inputs(descriptions)
+    timings = {}
+
+    for stage_name, inputs in stage_inputs.items():
+        if stage_name == 'get_2nd_div':
+            func = _parse_or_error
+        else:
+            func = getattr(ld_parser, stage_name)
+        timings[stage_name] = time_function(func, inputs)
+
+    return timings
+
+
+def snapshot_results(descriptions:List[str]) -> Dict[str, dict]:
+    '''
+    Parse output of each distinct description, in a form that compares
+    and stores as JSON
+    '''
+    snapshot = {}
+
+    for description in descriptions:
+        if not isinstance(description, str) or description in snapshot:
+            continue
+
+        try:
+            results = ld_parser.get_2nd_div(description)
+        except ValueError as parse_err:
+            snapshot[description] = {'error': str(parse_err)}
+        else:
+            snapshot[description] = {key:(value.to_list() if key == 'lookups' else sorted(value)) for key, value in results.items()}
+
+    return snapshot
+
+
+def compare_snapshot(snapshot:Dict[str, dict], snapshot_file:str = SNAPSHOT_FILE) -> List[Tuple[str, dict, dict]]:
+    '''
+    Descriptions whose results differ from the stored snapshot, as
+    (description, stored, current)
+    '''
+    with open(snapshot_file, encoding='UTF-8') as json_file:
+        stored = json.load(json_file)
+
+    differences = []
+    for description in sorted(set(stored) | set(snapshot)):
+        if stored.get(description) != snapshot.get(description):
+            differences.append((description, stored.get(description), snapshot.get(description)))
+
+    return differences
+
+
+def write_snapshot(snapshot:Dict[str, dict], snapshot_file:str = SNAPSHOT_FILE) -> None:
+    '''
+    Store the snapshot, one description per line to keep diffs readable
+    '''
+    with open(snapshot_file, 'w', encoding='UTF-8') as json_file:
+        json_file.write('{\n')
+        lines = [f'{json.dumps(description)}: {json.dumps(snapshot[description], sort_keys=True)}' for description in sorted(snapshot)]
+        json_file.write(',\n'.join(lines))
+        json_file.write('\n}\n')
+
+
+def _print_timings(timings:Dict[str, Dict[str, float]]) -> None:
+    print(f"{'stage':<28}{'count':>8}{'desc/sec':>12}{'p50 us':>10}{'p99 us':>10}")
+    for stage_name, timing in timings.items():
+        print(f"{stage_name:<28}{timing['count']:>8}{timing['per_sec']:>12.0f}{timing['p50_us']:>10.1f}{timing['p99_us']:>10.1f}")
+
+
+def run_parser_benchmark(update_snapshot:bool = False) -> int:
+    '''
+    Time the parser and check its results against the snapshot. Returns
+    the number of descriptions whose results changed.
+    '''
+    descriptions = load_descriptions()
+    print(f'{len(descriptions)} legal descriptions loaded')
+
+    _print_timings(benchmark_parser(descriptions))
+
+    snapshot = snapshot_results(descriptions)
+    if update_snapshot or not os.path.exists(SNAPSHOT_FILE):
+        write_snapshot(snapshot)
+        print(f'Snapshot written: {SNAPSHOT_FILE}')
+        return 0
+
+    differences = compare_snapshot(snapshot)
+    for description, stored, current in differences[:20]:
+        print(f'CHANGED: {description!r}\n    snapshot: {stored}\n    current:  {current}')
+    print(f'{len(differences)} of {len(snapshot)} distinct descriptions differ from the snapshot')
+
+    return len(differences)
+
+
+def make_synthetic_leases(transaction_count:int, rows_per_transaction:int = 3, mismatch_rate:float = 0.01, seed:int = 0) -> pd.DataFrame:
+    '''
+    Lease data with the FIELD_MAPPING columns, rows of the transactions
+    interleaved. A share of the transactions has one record with a
+    different value in one of the UPDATE_FIELDS.
+    '''
+    rng = np.random.default_rng(seed)
+    row_count = transaction_count * rows_per_transaction
+
+    transaction_ids = rng.permutation(np.repeat(np.arange(transaction_count), rows_per_transaction))
+    lease_data = {field: pd.Series(transaction_ids % 97, dtype=object).map(lambda x, field=field: f'{field} {x}') for field in cfg.FIELD_MAPPING}
+    lease_data[cfg.DISSOLVE_FIELD] = pd.Series([f'AG-{transaction_id}' for transaction_id in transaction_ids], dtype=object)
+    lease_data_df = pd.DataFrame(lease_data)
+
+    mismatched_ids = rng.choice(transaction_count, int(transaction_count * mismatch_rate), replace=False)
+    mismatched_rows = pd.Series(np.arange(row_count)).groupby(transaction_ids).first().loc[mismatched_ids].to_numpy()
+    mismatched_fields = rng.choice(cfg.UPDATE_FIELDS, len(mismatched_rows))
+    for row, field in zip(mismatched_rows, mismatched_fields):
+        lease_data_df.iat[row, lease_data_df.columns.get_loc(field)] = None
+
+    return lease_data_df
+
+
+def _legacy_check_lease_update_data(data_df:pd.DataFrame) -> Tuple[pd.DataFrame, List[list]]:
+    '''
+    The per-transaction loop check_lease_update_data replaced, kept as
+    the reference for its results
+    '''
+    error_records = []
+    excel_keys = list(data_df[cfg.DISSOLVE_FIELD].unique())
+
+    for key in excel_keys:
+        records_to_check = data_df.loc[data_df[cfg.DISSOLVE_FIELD] == key]
+
+        mismatched_fields = [field for field in cfg.UPDATE_FIELDS if len(list(records_to_check[field].unique())) > 1]
+
+        if mismatched_fields:
+            for record in records_to_check.values.tolist():
+                record.append(f'Fields mismatch: {mismatched_fields}')
+                error_records.append(record)
+            data_df = data_df.loc[data_df[cfg.DISSOLVE_FIELD] != key]
+
+    return (data_df, error_records)
+
+
+def run_consistency_benchmark(transaction_counts:List[int]) -> int:
+    '''
+    Check check_lease_update_data against the original loop, then time
+    it on each size. Returns 1 if the results differ.
+    '''
+    check_df = make_synthetic_leases(2000, mismatch_rate=0.05)
+    expected_df, expected_errors = _legacy_check_lease_update_data(check_df)
+    checked_df, error_records = ld_checks.check_lease_update_data(check_df)
+
+    if not checked_df.equals(expected_df) or error_records != expected_errors:
+        print('RESULTS DIFFER from the original per-transaction loop')
+        return 1
+    print(f'Results match the original loop ({len(error_records)} error records on 2000 transactions)')
+
+    print(f"{'transactions':>12}{'rows':>10}{'seconds':>10}{'us/transaction':>16}")
+    for transaction_count in transaction_counts:
+        lease_data_df = make_synthetic_leases(transaction_count)
+        start = time.perf_counter()
+        ld_checks.check_lease_update_data(lease_data_df)
+        elapsed = time.perf_counter() - start
+        print(f'{transaction_count:>12}{len(lease_data_df):>10}{elapsed:>10.2f}{elapsed / transaction_count * 1e6:>16.2f}')
+
+    return 0
+
+
+def get_section_origin(first_div:str) -> tuple:
+    '''
+    South west corner of the section of a FRSTDIVID on a flat grid:
+    townships and ranges in 6 section squares from their meridian, and
+    the sections numbered back and forth from the north east corner
+    '''
+    meridian = int(first_div[2:4])
+    township, township_direction = int(first_div[4:7]), first_div[8]
+    range_num, range_direction = int(first_div[9:12]), first_div[13]
+    section = int(first_div[17:19])
+
+    township_y = (township - 1) * TOWNSHIP_SIZE if township_direction == 'N' else -township * TOWNSHIP_SIZE
+    range_x = (range_num - 1) * TOWNSHIP_SIZE if range_direction == 'E' else -range_num * TOWNSHIP_SIZE
+
+    section_row = (section - 1) // 6
+    section_column = (section - 1) % 6
+    if section_row % 2 == 0:
+        section_column = 5 - section_column
+
+    x = meridian * MERIDIAN_OFFSET + range_x + section_column * SECTION_SIZE
+    y = township_y + (5 - section_row) * SECTION_SIZE
+
+    return (x, y)
+
+
+def get_section_lots(section:int) -> dict:
+    '''
+    Lot numbers of a section by the quarter-quarter they replace: along
+    the north of the township (east to west) and down its west side
+    '''
+    north_row = ['NENE', 'NWNE', 'NENW', 'NWNW']
+    west_column = ['NWNW', 'SWNW', 'NWSW', 'SWSW']
+
+    if section in [1, 2, 3, 4, 5]:
+        return {qq: str(lot) for lot, qq in enumerate(north_row, 1)}
+    if section == 6:
+        lots = {qq: str(lot) for lot, qq in enumerate(north_row, 1)}
+        lots.update({qq: str(lot) for lot, qq in enumerate(west_column[1:], 5)})
+        return lots
+    if section in [7, 18, 19, 30, 31]:
+        return {qq: str(lot) for lot, qq in enumerate(west_column, 1)}
+
+    return {}
+
+
+def make_synthetic_plss(store:ld_store.FeatureStore, plss_path:str, first_divs:List[str]) -> int:
+    '''
+    PLSS layer of the sections given, one feature per quarter-quarter or
+    lot (FRSTDIVID, SECDIVNO). Returns the number of features.
+    '''
+    store.create_feature_class(plss_path, fields=[('FRSTDIVID', ld_store.TEXT), ('SECDIVNO', ld_store.TEXT)])
+    qq_size = SECTION_SIZE / 4
+
+    rows = []
+    for first_div in sorted(set(first_divs)):
+        x, y = get_section_origin(first_div)
+        lots = get_section_lots(int(first_div[17:19]))
+        for bit, qq in enumerate(ld_divisions.QUARTER_QUARTERS):
+            cell_x = x + (bit % 4) * qq_size
+            cell_y = y + (3 - bit // 4) * qq_size
+            cell = ld_geometry.polygon_from_extent(cell_x, cell_y, cell_x + qq_size, cell_y + qq_size)
+            rows.append([first_div, lots.get(qq, qq), cell])
+
+    plss_count = store.insert_rows(plss_path, ['FRSTDIVID', 'SECDIVNO', ld_store.SHAPE_TOKEN], rows)
+    store.add_index(plss_path, 'FRSTDIVID')
+
+    return plss_count
+
+
+def make_synthetic_gis_layer(store:ld_store.FeatureStore, layer_path:str, lease_data_df:pd.DataFrame, seed_every:int = 3) -> int:
+    '''
+    GIS layer with the FIELD_MAPPING fields, typed as in the lease layer
+    (LEASE_LAYER_FIELDS), holding the first record of every seed_every-th
+    transaction of the extract (no geometry), so the run has updates as
+    well as adds. Every other one has an out of date lessee. Returns the
+    number of features.
+    '''
+    fields = [LEASE_LAYER_FIELDS[gis_field] for gis_field in cfg.FIELD_MAPPING.values()]
+    store.create_feature_class(layer_path, fields=fields)
+
+    first_records = lease_data_df.drop_duplicates(subset=cfg.DISSOLVE_FIELD)
+    seed_records = first_records.iloc[::seed_every][list(cfg.FIELD_MAPPING)].copy()
+    seed_records.iloc[::2, seed_records.columns.get_loc('Lessee(s)')] = 'PREVIOUS LESSEE'
+    rows = [values + [None] for values in seed_records.values.tolist()]
+
+    return store.insert_rows(layer_path, list(cfg.FIELD_MAPPING.values()) + [ld_store.SHAPE_TOKEN], rows)
+
+
+def run_pipeline_benchmark(excel_file:str, profile:bool = False, dissolve_engine:str = None) -> int:
+    '''
+    Run main end to end on the SQLite store against synthetic layers
+    built for the extract, and time it
+    '''
+    log_folder = os.path.join(PIPELINE_FOLDER, 'logs')
+    report_folder = os.path.join(PIPELINE_FOLDER, 'reports')
+    os.makedirs(log_folder, exist_ok=True)
+    os.makedirs(report_folder, exist_ok=True)
+
+    plss_workspace = os.path.join(PIPELINE_FOLDER, 'plss.sqlite')
+    lease_workspace = os.path.join(PIPELINE_FOLDER, 'lease.sqlite')
+    plss_path = os.path.join(plss_workspace, 'PLSS_Grid')
+    gis_layer = os.path.join(lease_workspace, 'Lease_Layer')
+
+    # The script module sets up its loggers and store from config on import
+    cfg.FEATURE_STORE = ld_store.SQLiteFeatureStore.name
+    cfg.LOG_FILE_FOLDER = log_folder
+    cfg.PLSS = plss_path
+    if dissolve_engine is not None:
+        cfg.DISSOLVE_ENGINE = dissolve_engine
+    import legal_description_to_feature_v2 as tool_script
+
+    # The temp layers are deleted at the end of the run; keep copies in the
+    # lease workspace for the dissolve benchmark
+    get_dissolve_fc = tool_script.get_dissolve_fc
+    def keep_temp_layers(scratch, plss_layer):
+        dissolve_layer = get_dissolve_fc(scratch, plss_layer)
+        for layer, name in [(plss_layer, 'temp_PLSS_features'), (dissolve_layer, 'temp_Dissolve_lyr')]:
+            ld_store.copy_feature_class(tool_script.store, layer.path, tool_script.store, os.path.join(lease_workspace, name))
+        return dissolve_layer
+    tool_script.get_dissolve_fc = keep_temp_layers
+
+    store = ld_store.SQLiteFeatureStore()
+    lease_data_df = ld_excel.read_excel_data(excel_file)
+    first_div_df, _ = ld_checks.check_first_div(lease_data_df)
+
+    ld_store.SQLiteFeatureStore.create_workspace(plss_workspace)
+    plss_count = make_synthetic_plss(store, plss_path, first_div_df[ld_checks.FIRST_DIV].to_list())
+    ld_store.SQLiteFeatureStore.create_workspace(lease_workspace)
+    seed_count = make_synthetic_gis_layer(store, gis_layer, lease_data_df)
+    store.close()
+    print(f'{len(lease_data_df)} Excel records, {plss_count} PLSS features, {seed_count} features in the GIS layer')
+
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    tool_script.main(excel_file, lease_workspace, gis_layer, report_folder)
+    if profiler is not None:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+    tool_script.store.close()
+
+    store = ld_store.SQLiteFeatureStore()
+    shapes = [row[0] for row in store.search(gis_layer, [ld_store.SHAPE_TOKEN]) if row[0] is not None]
+    store.close()
+    print(f'main: {elapsed:.2f} seconds, {len(shapes)} features added, area {sum(shape.area for shape in shapes):.1f}')
+    print(f'Log and audit files: {log_folder}, {report_folder}')
+
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    return 0
+
+
+def rotate_polygon(polygon:ld_geometry.Polygon, degrees:float, origin:tuple) -> ld_geometry.Polygon:
+    ''' Polygon turned counterclockwise about the origin '''
+    angle = math.radians(degrees)
+    cos, sin = math.cos(angle), math.sin(angle)
+    origin_x, origin_y = origin
+
+    def rotate(point:tuple) -> tuple:
+        x, y = point[0] - origin_x, point[1] - origin_y
+        return (origin_x + x * cos - y * sin, origin_y + x * sin + y * cos)
+
+    return ld_geometry.Polygon([[[rotate(point) for point in ring] for ring in part] for part in polygon.parts])
+
+
+def make_dissolve_fixtures() -> Dict[str, Tuple[List[ld_geometry.Polygon], float, int]]:
+    '''
+    Dissolve cases the synthetic PLSS grid does not have, with the area
+    and number of parts of each dissolved: edges off the axes, vertices
+    within the cluster tolerance of each other or of an edge, holes,
+    parts touching at a corner, and overlapping pieces (which take the
+    fallback union). Each case is in a cell of its own, away from the
+    others.
+    '''
+    cases = {}
+
+    def add_case(name:str, pieces:List[ld_geometry.Polygon], area:float, part_count:int, degrees:float = 0) -> None:
+        origin_x = FIXTURE_ORIGIN[0] + len(cases) * FIXTURE_SPACING
+        origin = (origin_x, FIXTURE_ORIGIN[1])
+        pieces = [ld_geometry.Polygon([[[(origin_x + x, FIXTURE_ORIGIN[1] + y) for x, y in ring] for ring in part] for part in piece.parts]) for piece in pieces]
+        if degrees:
+            pieces = [rotate_polygon(piece, degrees, origin) for piece in pieces]
+        cases[name] = (pieces, area, part_count)
+
+    def square(x:float, y:float, width:float = 400, height:float = 400) -> ld_geometry.Polygon:
+        return ld_geometry.polygon_from_extent(x, y, x + width, y + height)
+
+    add_case('rotated_grid', [square(x * 400, y * 400) for x in range(4) for y in range(4)], 2560000, 1, degrees=13)
+    add_case('t_junction_rotated', [square(0, 0, 800, 400), square(0, 400), square(400, 400)], 640000, 1, degrees=7)
+    add_case('gap_within_tolerance', [square(0, 0), square(400.0002, 0)], 320000, 1)
+    add_case('vertex_off_edge', [square(0, 0), ld_geometry.Polygon([[[(400, 0), (800, 0), (800, 400), (400, 400), (400.0003, 200), (400, 0)]]])], 320000, 1)
+    add_case('hole', [square(x * 400, y * 400) for x in range(3) for y in range(3) if (x, y) != (1, 1)], 1280000, 1, degrees=31)
+    add_case('corner_touch', [square(0, 0), square(400, 400)], 320000, 2)
+    add_case('overlap', [square(0, 0), square(200, 0)], 240000, 1)
+    add_case('overlap_rotated', [square(0, 0), square(200, 100)], 260000, 1, degrees=13)
+    add_case('contained', [square(0, 0), square(100, 100, 100, 100)], 160000, 1)
+    add_case('overlap_t_junction', [square(0, 0, 800, 400), square(0, 400), square(400, 400), square(200, 200)], 640000, 1, degrees=7)
+
+    return cases
+
+
+def check_dissolve_fixtures(store:ld_store.FeatureStore, workspace:str) -> int:
+    '''
+    Dissolve the fixtures in process and check each against its area and
+    number of parts. On the arcpy store the fixtures are also written to
+    the workspace and dissolved with PairwiseDissolve, and the in-process
+    result is checked against that too (the SQLite store's dissolve does
+    not union overlapping pieces, so it is not used).
+    Returns the number of fixtures that fail.
+    '''
+    fixtures = make_dissolve_fixtures()
+    reference_shapes = {}
+    if store.name == ld_store.ArcpyFeatureStore.name:
+        fixture_path = os.path.join(workspace, 'temp_Dissolve_fixtures')
+        store.create_feature_class(fixture_path, fields=[(FIXTURE_FIELD, ld_store.TEXT)])
+        rows = [[name, store.from_wkb(piece.to_wkb())] for name, (pieces, _, _) in fixtures.items() for piece in pieces]
+        store.insert_rows(fixture_path, [FIXTURE_FIELD, ld_store.SHAPE_TOKEN], rows)
+        store.dissolve(fixture_path, fixture_path + '_dissolved', FIXTURE_FIELD)
+        reference_shapes = {name: ld_dissolve.to_polygon(store, shape) for name, shape in store.search(fixture_path + '_dissolved', [FIXTURE_FIELD, ld_store.SHAPE_TOKEN])}
+
+    def check(polygon:ld_geometry.Polygon, area:float, part_count:int) -> bool:
+        return len(polygon.parts) == part_count and abs(polygon.area - area) <= area * FIXTURE_AREA_TOLERANCE
+
+    print(f'{"fixture":<22}{"parts":>7}{"area":>16}{"fallback":>10}{"expected":>10}{"pairwise":>10}')
+    failures = 0
+    for name, (pieces, area, part_count) in fixtures.items():
+        polygon, stats = ld_dissolve.dissolve_pieces(pieces, cfg.DISSOLVE_XY_RESOLUTION, cfg.DISSOLVE_XY_TOLERANCE)
+        expected = check(polygon, area, part_count)
+        pairwise = '-'
+        if reference_shapes:
+            reference = reference_shapes[name]
+            matches = check(polygon, reference.area, len(reference.parts))
+            _, same_vertices = ld_dissolve.compare_polygons(polygon, reference, cfg.DISSOLVE_XY_RESOLUTION)
+            pairwise = 'same' if matches and same_vertices else 'close' if matches else 'differs'
+            expected = expected and matches
+        failures += not expected
+        print(f'{name:<22}{len(polygon.parts):>7}{polygon.area:>16.4f}{stats["fallback"]:>10}{"ok" if expected else "FAIL":>10}{pairwise:>10}')
+
+    return failures
+
+
+def run_dissolve_benchmark(store_name:str = ld_store.SQLiteFeatureStore.name, gdb:str = None) -> int:
+    '''
+    Time the in-process dissolve and the store's dissolve on the temp PLSS
+    features of the last pairwise pipeline run, and compare the in-process
+    result of each transaction with the store's. On the SQLite store the
+    reference is the temp dissolve layer of that run; on the arcpy store
+    the features are copied to the gdb and dissolved with
+    PairwiseDissolve. Then checks the dissolve fixtures.
+    Returns the number of transactions and fixtures that differ.
+    '''
+    lease_workspace = os.path.join(PIPELINE_FOLDER, 'lease.sqlite')
+    plss_features_path = os.path.join(lease_workspace, 'temp_PLSS_features')
+    reference_path = os.path.join(lease_workspace, 'temp_Dissolve_lyr')
+    key_field = cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD]
+
+    sqlite_store = ld_store.SQLiteFeatureStore()
+    if not (sqlite_store.exists(plss_features_path) and sqlite_store.exists(reference_path)):
+        print('Run: python ld_benchmark.py pipeline --dissolve-engine pairwise')
+        return 1
+
+    pieces = defaultdict(list)
+    for key, shape in sqlite_store.search(plss_features_path, [key_field, ld_store.SHAPE_TOKEN]):
+        if key is not None and shape is not None:
+            pieces[key].append(shape)
+
+    if store_name == ld_store.ArcpyFeatureStore.name:
+        # Synthetic coordinates in metres, with the resolution and
+        # tolerance of DISSOLVE_XY_RESOLUTION and DISSOLVE_XY_TOLERANCE
+        store = ld_store.ArcpyFeatureStore()
+        store.spatial_reference = ld_store.arcpy.SpatialReference(BENCHMARK_SPATIAL_REFERENCE)
+        workspace = os.path.abspath(gdb)
+        if not store.exists(workspace):
+            store.create_scratch_workspace(os.path.dirname(workspace), os.path.splitext(os.path.basename(workspace))[0])
+        store_features_path = os.path.join(workspace, 'temp_PLSS_features')
+        ld_store.copy_feature_class(sqlite_store, plss_features_path, store, store_features_path)
+        reference_path = os.path.join(workspace, 'temp_Dissolve_benchmark')
+        store_dissolve_path = reference_path
+    else:
+        store = sqlite_store
+        workspace = lease_workspace
+        store_features_path = plss_features_path
+        store_dissolve_path = os.path.join(lease_workspace, 'temp_Dissolve_benchmark')
+
+    start = time.perf_counter()
+    store.dissolve(store_features_path, store_dissolve_path, key_field)
+    store_seconds = time.perf_counter() - start
+    reference_shapes = {key: ld_dissolve.to_polygon(store, shape) for key, shape in store.search(reference_path, [key_field, ld_store.SHAPE_TOKEN])}
+
+    start = time.perf_counter()
+    results = {key: ld_dissolve.dissolve_pieces(key_pieces, cfg.DISSOLVE_XY_RESOLUTION, cfg.DISSOLVE_XY_TOLERANCE) for key, key_pieces in pieces.items()}
+    inprocess_seconds = time.perf_counter() - start
+
+    differences = []
+    fallback_count = 0
+    for key, (polygon, stats) in results.items():
+        fallback_count += stats['fallback']
+        area_difference, same_vertices = ld_dissolve.compare_polygons(polygon, reference_shapes[key], cfg.DISSOLVE_XY_RESOLUTION)
+        if area_difference > cfg.DISSOLVE_XY_RESOLUTION or not same_vertices:
+            differences.append((key, area_difference, same_vertices))
+
+    # The arcpy outputs are left in the gdb to look at in Pro
+    if store is sqlite_store:
+        store.delete(store_dissolve_path)
+
+    piece_count = sum(len(key_pieces) for key_pieces in pieces.values())
+    print(f'{len(pieces)} transactions, {piece_count} PLSS features')
+    print(f'{store.name} store dissolve: {store_seconds:.2f} seconds; in-process: {inprocess_seconds:.2f} seconds, {fallback_count} fallback unions')
+    print(f'{len(differences)} transactions differ in area or vertices')
+    for key, area_difference, same_vertices in differences[:20]:
+        print(f'  {key}: area difference {area_difference}, same vertices: {same_vertices}')
+
+    print()
+    fixture_failures = check_dissolve_fixtures(store, workspace)
+    print(f'{fixture_failures} fixtures fail')
+
+    store.close()
+    if store is not sqlite_store:
+        sqlite_store.close()
+
+    return len(differences) + fixture_failures
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Legal description to feature benchmarks')
+    sub_parsers = arg_parser.add_subparsers(dest='benchmark', required=True)
+
+    parser_args = sub_parsers.add_parser('parser', help='Time the ld_parser stages and check the results snapshot')
+    parser_args.add_argument('--update-snapshot', action='store_true', help='Store the current results as the new snapshot')
+
+    consistency_args = sub_parsers.add_parser('consistency', help='Time the transaction consistency check on synthetic data')
+    consistency_args.add_argument('--sizes', type=int, nargs='+', default=[25000, 50000, 100000, 200000], help='Transaction counts to time')
+
+    pipeline_args = sub_parsers.add_parser('pipeline', help='Run the whole script on the SQLite store with synthetic PLSS data')
+    pipeline_args.add_argument('--excel', default=EXCEL_FILES[1], help='Netsuite extract to run')
+    pipeline_args.add_argument('--profile', action='store_true', help='Print the top functions by cumulative time')
+    pipeline_args.add_argument('--dissolve-engine', choices=['inprocess', 'pairwise'], help='DISSOLVE_ENGINE to run with (default: config)')
+
+    dissolve_args = sub_parsers.add_parser('dissolve', help='Compare the in-process dissolve with the dissolve of the last pairwise pipeline run')
+    dissolve_args.add_argument('--store', choices=['sqlite', 'arcpy'], default='sqlite', help='Store to dissolve with: arcpy runs PairwiseDissolve (needs ArcGIS Pro)')
+    dissolve_args.add_argument('--gdb', default=os.path.join(CACHE_FOLDER, 'dissolve_benchmark.gdb'), help='File gdb for the arcpy store (made if missing)')
+
+    args = arg_parser.parse_args()
+
+    if args.benchmark == 'parser':
+        raise SystemExit(1 if run_parser_benchmark(args.update_snapshot) > 0 else 0)
+    elif args.benchmark == 'consistency':
+        raise SystemExit(run_consistency_benchmark(args.sizes))
+    elif args.benchmark == 'pipeline':
+        raise SystemExit(run_pipeline_benchmark(args.excel, args.profile, args.dissolve_engine))
+    elif args.benchmark == 'dissolve':
+        raise SystemExit(1 if run_dissolve_benchmark(args.store, args.gdb) > 0 else 0)
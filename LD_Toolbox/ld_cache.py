@@ -0,0 +1,253 @@
+'''
+On-disk caches of the legal description parse results and of the
+dissolved PLSS geometries
+
+Results from ld_parser.get_2nd_div are kept in a SQLite file, keyed by
+the canonical form of the description. The whole cache is cleared when
+the patterns, the 'all' exceptions or the parser version change.
+
+The PLSS features of a record's first division and second divisions,
+dissolved into one polygon, are kept as WKB in another SQLite file. That
+cache is cleared when the PLSS layer changes (see
+FeatureStore.get_source_stamp) and trimmed to a size, least recently used
+first.
+'''
+import json
+import pathlib
+import sqlite3
+import time
+from typing import Iterable, Set, Tuple, Union
+
+import ld_parser
+from ld_divisions import SecondDivSet
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class ParseCache:
+    '''
+    Drop-in for ld_parser.get_2nd_div that reuses earlier parses.
+    Parse errors are cached too and raised again as ValueError.
+
+    With read_only (the check_divisions workers) the file is only read:
+    it is not cleared or written on close, and the new parses are handed
+    back with get_new_rows, for the process that owns the cache to add
+    with add_new_rows and save.
+    '''
+    def __init__(self, cache_file:str, read_only:bool = False):
+        self.cache_file = cache_file
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+
+        # New parses are written in one go on close, keeping the write lock short
+        self._new_rows = {}
+        self._use_file = True
+        if read_only:
+            self._conn = sqlite3.connect(f'{pathlib.Path(cache_file).absolute().as_uri()}?mode=ro', uri=True, timeout=30)
+        else:
+            self._conn = sqlite3.connect(cache_file, timeout=30)
+        self._check_source_hash()
+
+    def __str__(self):
+        return f'cache_file: {self.cache_file}; hits: {self.hits}; misses: {self.misses}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check_source_hash(self) -> None:
+        '''
+        Clear out the cached parses if the parser source has changed.
+        Read only, the file is just not used then.
+        '''
+        if self.read_only:
+            try:
+                row = self._conn.execute("SELECT value FROM cache_info WHERE name = 'source_hash'").fetchone()
+            except sqlite3.Error:
+                row = None
+            self._use_file = row is not None and row[0] == ld_parser.get_source_hash()
+            return
+
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache_info (name TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS parse_results (description TEXT PRIMARY KEY, results TEXT, error TEXT)')
+
+        source_hash = ld_parser.get_source_hash()
+        row = self._conn.execute("SELECT value FROM cache_info WHERE name = 'source_hash'").fetchone()
+
+        if row is None or row[0] != source_hash:
+            self._conn.execute('DELETE FROM parse_results')
+            self._conn.execute("INSERT OR REPLACE INTO cache_info (name, value) VALUES ('source_hash', ?)", (source_hash,))
+            self._conn.commit()
+
+    def get_2nd_div(self, search_str:Union[str, None]) -> dict:
+        '''
+        Same contract as ld_parser.get_2nd_div
+        '''
+        # Empty values are an 'ALL' without any parsing, nothing to cache
+        if not isinstance(search_str, str) or len(search_str) == 0:
+            return ld_parser.get_2nd_div(search_str)
+
+        description = ld_parser.canonicalize_description(search_str)
+
+        row = self._new_rows.get(description)
+        if row is None and self._use_file:
+            row = self._conn.execute('SELECT results, error FROM parse_results WHERE description = ?', (description,)).fetchone()
+
+        if row is not None:
+            self.hits += 1
+            if row[1] is not None:
+                raise ValueError(row[1])
+            results = json.loads(row[0])
+            results['lookups'] = SecondDivSet.from_elements(results['lookups'])
+            return results
+
+        self.misses += 1
+        try:
+            results = ld_parser.get_2nd_div(description)
+        except ValueError as parse_err:
+            self._new_rows[description] = (None, str(parse_err))
+            raise
+
+        stored_results = dict(results, lookups=results['lookups'].to_list())
+        self._new_rows[description] = (json.dumps(stored_results), None)
+
+        return results
+
+    def get_new_rows(self) -> dict:
+        ''' Parses made since the cache was opened, by canonical description '''
+        return dict(self._new_rows)
+
+    def add_new_rows(self, new_rows:dict) -> None:
+        ''' Parses from get_new_rows of another ParseCache, saved on close '''
+        self._new_rows.update(new_rows)
+
+    def close(self) -> None:
+        ''' Save the new parses (unless read only) and close the file '''
+        if not self.read_only:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO parse_results VALUES (?, ?, ?)',
+                    [(description, results, error) for description, (results, error) in self._new_rows.items()]
+                    )
+        self._new_rows = {}
+        self._conn.close()
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class GeometryCache:
+    '''
+    Dissolved PLSS geometry (WKB) by first division and second division
+    set. An empty WKB (b'') is kept for the records with no PLSS
+    features. Entries are read up front with load and the new ones
+    written on close, when the file is also trimmed to max_bytes.
+    '''
+    def __init__(self, cache_file:str, source_stamp:str, max_bytes:int):
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._rows = {}
+        self._new_rows = {}
+        self._used_keys = set()
+        self._conn = sqlite3.connect(cache_file, timeout=30)
+        self._check_source_stamp(source_stamp)
+
+    def __str__(self):
+        return f'cache_file: {self.cache_file}; hits: {self.hits}; misses: {self.misses}; evictions: {self.evictions}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def get_key(first_div:str, second_div:SecondDivSet) -> Tuple[str, str]:
+        ''' Same for the same set of second divisions, however it was written '''
+        return (first_div, ','.join(second_div.to_list()))
+
+    def _check_source_stamp(self, source_stamp:str) -> None:
+        ''' Clear out the geometries if the PLSS layer has changed '''
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache_info (name TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS geometries (first_div TEXT, second_div TEXT, wkb BLOB, last_used REAL, '
+            'PRIMARY KEY (first_div, second_div))'
+            )
+
+        row = self._conn.execute("SELECT value FROM cache_info WHERE name = 'source_stamp'").fetchone()
+
+        if row is None or row[0] != source_stamp:
+            self._conn.execute('DELETE FROM geometries')
+            self._conn.execute("INSERT OR REPLACE INTO cache_info (name, value) VALUES ('source_stamp', ?)", (source_stamp,))
+            self._conn.commit()
+
+    def load(self, keys:Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        '''
+        Read the cached geometries of the keys, returns the keys found
+        '''
+        keys = set(keys)
+        first_divs = sorted(set(first_div for first_div, _ in keys))
+        for start in range(0, len(first_divs), 500):
+            batch = first_divs[start:start + 500]
+            rows = self._conn.execute(f'SELECT first_div, second_div, wkb FROM geometries WHERE first_div IN ({", ".join("?" * len(batch))})', batch)
+            for first_div, second_div, wkb in rows:
+                if (first_div, second_div) in keys:
+                    self._rows[(first_div, second_div)] = bytes(wkb)
+
+        return set(key for key in keys if key in self._rows)
+
+    def get(self, key:Tuple[str, str]) -> Union[bytes, None]:
+        '''
+        WKB of the key (b'' for no features), or None if not cached
+        '''
+        wkb = self._rows.get(key)
+        if wkb is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._used_keys.add(key)
+        return wkb
+
+    def put(self, key:Tuple[str, str], wkb:bytes) -> None:
+        self._rows[key] = wkb
+        self._new_rows[key] = wkb
+
+    def _evict(self) -> None:
+        '''
+        Remove the least recently used geometries until the stored WKB
+        fits in max_bytes
+        '''
+        total_bytes = self._conn.execute('SELECT COALESCE(SUM(LENGTH(wkb)), 0) FROM geometries').fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        evict_keys = []
+        for first_div, second_div, wkb_bytes in self._conn.execute('SELECT first_div, second_div, LENGTH(wkb) FROM geometries ORDER BY last_used'):
+            if total_bytes <= self.max_bytes:
+                break
+            evict_keys.append((first_div, second_div))
+            total_bytes -= wkb_bytes
+
+        self._conn.executemany('DELETE FROM geometries WHERE first_div = ? AND second_div = ?', evict_keys)
+        self.evictions += len(evict_keys)
+
+    def close(self) -> None:
+        ''' Save the new geometries, mark the ones used, trim and close the file '''
+        used_time = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO geometries VALUES (?, ?, ?, ?)',
+                [(first_div, second_div, wkb, used_time) for (first_div, second_div), wkb in self._new_rows.items()]
+                )
+            self._conn.executemany(
+                'UPDATE geometries SET last_used = ? WHERE first_div = ? AND second_div = ?',
+                [(used_time, first_div, second_div) for first_div, second_div in self._used_keys]
+                )
+            self._evict()
+        self._new_rows = {}
+        self._used_keys = set()
+        self._conn.close()
@@ -0,0 +1,398 @@
+'''
+First and second division checks of the lease data
+
+Kept free of arcpy so the checks can run in worker processes, see
+check_divisions.
+'''
+import contextlib
+import multiprocessing
+import multiprocessing.spawn
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, Iterator, List, Tuple, Union
+
+import pandas as pd
+
+import config as cfg
+import ld_cache
+import ld_parser
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+FIRST_DIV = 'First_Div'
+SECOND_DIV = 'Second_Div'
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def get_meridian(meridian_num:Union[int, str]) -> str:
+    '''
+    Normalize the meridian number.
+    '''
+    if meridian_num is None:
+        raise ValueError('Empty value value in meridian number')
+
+    meridian = str(meridian_num)
+
+    if not meridian.isdigit():
+        raise ValueError('Improper value in meridian number')
+    elif len(meridian) > 2:
+        raise ValueError('Meridian greater than two digits presented. Unable to process.')
+
+    if len(meridian) == 1:
+        meridian = "0" + meridian
+
+    return meridian
+
+
+def get_township(township_field:str) -> str:
+    '''
+    Normalize the township number
+    '''
+    if township_field is None or not isinstance(township_field, str):
+        raise ValueError('Non-string value presented in township data')
+    elif len(township_field) == 0:
+        raise ValueError('Empty string presented in township data')
+
+    test_string = township_field.lower()
+    test_string = test_string.replace(' ', '')
+
+    if 'n' not in test_string and 's' not in test_string:
+        raise ValueError('No directional value provided in township data')
+
+    if 'n' in test_string:
+        township_direction = 'N'
+        test_string = test_string.replace('n', '')
+    else:
+        township_direction = 'S'
+        test_string = test_string.replace('s', '')
+
+    if '.5' in test_string:
+        township_fraction = '2'
+        test_string = test_string.replace('.5', '')
+    else:
+        township_fraction = '0'
+
+    if not test_string.isdigit():
+        raise ValueError('Unknown characters in township data')
+
+    padding = 3 - len(test_string)
+    township_num = '0' * padding
+    township_num = township_num + test_string
+
+    # format of ID: NNNFD
+        # NNN 3 digits, starting with zero
+        # F fractional - either 0, 2
+        # D directional - either N or S
+
+    township_id = township_num + township_fraction + township_direction
+
+    return township_id
+
+
+def get_range(range_field:str) -> str:
+    '''
+    Normalize the range number
+    '''
+    if range_field is None or not isinstance(range_field, str):
+        raise ValueError('Non-string value presented in range data')
+    elif len(range_field) == 0:
+        raise ValueError('Empty string presented in reange data')
+
+    test_string = range_field.lower()
+    test_string = test_string.replace(' ', '')
+
+    if 'e' not in test_string and 'w' not in test_string:
+        raise ValueError('No directional value provided in range data')
+
+    if 'e' in test_string:
+        range_direction = 'E'
+        test_string = test_string.replace('e', '')
+    else:
+        range_direction = 'W'
+        test_string = test_string.replace('w', '')
+
+    if '.5' in test_string:
+        range_fraction = '2'
+        test_string = test_string.replace('.5', '')
+    else:
+        range_fraction = '0'
+
+    if not test_string.isdigit():
+        raise ValueError('Unknown characters in range data')
+
+    padding = 3 - len(test_string)
+    range_num = '0' * padding
+    range_num = range_num + test_string
+
+    # format of ID: NNNFD
+        # NNN 3 digits, starting with zero
+        # F fractional - either 0, 2
+        # D directional - either N or S
+
+    range_id = range_num + range_fraction + range_direction
+
+    return range_id
+
+
+def get_section(section_num:Union[int, str]) -> str:
+    '''
+    Normalize the section number. Can accept either
+    string or integer input
+    '''
+    if section_num is None:
+        raise ValueError('Empty value value in section number')
+
+    section = str(section_num)
+
+    if not section.isdigit():
+        raise ValueError('Unable to resolve section number to a digit')
+    elif len(section) > 2:
+        raise ValueError('Section greater than two digits presented. Unable to process.')
+
+    if len(section) == 1:
+        section = "0" + section
+
+    return section
+
+
+# Columns making up the first div, with their normalizers, in the order
+# their errors are reported
+FIRST_DIV_FIELDS = [
+    ('Meridian', get_meridian),
+    ('Township', get_township),
+    ('Range', get_range),
+    ('Section#', get_section)
+    ]
+
+
+def check_lease_update_data(data_df:pd.DataFrame) -> Tuple[pd.DataFrame, List[list]]:
+    '''
+    Check the data file records to make sure each transaction
+    has consistent data in the UPDATE_FIELDS. Returns the data less
+    the mismatched transactions, and their records (by transaction,
+    in file order) with the mismatch message appended.
+    '''
+    value_counts = data_df.groupby(cfg.DISSOLVE_FIELD, sort=False)[cfg.UPDATE_FIELDS].nunique(dropna=False)
+    mismatches = value_counts > 1
+    mismatches = mismatches.loc[mismatches.any(axis=1)]
+
+    if mismatches.empty:
+        return (data_df, [])
+
+    error_msgs = {key: f'Fields mismatch: {[field for field in cfg.UPDATE_FIELDS if mismatched[field]]}' for key, mismatched in mismatches.iterrows()}
+    key_order = pd.Series(range(len(mismatches)), index=mismatches.index)
+
+    is_mismatched = data_df[cfg.DISSOLVE_FIELD].isin(mismatches.index)
+    mismatched_df = data_df.loc[is_mismatched]
+    mismatched_df = mismatched_df.iloc[mismatched_df[cfg.DISSOLVE_FIELD].map(key_order).argsort(kind='stable')]
+
+    error_records = mismatched_df.values.tolist()
+    for record, key in zip(error_records, mismatched_df[cfg.DISSOLVE_FIELD]):
+        record.append(error_msgs[key])
+
+    return (data_df.loc[~is_mismatched], error_records)
+
+
+def _normalize_values(values:pd.Series, normalizer:Callable) -> Tuple[list, list]:
+    '''
+    Run the normalizer once per distinct value (by type and value, so 6
+    and '6' stay apart) and map the results back to every row. Returns
+    the normalized values and the error messages, None where not set.
+    '''
+    memo = {}
+    normalized_values = []
+    error_msgs = []
+
+    for value in values:
+        memo_key = (type(value), value)
+        if memo_key not in memo:
+            try:
+                memo[memo_key] = (normalizer(value), None)
+            except ValueError as err:
+                memo[memo_key] = (None, str(err))
+        normalized_value, error_msg = memo[memo_key]
+        normalized_values.append(normalized_value)
+        error_msgs.append(error_msg)
+
+    return normalized_values, error_msgs
+
+
+def check_first_div(data_to_check:pd.DataFrame) -> Tuple[pd.DataFrame, list]:
+    '''
+    Parse the PLSS first div entry out of the data in the dataframe.
+    Return an updated data frame with a First_Div column added, less
+    the records that will not parse. Also return a list of these error
+    records (the record values with the error messages appended).
+    '''
+    normalized = {}
+    column_errors = []
+    for field_name, normalizer in FIRST_DIV_FIELDS:
+        normalized_values, error_msgs = _normalize_values(data_to_check[field_name], normalizer)
+        normalized[field_name] = pd.Series(normalized_values, index=data_to_check.index, dtype=object)
+        column_errors.append(error_msgs)
+
+    error_msgs = ['; '.join(msg for msg in row_errors if msg is not None) for row_errors in zip(*column_errors)]
+    error_msgs = pd.Series(error_msgs, index=data_to_check.index, dtype=object)
+    has_error = error_msgs != ''
+
+    first_div = 'CO' + normalized['Meridian'] + normalized['Township'] + normalized['Range'] + '0SN' + normalized['Section#'] + '0'
+    first_div = first_div.where(~has_error, None)
+
+    error_df = data_to_check.loc[has_error].assign(ErrorMsg = error_msgs[has_error])
+    error_records = error_df.values.tolist()
+
+    updated_df = data_to_check.assign(**{FIRST_DIV: first_div})
+    updated_df = updated_df.loc[~has_error]
+
+    return updated_df, error_records
+
+
+def check_second_div(data_to_check:pd.DataFrame, parse_cache:ld_cache.ParseCache = None) -> pd.DataFrame:
+    '''
+    Check the second div entries and compile list for PLSS check and audit
+    report. Parses go through the parse cache when one is given.
+
+    Returns the data with Second_Div, WarningMsg and ErrorMsg columns added.
+    The message columns are None when there is nothing to report.
+    '''
+    if parse_cache is None:
+        get_2nd_div = ld_parser.get_2nd_div
+    else:
+        get_2nd_div = parse_cache.get_2nd_div
+
+    results_2nd_div = ld_parser.get_2nd_div_many(data_to_check['Legal Description'], get_2nd_div)
+
+    warning_msgs = [
+        None if warning_msg is None else
+        f'AUDIT ONLY: {warning_msg} >> First_Div value: {first_div} Second_Div value(s): {lookups}'
+        for warning_msg, first_div, lookups in zip(results_2nd_div['warnings'], data_to_check[FIRST_DIV], results_2nd_div['lookups'])
+        ]
+
+    checked_df = data_to_check.assign(**{
+        SECOND_DIV: pd.Series(results_2nd_div['lookups'], index=data_to_check.index, dtype=object),
+        'WarningMsg': pd.Series(warning_msgs, index=data_to_check.index, dtype=object),
+        'ErrorMsg': pd.Series(results_2nd_div['errors'], index=data_to_check.index, dtype=object)
+        })
+
+    return checked_df
+
+
+def get_2nd_div_error_records(err_type:str, records:pd.DataFrame, col_names:list) -> list:
+    '''
+    Parse out the records that have error or warning messages. Reorder data
+    to match original data attribute sequence.
+    '''
+    if err_type not in ['WarningMsg', 'ErrorMsg']:
+        raise KeyError(f'Unknown error type presented: {err_type}')
+
+    error_cols = col_names[:]
+    error_cols.append(err_type)
+
+    records_with_errors = records.loc[records[err_type].notna(), error_cols].values.tolist()
+
+    return records_with_errors
+
+
+def _check_partition(data_to_check:pd.DataFrame, cache_file:Union[str, None], instrument:bool) -> Tuple[pd.DataFrame, list, list, int, int, dict, dict]:
+    '''
+    Worker for check_divisions. Returns the checked data, the first div
+    error records and their index labels, the parse cache hits/misses,
+    the parser statistics (None unless instrument is set) and the new
+    parses. The parse cache is only read here, the new parses are saved
+    by the main process, so the workers never wait on each other's
+    write locks.
+    '''
+    if instrument:
+        ld_parser.enable_instrumentation()
+
+    hits = 0
+    misses = 0
+    new_rows = {}
+    if cache_file is None:
+        checked_df, error_records = check_first_div(data_to_check)
+        checked_df = check_second_div(checked_df)
+    else:
+        with ld_cache.ParseCache(cache_file, read_only=True) as parse_cache:
+            checked_df, error_records = check_first_div(data_to_check)
+            checked_df = check_second_div(checked_df, parse_cache)
+            new_rows = parse_cache.get_new_rows()
+        hits = parse_cache.hits
+        misses = parse_cache.misses
+
+    parser_stats = ld_parser.get_instrumentation() if instrument else None
+
+    return checked_df, error_records, _dropped_index(data_to_check, checked_df), hits, misses, parser_stats, new_rows
+
+
+def _dropped_index(data_to_check:pd.DataFrame, checked_df:pd.DataFrame) -> list:
+    '''
+    Index labels of the rows the first div check dropped, in data order
+    '''
+    return data_to_check.index[~data_to_check.index.isin(checked_df.index)].to_list()
+
+
+@contextlib.contextmanager
+def _pool_context() -> Iterator[multiprocessing.context.BaseContext]:
+    '''
+    Spawn context for the worker pool. Inside ArcGIS Pro sys.executable
+    is Pro itself, so the workers are pointed at the environment's
+    python. multiprocessing keeps that executable process-wide, so it is
+    only set while the pool starts its workers and put back after, and
+    the rest of the Pro session keeps its own setting.
+    '''
+    pool_context = multiprocessing.get_context('spawn')
+
+    python_exe = os.path.join(sys.exec_prefix, 'python.exe')
+    if os.name != 'nt' or os.path.basename(sys.executable).lower().startswith('python') or not os.path.exists(python_exe):
+        yield pool_context
+        return
+
+    session_exe = multiprocessing.spawn.get_executable()
+    pool_context.set_executable(python_exe)
+    try:
+        yield pool_context
+    finally:
+        pool_context.set_executable(session_exe)
+
+
+def check_divisions(data_to_check:pd.DataFrame, parse_cache:ld_cache.ParseCache = None, workers:int = 1) -> Tuple[pd.DataFrame, list]:
+    '''
+    Run the first and second division checks. Returns the output of
+    check_second_div and the first div error records.
+
+    With more than one worker the data is split by transaction number and
+    the parts are checked in a process pool. Results are put back in the
+    original row order, so the output is the same as a serial run.
+    '''
+    transaction_codes = pd.factorize(data_to_check[cfg.DISSOLVE_FIELD])[0]
+    workers = min(workers, len(set(transaction_codes)))
+
+    if workers <= 1:
+        checked_df, error_records = check_first_div(data_to_check)
+        checked_df = check_second_div(checked_df, parse_cache)
+        return checked_df, error_records
+
+    # A transaction always lands in one partition
+    partitions = [partition for _, partition in data_to_check.groupby(transaction_codes % workers)]
+    cache_file = None if parse_cache is None else parse_cache.cache_file
+
+    # The workers are all started by the map, inside the pool context
+    with _pool_context() as pool_context, ProcessPoolExecutor(max_workers=workers, mp_context=pool_context) as executor:
+        results = list(executor.map(_check_partition, partitions, repeat(cache_file), repeat(ld_parser.is_instrumented())))
+
+    checked_df = pd.concat([result[0] for result in results])
+    checked_df = checked_df.loc[data_to_check.index[data_to_check.index.isin(checked_df.index)]]
+
+    error_positions = []
+    for _, error_records, error_index, hits, misses, parser_stats, new_rows in results:
+        error_positions.extend(zip(data_to_check.index.get_indexer(error_index), error_records))
+        if parse_cache is not None:
+            parse_cache.hits += hits
+            parse_cache.misses += misses
+            parse_cache.add_new_rows(new_rows)
+        if parser_stats is not None:
+            ld_parser.merge_instrumentation(parser_stats)
+
+    error_records = [error_record for _, error_record in sorted(error_positions, key=lambda item: item[0])]
+
+    return checked_df, error_records
@@ -0,0 +1,222 @@
+'''
+Consolidation of the new records to one record per transaction, the
+checks of the consolidation rules against the GIS layer's fields, and
+the acres reconciliation against the Excel data
+
+Kept free of arcpy, like ld_checks.
+'''
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import ld_store
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+CONSOLIDATION_RULE_NAMES = ['first', 'sum', 'join_unique', 'min', 'max']
+# GIS field types the values of a rule fit in. The other rules keep the
+# values of the Excel column, as 'first' does.
+RULE_FIELD_TYPES = {
+    'sum': [ld_store.DOUBLE, ld_store.LONG],
+    'join_unique': [ld_store.TEXT]
+    }
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def check_rule_fields(field_definitions:List[Tuple[str, str]]) -> List[str]:
+    '''
+    Problems with CONSOLIDATION_RULES for the fields of the GIS layer:
+    unknown rules, and rules whose values do not fit the field type
+    (e.g. join_unique text in a LONG field). Empty if the rules fit.
+    '''
+    field_types = dict(field_definitions)
+
+    problems = []
+    for field_name, rule in cfg.CONSOLIDATION_RULES.items():
+        gis_field = cfg.FIELD_MAPPING.get(field_name)
+        if rule not in CONSOLIDATION_RULE_NAMES:
+            problems.append(f'Unknown consolidation rule for {field_name}: {rule}')
+        elif gis_field in field_types and rule in RULE_FIELD_TYPES and field_types[gis_field] not in RULE_FIELD_TYPES[rule]:
+            problems.append(f'Consolidation rule {rule} for {field_name} does not fit the {field_types[gis_field]} field {gis_field}')
+
+    return problems
+
+
+def check_rule_lengths(data_to_insert:pd.DataFrame, field_lengths:Dict[str, int]) -> List[str]:
+    '''
+    Problems with the join_unique values of the consolidated data that
+    are longer than their GIS text field. Empty if they all fit.
+    '''
+    problems = []
+    for field_name, rule in cfg.CONSOLIDATION_RULES.items():
+        field_length = field_lengths.get(cfg.FIELD_MAPPING.get(field_name))
+        if rule != 'join_unique' or not field_length or field_name not in data_to_insert:
+            continue
+
+        value_lengths = data_to_insert[field_name].dropna().astype(str).str.len()
+        too_long = value_lengths[value_lengths > field_length]
+        if len(too_long) > 0:
+            problems.append(f'Consolidation rule {rule} for {field_name} gives {len(too_long)} values longer than the '
+                            f'{field_length} characters of {cfg.FIELD_MAPPING[field_name]} (longest {too_long.max()}, '
+                            f'transaction {too_long.idxmax()})')
+
+    return problems
+
+
+def get_first_record_index(records_df:pd.DataFrame) -> pd.Series:
+    '''
+    Index label of the first record of each transaction, indexed by the
+    transaction number in order of first appearance
+    '''
+    transaction_keys = records_df[cfg.DISSOLVE_FIELD]
+    is_first = ~transaction_keys.duplicated()
+
+    return pd.Series(records_df.index[is_first.to_numpy()], index=transaction_keys[is_first].to_numpy())
+
+
+def _add_in_order(values:np.ndarray, group_codes:np.ndarray, group_count:int) -> np.ndarray:
+    '''
+    Total of the values in each group (codes 0 to group_count - 1, other
+    codes are left out). The values are added one after the other in
+    their order, so the totals come out exactly as a loop would give
+    them; numpy's float sums are pairwise. Missing values count as zero.
+    '''
+    values = values.astype(object)
+    values[pd.isna(values)] = 0
+
+    in_group = group_codes >= 0
+    if group_count == 0:
+        return np.array([], dtype=object)
+
+    order = np.argsort(group_codes[in_group], kind='stable')
+    group_starts = np.searchsorted(group_codes[in_group][order], np.arange(group_count))
+
+    # On objects reduceat adds strictly left to right
+    return np.add.reduceat(values[in_group][order], group_starts)
+
+
+def get_original_acres(original_data:pd.DataFrame) -> pd.Series:
+    '''
+    Total acres of each transaction in the Excel data, indexed by the
+    transaction number. Missing acres count as zero.
+    '''
+    transaction_codes, transaction_keys = pd.factorize(original_data[cfg.DISSOLVE_FIELD])
+    totals = _add_in_order(original_data[cfg.ACRES_FIELD].to_numpy(), transaction_codes, len(transaction_keys))
+
+    return pd.Series(totals, index=transaction_keys, dtype=object)
+
+
+def _sum_values(values:pd.Series, group_codes:np.ndarray, group_count:int) -> np.ndarray:
+    '''
+    Sum rule: None when a transaction has no values, float when it adds
+    up more than one
+    '''
+    totals = _add_in_order(values.to_numpy(), group_codes, group_count)
+    value_counts = np.bincount(group_codes[values.notna().to_numpy()], minlength=group_count)
+
+    totals[value_counts == 0] = None
+    for position in np.flatnonzero(value_counts > 1):
+        totals[position] = float(totals[position])
+
+    return totals
+
+
+def _join_unique_values(values:pd.Series, group_codes:np.ndarray, group_count:int) -> np.ndarray:
+    '''
+    Join unique rule: the distinct values in record order, joined by
+    CONSOLIDATION_SEPARATOR. A single distinct value is kept as it is, and
+    None is used when a transaction has no values.
+    '''
+    group_values = pd.DataFrame({'code': group_codes, 'value': values.to_numpy(dtype=object)})
+    group_values = group_values.loc[group_values['value'].notna()].drop_duplicates()
+
+    is_single = ~group_values['code'].duplicated(keep=False)
+    multiple_values = group_values.loc[~is_single]
+
+    joined_values = np.full(group_count, None, dtype=object)
+    joined_values[group_values.loc[is_single, 'code'].to_numpy()] = group_values.loc[is_single, 'value'].to_numpy()
+
+    joined = multiple_values['value'].astype(str).groupby(multiple_values['code']).agg(cfg.CONSOLIDATION_SEPARATOR.join)
+    joined_values[joined.index.to_numpy()] = joined.to_numpy()
+
+    return joined_values
+
+
+def _min_max_values(values:pd.Series, group_codes:np.ndarray, group_count:int, rule:str) -> np.ndarray:
+    '''
+    Min or max rule, ignoring missing values. None when a transaction
+    has no values.
+    '''
+    has_value = values.notna().to_numpy()
+
+    # Ranks of the sorted distinct values keep the groupby on integers
+    value_ranks, sorted_values = pd.factorize(values.to_numpy(dtype=object)[has_value], sort=True)
+    group_ranks = pd.Series(value_ranks, index=group_codes[has_value])
+    extreme_ranks = getattr(group_ranks.groupby(level=0), rule)()
+
+    extreme_values = np.full(group_count, None, dtype=object)
+    extreme_values[extreme_ranks.index.to_numpy()] = np.asarray(sorted_values, dtype=object)[extreme_ranks.to_numpy()]
+
+    return extreme_values
+
+
+def consolidate_new_data(new_records:pd.DataFrame, first_record_index:pd.Series = None) -> pd.DataFrame:
+    '''
+    Consolidate the data down to one record per transaction, following
+    CONSOLIDATION_RULES per FIELD_MAPPING column ('first' when not set).
+    Returns the FIELD_MAPPING columns, in order, indexed by transaction
+    number in order of first appearance.
+    '''
+    if first_record_index is None:
+        first_record_index = get_first_record_index(new_records)
+
+    # Codes follow the order of first appearance, same as the first record
+    # index, whose keys are used as factorize turns None into NaN
+    group_codes = pd.factorize(new_records[cfg.DISSOLVE_FIELD], use_na_sentinel=False)[0]
+    transaction_keys = first_record_index.index
+    group_count = len(transaction_keys)
+
+    consolidated = {}
+    for field_name in cfg.FIELD_MAPPING:
+        rule = cfg.CONSOLIDATION_RULES.get(field_name, 'first')
+
+        if rule == 'first':
+            field_values = new_records.loc[first_record_index.to_numpy(), field_name].to_numpy(dtype=object)
+        elif rule == 'sum':
+            field_values = _sum_values(new_records[field_name], group_codes, group_count)
+        elif rule == 'join_unique':
+            field_values = _join_unique_values(new_records[field_name], group_codes, group_count)
+        elif rule in ['min', 'max']:
+            field_values = _min_max_values(new_records[field_name], group_codes, group_count, rule)
+        else:
+            raise ValueError(f'Unknown consolidation rule for {field_name}: {rule}')
+
+        consolidated[field_name] = pd.Series(field_values, index=transaction_keys, dtype=object)
+
+    return pd.DataFrame(consolidated, index=transaction_keys)
+
+
+def check_acres(original_acres:pd.Series, insert_acres:pd.Series, new_records:pd.DataFrame, first_record_index:pd.Series, col_names:List[str]) -> list:
+    '''
+    Check the consolidated acres after the 2nd Div and PLSS processing against the
+    original data import. If any records were dropped due to errors, it will be
+    flagged here.
+
+    insert_acres holds the consolidated acres by transaction number, in insert
+    order. Acres within ACRES_TOLERANCE match; no acres to insert is a mismatch.
+    The error records are the first new record of each mismatched transaction.
+    '''
+    insert_values = pd.to_numeric(insert_acres, errors='coerce')
+    total_original_acres = original_acres.reindex(insert_acres.index, fill_value=0)
+    original_values = pd.to_numeric(total_original_acres, errors='coerce')
+
+    mismatched = insert_values.isna() | ((original_values - insert_values).abs() > cfg.ACRES_TOLERANCE)
+    mismatched_keys = insert_acres.index[mismatched.to_numpy()]
+
+    error_records = new_records.loc[first_record_index[mismatched_keys], col_names].values.tolist()
+    for error_record, key in zip(error_records, mismatched_keys):
+        warning_msg = f'WARNING: Acres mismatch on {key}. Original:{total_original_acres[key]} Insert: {insert_acres[key]}'
+        error_record.append(warning_msg)
+
+    return error_records
@@ -0,0 +1,173 @@
+'''
+Delta mode support: what changed since the last applied extract
+
+Each transaction gets two content hashes, one over the attribute fields
+(UPDATE_FIELDS) and one over the legal description fields (the first
+division fields and the Legal Description, which decide the geometry).
+The hashes of the last successful run are kept in a JSON state file, and
+the transactions of a new extract are classified against them so main
+only works on the ones that changed. Transactions whose legal
+description changed have their geometry rebuilt.
+'''
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+import ld_checks
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Bump when the hashing changes, so old state files are not used
+STATE_VERSION = 1
+
+UNCHANGED = 'unchanged'
+ATTRIBUTES_CHANGED = 'attributes changed'
+LEGAL_CHANGED = 'legal description changed'
+NEW = 'new'
+
+# The fields the PLSS lookup uses; a change to any other field does not
+# change the geometry
+LEGAL_FIELDS = [field for field, _ in ld_checks.FIRST_DIV_FIELDS] + ['Legal Description']
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def get_hash_fields() -> Tuple[List[str], List[str]]:
+    '''
+    The attribute fields and the legal description fields
+    '''
+    attribute_fields = [field for field in cfg.FIELD_MAPPING if field in cfg.UPDATE_FIELDS]
+    legal_fields = [field for field in cfg.FIELD_MAPPING if field in LEGAL_FIELDS]
+
+    return (attribute_fields, legal_fields)
+
+
+def _get_config_hash() -> str:
+    '''
+    Hash of the settings the transaction hashes depend on
+    '''
+    attribute_fields, legal_fields = get_hash_fields()
+    source = json.dumps(
+        {
+            'attributes': attribute_fields,
+            'legal': legal_fields,
+            'key': cfg.DISSOLVE_FIELD,
+            'version': STATE_VERSION,
+            'pandas': pd.__version__
+        },
+        sort_keys=True
+        )
+
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _combine_row_hashes(row_hashes:pd.Series) -> str:
+    '''
+    One hash for the rows of a transaction, independent of the row order
+    '''
+    return hashlib.blake2b(np.sort(row_hashes.to_numpy()).tobytes(), digest_size=8).hexdigest()
+
+
+def get_transaction_hashes(data_df:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Attribute and legal description hashes per transaction. Indexed by
+    the transaction number (as str), columns 'attributes' and 'legal'.
+    '''
+    attribute_fields, legal_fields = get_hash_fields()
+
+    row_hashes = pd.DataFrame(
+        {
+            'key': data_df[cfg.DISSOLVE_FIELD],
+            'attributes': pd.util.hash_pandas_object(data_df[attribute_fields], index=False),
+            'legal': pd.util.hash_pandas_object(data_df[legal_fields], index=False)
+        }
+        )
+    row_hashes = row_hashes.dropna(subset=['key'])
+    row_hashes['key'] = row_hashes['key'].astype(str)
+
+    return row_hashes.groupby('key', sort=False).agg(_combine_row_hashes)
+
+
+def classify_transactions(transaction_hashes:pd.DataFrame, previous_hashes:Dict[str, list]) -> Tuple[pd.Series, List[str]]:
+    '''
+    Status of each transaction against the previous hashes (UNCHANGED,
+    ATTRIBUTES_CHANGED, LEGAL_CHANGED or NEW; a legal description change
+    wins over an attribute change), and the previous transactions that
+    are no longer in the extract.
+    '''
+    previous_df = pd.DataFrame.from_dict(previous_hashes, orient='index', columns=['attributes', 'legal'])
+    previous_df = previous_df.reindex(transaction_hashes.index)
+
+    is_new = previous_df['attributes'].isna()
+    legal_changed = previous_df['legal'] != transaction_hashes['legal']
+    attributes_changed = previous_df['attributes'] != transaction_hashes['attributes']
+
+    status = np.select(
+        [is_new, legal_changed, attributes_changed],
+        [NEW, LEGAL_CHANGED, ATTRIBUTES_CHANGED],
+        default=UNCHANGED
+        )
+    transaction_status = pd.Series(status, index=transaction_hashes.index)
+
+    current_keys = set(transaction_hashes.index)
+    disappeared_keys = [key for key in previous_hashes if key not in current_keys]
+
+    return (transaction_status, disappeared_keys)
+
+
+def get_record_status(data_df:pd.DataFrame, transaction_status:pd.Series) -> pd.Series:
+    '''
+    Transaction status for each record of the DataFrame. Records without
+    a transaction number count as NEW.
+    '''
+    record_keys = data_df[cfg.DISSOLVE_FIELD].where(data_df[cfg.DISSOLVE_FIELD].isna(), data_df[cfg.DISSOLVE_FIELD].astype(str))
+
+    return record_keys.map(transaction_status).fillna(NEW)
+
+
+def keep_previous_hashes(transaction_hashes:pd.DataFrame, previous_hashes:Dict[str, list], keys:Iterable) -> pd.DataFrame:
+    '''
+    Copy of the transaction hashes with the previous hashes put back for
+    the keys, so those transactions show as changed again on the next run
+    '''
+    transaction_hashes = transaction_hashes.copy()
+    for key in keys:
+        key = str(key)
+        if key in previous_hashes and key in transaction_hashes.index:
+            transaction_hashes.loc[key, ['attributes', 'legal']] = previous_hashes[key]
+
+    return transaction_hashes
+
+
+def load_delta_state(state_file:str) -> Dict[str, list]:
+    '''
+    Transaction hashes of the last applied extract. Empty if there is no
+    state file, or it was written with other settings.
+    '''
+    try:
+        with open(state_file, encoding='UTF-8') as json_file:
+            state = json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+    if state.get('config') != _get_config_hash():
+        return {}
+
+    return state.get('transactions', {})
+
+
+def save_delta_state(state_file:str, transaction_hashes:pd.DataFrame) -> None:
+    '''
+    Store the transaction hashes of the extract just applied
+    '''
+    state = {
+        'config': _get_config_hash(),
+        'transactions': {key: [values[0], values[1]] for key, values in zip(transaction_hashes.index, transaction_hashes[['attributes', 'legal']].to_numpy())}
+        }
+
+    temp_file = f'{state_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'w', encoding='UTF-8') as json_file:
+        json.dump(state, json_file)
+    os.replace(temp_file, state_file)
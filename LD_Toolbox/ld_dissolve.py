@@ -0,0 +1,533 @@
+'''
+In-process dissolve of the PLSS features of each transaction
+
+PLSS quarter-quarters and lots share edges, so the features of a
+transaction are dissolved by snapping the coordinates to the XY
+resolution (as integers), then within the cluster tolerance, as
+PairwiseDissolve does: vertices closer than the tolerance are merged,
+and a vertex within the tolerance of another feature's edge is added to
+that edge. Duplicate features are dropped and the edges that run both
+ways cancel. The edges left are walked into the outer rings and holes.
+When the features do not line up (the edges left cross or overlap, or
+rings nest), a general union is used instead.
+
+Replaces the temp feature class, PairwiseDissolve and read back of the
+dissolve output (see DISSOLVE_ENGINE in config.py).
+'''
+import bisect
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import ld_geometry
+import ld_store
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+IntPoint = Tuple[int, int]
+IntRing = List[IntPoint]
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def get_scale(resolution:float) -> int:
+    ''' Grid steps per coordinate unit '''
+    return max(1, round(1 / resolution))
+
+
+def quantize_polygon(polygon:ld_geometry.Polygon, scale:int) -> List[List[IntRing]]:
+    '''
+    Parts of the polygon (exterior, then holes) on the integer grid,
+    repeated points dropped. Rings that collapse are left out, with the
+    part if it is the exterior.
+    '''
+    parts = []
+    for part in polygon.parts:
+        rings = []
+        for ring in part:
+            points = []
+            for x, y in ring:
+                point = (round(x * scale), round(y * scale))
+                if not points or points[-1] != point:
+                    points.append(point)
+            if len(points) >= 4 and points[0] == points[-1]:
+                rings.append(points)
+            elif not rings:
+                break
+        if rings:
+            parts.append(rings)
+
+    return parts
+
+
+def _get_piece_key(rings:List[IntRing]) -> tuple:
+    ''' Same for identical pieces, whatever the ring start points '''
+    ring_keys = []
+    for ring in rings:
+        points = ring[:-1]
+        start = points.index(min(points))
+        ring_keys.append(tuple(points[start:] + points[:start]))
+
+    return tuple(sorted(ring_keys))
+
+
+def _orientation(a:IntPoint, b:IntPoint, c:IntPoint) -> int:
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (value > 0) - (value < 0)
+
+
+def _between(a:IntPoint, b:IntPoint, point:IntPoint) -> bool:
+    ''' Point (collinear with a-b) strictly between a and b '''
+    if a[0] != b[0]:
+        return min(a[0], b[0]) < point[0] < max(a[0], b[0])
+    return min(a[1], b[1]) < point[1] < max(a[1], b[1])
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def get_tolerance_units(tolerance:float, scale:int) -> int:
+    ''' Cluster tolerance in grid steps '''
+    return max(0, round(tolerance * scale))
+
+
+def _cluster_points(points:Iterable[IntPoint], tolerance:int) -> Dict[IntPoint, IntPoint]:
+    '''
+    Map each point to the first point (in sorted order) within the
+    tolerance of it, so vertices that nearly meet become one
+    '''
+    if tolerance <= 0:
+        return {point: point for point in points}
+
+    tolerance_sq = tolerance * tolerance
+    cells = defaultdict(list)
+    point_map = {}
+
+    for point in sorted(set(points)):
+        cell_x, cell_y = point[0] // tolerance, point[1] // tolerance
+        target = next((other for near_x in (cell_x - 1, cell_x, cell_x + 1) for near_y in (cell_y - 1, cell_y, cell_y + 1)
+                       for other in cells.get((near_x, near_y), ())
+                       if (other[0] - point[0]) ** 2 + (other[1] - point[1]) ** 2 <= tolerance_sq), None)
+        if target is None:
+            target = point
+            cells[(cell_x, cell_y)].append(point)
+        point_map[point] = target
+
+    return point_map
+
+
+def _map_rings(rings:List[IntRing], point_map:Dict[IntPoint, IntPoint]) -> List[IntRing]:
+    '''
+    Rings of a piece with the points moved, repeated points dropped.
+    Rings that collapse are left out, with the piece if it is the
+    exterior.
+    '''
+    mapped_rings = []
+    for ring in rings:
+        points = []
+        for point in ring:
+            point = point_map[point]
+            if not points or points[-1] != point:
+                points.append(point)
+        if len(points) >= 4 and points[0] == points[-1]:
+            mapped_rings.append(points)
+        elif not mapped_rings:
+            return []
+
+    return mapped_rings
+
+
+def _snap_to_edges(pieces:List[List[IntRing]], tolerance:int) -> List[List[IntRing]]:
+    '''
+    Add to each edge the vertices lying inside it, or within the
+    tolerance of it (T-junctions), so edges shared only in part or
+    nearly line up end to end
+    '''
+    points = set(point for rings in pieces for ring in rings for point in ring)
+    xs_by_y = defaultdict(list)
+    ys_by_x = defaultdict(list)
+    for x, y in points:
+        xs_by_y[y].append(x)
+        ys_by_x[x].append(y)
+    for values in list(xs_by_y.values()) + list(ys_by_x.values()):
+        values.sort()
+    sorted_ys = sorted(xs_by_y)
+    sorted_xs = sorted(ys_by_x)
+    tolerance_sq = tolerance * tolerance
+
+    def get_inner_points(start:IntPoint, end:IntPoint) -> List[IntPoint]:
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        length_sq = dx * dx + dy * dy
+        x_low, x_high = min(start[0], end[0]) - tolerance, max(start[0], end[0]) + tolerance
+        y_low, y_high = min(start[1], end[1]) - tolerance, max(start[1], end[1]) + tolerance
+
+        # Scan the lines of points across the edge's short side
+        if abs(dx) >= abs(dy):
+            candidates = ((x, y) for y in sorted_ys[bisect.bisect_left(sorted_ys, y_low):bisect.bisect_right(sorted_ys, y_high)]
+                          for x in xs_by_y[y][bisect.bisect_left(xs_by_y[y], x_low):bisect.bisect_right(xs_by_y[y], x_high)])
+        else:
+            candidates = ((x, y) for x in sorted_xs[bisect.bisect_left(sorted_xs, x_low):bisect.bisect_right(sorted_xs, x_high)]
+                          for y in ys_by_x[x][bisect.bisect_left(ys_by_x[x], y_low):bisect.bisect_right(ys_by_x[x], y_high)])
+
+        inner_points = []
+        for point in candidates:
+            if point == start or point == end:
+                continue
+            along = (point[0] - start[0]) * dx + (point[1] - start[1]) * dy
+            across = (point[1] - start[1]) * dx - (point[0] - start[0]) * dy
+            if 0 < along < length_sq and across * across <= tolerance_sq * length_sq:
+                inner_points.append((along, point))
+
+        return [point for _, point in sorted(inner_points)]
+
+    snapped_pieces = []
+    for rings in pieces:
+        snapped_rings = []
+        for ring in rings:
+            snapped_ring = [ring[0]]
+            for start, end in zip(ring, ring[1:]):
+                snapped_ring.extend(get_inner_points(start, end))
+                snapped_ring.append(end)
+            snapped_rings.append(snapped_ring)
+        snapped_pieces.append(snapped_rings)
+
+    return snapped_pieces
+
+
+def _edges_conflict(a:IntPoint, b:IntPoint, c:IntPoint, d:IntPoint) -> bool:
+    '''
+    True if the segments a-b and c-d meet anywhere other than at a
+    shared end point
+    '''
+    o1 = _orientation(a, b, c)
+    o2 = _orientation(a, b, d)
+    o3 = _orientation(c, d, a)
+    o4 = _orientation(c, d, b)
+
+    if o1 == 0 and o2 == 0:
+        # Collinear: a conflict if they overlap for some length
+        return _between(a, b, c) or _between(a, b, d) or _between(c, d, a) or _between(c, d, b) or {a, b} == {c, d}
+    if o1 * o2 < 0 and o3 * o4 < 0:
+        return True
+
+    return ((o1 == 0 and _between(a, b, c)) or (o2 == 0 and _between(a, b, d))
+            or (o3 == 0 and _between(c, d, a)) or (o4 == 0 and _between(c, d, b)))
+
+
+def _has_conflicting_edges(edges:List[Tuple[IntPoint, IntPoint]]) -> bool:
+    ''' Any two edges crossing or overlapping, found by a sweep along x '''
+    boxes = sorted((min(a[0], b[0]), max(a[0], b[0]), min(a[1], b[1]), max(a[1], b[1]), a, b) for a, b in edges)
+
+    for index, (_, xmax, ymin, ymax, a, b) in enumerate(boxes):
+        for other_xmin, _, other_ymin, other_ymax, c, d in boxes[index + 1:]:
+            if other_xmin > xmax:
+                break
+            if other_ymin > ymax or other_ymax < ymin:
+                continue
+            if _edges_conflict(a, b, c, d):
+                return True
+
+    return False
+
+
+def _point_in_rings(point:Tuple[float, float], rings:List[IntRing]) -> bool:
+    ''' Inside the exterior (first ring) and outside its holes '''
+    if not ld_geometry.point_in_ring(point, rings[0]):
+        return False
+
+    return not any(ld_geometry.point_in_ring(point, hole) for hole in rings[1:])
+
+
+def _get_inside_test(pieces:List[List[IntRing]]) -> Callable[[Tuple[float, float]], bool]:
+    '''
+    Test of a point being inside any of the pieces, with the pieces
+    bucketed by extent on a grid of about their typical size
+    '''
+    boxes = []
+    for rings in pieces:
+        x_values = [x for x, _ in rings[0]]
+        y_values = [y for _, y in rings[0]]
+        boxes.append((min(x_values), min(y_values), max(x_values), max(y_values), rings))
+
+    sizes = sorted(max(xmax - xmin, ymax - ymin) for xmin, ymin, xmax, ymax, _ in boxes)
+    cell_size = max(1, sizes[len(sizes) // 2])
+    cells = defaultdict(list)
+    for box in boxes:
+        xmin, ymin, xmax, ymax, _ = box
+        for cell_x in range(xmin // cell_size, xmax // cell_size + 1):
+            for cell_y in range(ymin // cell_size, ymax // cell_size + 1):
+                cells[(cell_x, cell_y)].append(box)
+
+    def is_inside(point:Tuple[float, float]) -> bool:
+        x, y = point
+        return any(xmin <= x <= xmax and ymin <= y <= ymax and _point_in_rings(point, rings)
+                   for xmin, ymin, xmax, ymax, rings in cells.get((int(x // cell_size), int(y // cell_size)), []))
+
+    return is_inside
+
+
+def _has_overlaps(edges:List[Tuple[IntPoint, IntPoint]], is_inside:Callable[[Tuple[float, float]], bool]) -> bool:
+    '''
+    Any edge left by the cancel with a piece on its right side as well
+    as its left, i.e. pieces overlapping. Edges are split at every
+    corner and do not cross, so the side of an edge is the same all
+    along it and is tested off its middle.
+    '''
+    for start, end in edges:
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        length = (dx * dx + dy * dy) ** 0.5
+        right_point = ((start[0] + end[0]) / 2 + dy / length * 0.25, (start[1] + end[1]) / 2 - dx / length * 0.25)
+        if is_inside(right_point):
+            return True
+
+    return False
+
+
+def _assemble(rings:List[IntRing], scale:int, check_nesting:bool) -> Tuple[ld_geometry.Polygon, bool]:
+    '''
+    Polygon from the walked rings: counterclockwise rings are exteriors,
+    clockwise ones holes of the smallest exterior around them. With
+    check_nesting, returns False as well if an exterior sits inside
+    another (outside its holes) or a hole is outside every exterior,
+    which the edge cancel gives for overlapping features.
+    '''
+    exteriors = []
+    holes = []
+    for ring in rings:
+        ring = ld_geometry.remove_collinear_points(ring)
+        if len(ring) < 4:
+            continue
+        ring_area = ld_geometry.signed_area(ring)
+        if ring_area > 0:
+            exteriors.append((ring_area, ring))
+        elif ring_area < 0:
+            holes.append(ring)
+
+    exteriors.sort(key=lambda exterior: exterior[0])
+    parts = [[ring] for _, ring in exteriors]
+
+    is_valid = True
+    for hole in holes:
+        # A point of the hole off the exterior, as points on it may test
+        # either way
+        for part_index, (_, exterior) in enumerate(exteriors):
+            exterior_points = set(exterior)
+            test_points = [point for point in hole[:-1] if point not in exterior_points] or hole[:-1]
+            if ld_geometry.point_in_ring(test_points[0], exterior):
+                parts[part_index].append(hole)
+                break
+        else:
+            is_valid = False
+
+    if check_nesting and is_valid:
+        for index, (_, exterior) in enumerate(exteriors):
+            for other_part in parts[index + 1:]:
+                other_points = set(point for ring in other_part for point in ring)
+                test_points = [point for point in exterior[:-1] if point not in other_points]
+                if test_points and _point_in_rings(test_points[0], other_part):
+                    is_valid = False
+                    break
+            if not is_valid:
+                break
+
+    scaled_parts = [[[(x / scale, y / scale) for x, y in ring] for ring in part] for part in parts]
+
+    return ld_geometry.Polygon(scaled_parts), is_valid
+
+
+def _union_by_arrangement(pieces:List[List[IntRing]], scale:int) -> ld_geometry.Polygon:
+    '''
+    General union: split every edge where it meets another, then keep
+    the pieces of edges with the union on one side only, directed with
+    the union on their left. The sides are tested just off the middle of
+    each piece of the original edge, before crossings are snapped to the
+    grid.
+    '''
+    segments = set()
+    for rings in pieces:
+        for ring in rings:
+            for start, end in zip(ring, ring[1:]):
+                if start != end:
+                    segments.add((min(start, end), max(start, end)))
+
+    # Segment: {point on the grid: position along the segment, 0 to 1}
+    split_points = defaultdict(dict)
+
+    def add_split_point(segment:Tuple[IntPoint, IntPoint], point:IntPoint, position:float) -> None:
+        if 0 < position < 1 and point not in segment:
+            split_points[segment][point] = position
+
+    def get_position(segment:Tuple[IntPoint, IntPoint], point:IntPoint) -> float:
+        (x1, y1), (x2, y2) = segment
+        return ((point[0] - x1) * (x2 - x1) + (point[1] - y1) * (y2 - y1)) / ((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+    boxes = sorted((min(a[0], b[0]), max(a[0], b[0]), min(a[1], b[1]), max(a[1], b[1]), (a, b)) for a, b in segments)
+    for index, (_, xmax, ymin, ymax, segment) in enumerate(boxes):
+        a, b = segment
+        for other_xmin, _, other_ymin, other_ymax, other_segment in boxes[index + 1:]:
+            if other_xmin > xmax:
+                break
+            if other_ymin > ymax or other_ymax < ymin:
+                continue
+            c, d = other_segment
+            for point, owner in [(c, segment), (d, segment), (a, other_segment), (b, other_segment)]:
+                if _orientation(owner[0], owner[1], point) == 0 and _between(owner[0], owner[1], point):
+                    add_split_point(owner, point, get_position(owner, point))
+
+            o1, o2, o3, o4 = _orientation(a, b, c), _orientation(a, b, d), _orientation(c, d, a), _orientation(c, d, b)
+            if o1 * o2 < 0 and o3 * o4 < 0:
+                denominator = (b[0] - a[0]) * (d[1] - c[1]) - (b[1] - a[1]) * (d[0] - c[0])
+                position = ((c[0] - a[0]) * (d[1] - c[1]) - (c[1] - a[1]) * (d[0] - c[0])) / denominator
+                other_position = ((c[0] - a[0]) * (b[1] - a[1]) - (c[1] - a[1]) * (b[0] - a[0])) / denominator
+                crossing = (round(a[0] + position * (b[0] - a[0])), round(a[1] + position * (b[1] - a[1])))
+                add_split_point(segment, crossing, position)
+                add_split_point(other_segment, crossing, other_position)
+
+    is_inside = _get_inside_test(pieces)
+
+    # The same piece of boundary may come from more than one segment
+    edges = Counter()
+    for start, end in segments:
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        length = (dx * dx + dy * dy) ** 0.5
+        offset_x, offset_y = -dy / length * 0.01, dx / length * 0.01
+
+        chain = [(0.0, start)] + sorted((position, point) for point, position in split_points[(start, end)].items()) + [(1.0, end)]
+        for (start_position, sub_start), (end_position, sub_end) in zip(chain, chain[1:]):
+            if sub_start == sub_end:
+                continue
+            middle_position = (start_position + end_position) / 2
+            middle_x, middle_y = start[0] + middle_position * dx, start[1] + middle_position * dy
+
+            left_inside = is_inside((middle_x + offset_x, middle_y + offset_y))
+            right_inside = is_inside((middle_x - offset_x, middle_y - offset_y))
+            if left_inside and not right_inside:
+                edges[(sub_start, sub_end)] = 1
+            elif right_inside and not left_inside:
+                edges[(sub_end, sub_start)] = 1
+
+    polygon, _ = _assemble(ld_geometry.rings_from_edges(edges), scale, check_nesting=False)
+
+    return polygon
+
+
+def dissolve_pieces(polygons:Iterable[ld_geometry.Polygon], resolution:float, tolerance:float) -> Tuple[ld_geometry.Polygon, dict]:
+    '''
+    Union of the polygons snapped to the resolution and within the
+    cluster tolerance. Returns the polygon (empty if every polygon
+    collapses) and counts of the 'pieces', duplicate parts dropped
+    ('duplicates') and whether the 'fallback' union was used (0 or 1).
+    '''
+    scale = get_scale(resolution)
+    tolerance_units = get_tolerance_units(tolerance, scale)
+    stats = {'pieces': 0, 'duplicates': 0, 'fallback': 0}
+
+    # Each part is dissolved as a piece of its own
+    quantized_pieces = []
+    for polygon in polygons:
+        stats['pieces'] += 1
+        quantized_pieces.extend(quantize_polygon(polygon, scale))
+
+    point_map = _cluster_points((point for rings in quantized_pieces for ring in rings for point in ring), tolerance_units)
+
+    unique_pieces = {}
+    for rings in quantized_pieces:
+        rings = _map_rings(rings, point_map)
+        if not rings:
+            continue
+        piece_key = _get_piece_key(rings)
+        if piece_key in unique_pieces:
+            stats['duplicates'] += 1
+        else:
+            unique_pieces[piece_key] = rings
+
+    # Slivers that collapse leave nothing to dissolve
+    if not unique_pieces:
+        return ld_geometry.Polygon([]), stats
+
+    pieces = _snap_to_edges(list(unique_pieces.values()), tolerance_units)
+
+    edge_counts = Counter((start, end) for rings in pieces for ring in rings for start, end in zip(ring, ring[1:]))
+    for start, end in list(edge_counts):
+        shared_count = min(edge_counts[(start, end)], edge_counts.get((end, start), 0))
+        if shared_count:
+            edge_counts[(start, end)] -= shared_count
+            edge_counts[(end, start)] -= shared_count
+    edge_counts = Counter({edge: count for edge, count in edge_counts.items() if count > 0})
+
+    # Edges left twice over, crossing, or with a piece on both sides mean
+    # the features overlap
+    if (all(count == 1 for count in edge_counts.values()) and not _has_conflicting_edges(list(edge_counts))
+            and not _has_overlaps(list(edge_counts), _get_inside_test(pieces))):
+        polygon, is_valid = _assemble(ld_geometry.rings_from_edges(edge_counts), scale, check_nesting=True)
+        if is_valid:
+            return polygon, stats
+
+    stats['fallback'] = 1
+    return _union_by_arrangement(pieces, scale), stats
+
+
+def compare_polygons(polygon:ld_geometry.Polygon, reference:ld_geometry.Polygon, resolution:float) -> Tuple[float, bool]:
+    '''
+    Area difference from the reference, and whether both have the same
+    vertices once snapped to the resolution (points in the middle of
+    straight runs are not counted)
+    '''
+    scale = get_scale(resolution)
+
+    def get_vertices(source:ld_geometry.Polygon) -> set:
+        return set(point for part in quantize_polygon(source, scale) for ring in part for point in ld_geometry.remove_collinear_points(ring))
+
+    return abs(polygon.area - reference.area), get_vertices(polygon) == get_vertices(reference)
+
+
+def to_polygon(store:ld_store.FeatureStore, shape) -> ld_geometry.Polygon:
+    ''' Polygon of a geometry of the store '''
+    if isinstance(shape, ld_geometry.Polygon):
+        return shape
+
+    return ld_geometry.Polygon.from_wkb(store.to_wkb(shape))
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class TransactionDissolver:
+    '''
+    Collects the PLSS features of each transaction as its records are
+    looked up, and dissolves them once the transaction's last record is
+    in. shapes holds the dissolved geometry (of the store) by
+    transaction number as text.
+    '''
+    def __init__(self, store:ld_store.FeatureStore, record_counts:Dict[str, int], resolution:float, tolerance:float):
+        self.store = store
+        self.resolution = resolution
+        self.tolerance = tolerance
+        self.shapes = {}
+        self.stats = Counter()
+        self.seconds = 0.0
+
+        self._remaining = dict(record_counts)
+        self._pieces = defaultdict(list)
+
+    def __str__(self):
+        return (f"transactions: {self.stats['transactions']}; pieces: {self.stats['pieces']}; "
+                f"duplicates: {self.stats['duplicates']}; fallback: {self.stats['fallback']}; seconds: {self.seconds:.2f}")
+
+    def add_record(self, key:str, shapes:list) -> None:
+        '''
+        Features found for one record of the transaction
+        '''
+        self._pieces[key].extend(to_polygon(self.store, shape) for shape in shapes)
+        self._remaining[key] -= 1
+
+        if self._remaining[key] == 0:
+            self._dissolve(key)
+
+    def _dissolve(self, key:str) -> None:
+        pieces = self._pieces.pop(key, [])
+        if not pieces:
+            return
+
+        start = time.perf_counter()
+        polygon, stats = dissolve_pieces(pieces, self.resolution, self.tolerance)
+        if not polygon.is_empty:
+            self.shapes[key] = self.store.from_wkb(polygon.to_wkb())
+        self.seconds += time.perf_counter() - start
+
+        self.stats.update(stats)
+        self.stats['transactions'] += 1
@@ -0,0 +1,139 @@
+'''
+Value type for a set of PLSS second divisions
+
+A section's quarter-quarters are held as a 16 bit mask and its lots as a
+bitset (numbers too big for a lot, e.g. patent numbers picked up by the
+parser, are kept aside in a frozenset), so unions, intersections and duplicate removal are integer
+operations. The sets are hashable and can be used as cache keys. They are
+only expanded to SECDIVNO strings where the PLSS data is queried.
+'''
+from typing import FrozenSet, Iterable, Iterator, List, Union
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Bit order of the quarter-quarters, north to south and west to east
+QUARTER_QUARTERS = [
+    'NWNW', 'NENW', 'NWNE', 'NENE',
+    'SWNW', 'SENW', 'SWNE', 'SENE',
+    'NWSW', 'NESW', 'NWSE', 'NESE',
+    'SWSW', 'SESW', 'SWSE', 'SESE'
+    ]
+QUARTER_QUARTER_BITS = {name:1 << bit for bit, name in enumerate(QUARTER_QUARTERS)}
+
+ALL_VALUE = 'ALL'
+
+# Lot numbers from here on are kept out of the lot bitset
+LOT_BITSET_SIZE = 128
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class SecondDivSet:
+    '''
+    Set of second divisions for a section: quarter-quarters, lot
+    numbers, or the whole section (ALL).
+
+    Iterating gives the SECDIVNO values: quarter-quarters in bit order,
+    then the lots in ascending order.
+    '''
+    __slots__ = ('qq_mask', 'lot_mask', 'other_lots', 'is_all')
+
+    def __init__(self, qq_mask:int = 0, lot_mask:int = 0, is_all:bool = False, other_lots:FrozenSet[int] = frozenset()):
+        self.qq_mask = qq_mask
+        self.lot_mask = lot_mask
+        self.other_lots = other_lots
+        self.is_all = is_all
+
+    @classmethod
+    def from_elements(cls, elements:Iterable[Union[str, int]]) -> 'SecondDivSet':
+        '''
+        Build the set from SECDIVNO style values, e.g. ['NWNE', '3', 4].
+        'ALL' gives the whole section.
+        '''
+        qq_mask = 0
+        lot_mask = 0
+        other_lots = set()
+
+        for element in elements:
+            if element == ALL_VALUE:
+                return cls(is_all=True)
+            elif element in QUARTER_QUARTER_BITS:
+                qq_mask |= QUARTER_QUARTER_BITS[element]
+                continue
+            elif isinstance(element, int):
+                lot_num = element
+            elif isinstance(element, str) and element.isdigit():
+                lot_num = int(element)
+            else:
+                raise ValueError(f'Unknown second division element: {element}')
+
+            if lot_num < LOT_BITSET_SIZE:
+                lot_mask |= 1 << lot_num
+            else:
+                other_lots.add(lot_num)
+
+        return cls(qq_mask, lot_mask, other_lots=frozenset(other_lots))
+
+    def __or__(self, other:'SecondDivSet') -> 'SecondDivSet':
+        if self.is_all or other.is_all:
+            return SecondDivSet(is_all=True)
+        return SecondDivSet(self.qq_mask | other.qq_mask, self.lot_mask | other.lot_mask,
+                            other_lots=self.other_lots | other.other_lots)
+
+    def __and__(self, other:'SecondDivSet') -> 'SecondDivSet':
+        if self.is_all:
+            return SecondDivSet(other.qq_mask, other.lot_mask, other.is_all, other.other_lots)
+        if other.is_all:
+            return SecondDivSet(self.qq_mask, self.lot_mask, self.is_all, self.other_lots)
+        return SecondDivSet(self.qq_mask & other.qq_mask, self.lot_mask & other.lot_mask,
+                            other_lots=self.other_lots & other.other_lots)
+
+    def __eq__(self, other:object) -> bool:
+        if not isinstance(other, SecondDivSet):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __bool__(self) -> bool:
+        return self.is_all or self.qq_mask != 0 or self.lot_mask != 0 or len(self.other_lots) > 0
+
+    def __len__(self) -> int:
+        if self.is_all:
+            return 1
+        return bin(self.qq_mask).count('1') + bin(self.lot_mask).count('1') + len(self.other_lots)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.is_all:
+            yield ALL_VALUE
+            return
+
+        for name, bit in QUARTER_QUARTER_BITS.items():
+            if self.qq_mask & bit:
+                yield name
+
+        lot_mask = self.lot_mask
+        lot_num = 0
+        while lot_mask:
+            if lot_mask & 1:
+                yield str(lot_num)
+            lot_mask >>= 1
+            lot_num += 1
+
+        for lot_num in sorted(self.other_lots):
+            yield str(lot_num)
+
+    def _key(self) -> tuple:
+        return (self.qq_mask, self.lot_mask, self.other_lots, self.is_all)
+
+    def __repr__(self):
+        return f'SecondDivSet({self.to_list()})'
+
+    def __str__(self):
+        return str(self.to_list())
+
+    def to_list(self) -> List[str]:
+        ''' SECDIVNO values as a list '''
+        return list(self)
+
+
+SecondDivSet.ALL = SecondDivSet(is_all=True)
@@ -0,0 +1,254 @@
+'''
+Reading of the Netsuite lease extracts
+
+The workbook is read row by row (openpyxl read-only mode) and only the
+columns used by the script are kept. The script works on the whole
+extract, so the rows are built into one DataFrame.
+
+ExcelSnapshotCache keeps the normalized DataFrame of a workbook on disk,
+so reruns against the same extract skip the Excel parse.
+'''
+import hashlib
+import json
+import mmap
+import os
+import pickle
+from typing import List, Union
+
+import openpyxl
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+import config as cfg
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Bump when the reader changes the DataFrame it builds, so old snapshots are not used
+SNAPSHOT_VERSION = 1
+
+# Rows typed at a time while reading
+BLOCK_ROWS = 10000
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def convert_excel_datatypes(excel_data:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Apply the EXCEL_DATATYPES conversions, then swap the missing values
+    for None in the columns that have any
+    '''
+    for field_name, data_type in cfg.EXCEL_DATATYPES.items():
+        if field_name not in excel_data.columns:
+            continue
+        if data_type == 'Timestamp':
+            excel_data[field_name] = pd.to_datetime(excel_data[field_name]).dt.date
+        else:
+            excel_data[field_name] = excel_data[field_name].astype(data_type)
+
+    return _missing_to_none(excel_data)
+
+
+def _missing_to_none(excel_data:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Swap the missing values for None, only in the columns that have any
+    '''
+    for field_name in excel_data.columns:
+        missing = excel_data[field_name].isna()
+        if missing.any():
+            excel_data[field_name] = excel_data[field_name].astype(object).mask(missing, None)
+
+    return excel_data
+
+
+def _set_numeric_columns(excel_data:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Columns of numbers (some possibly stored as text) get a numeric type,
+    but only when every value in the column converts, as pd.read_excel does
+    '''
+    for field_name in excel_data.columns:
+        if excel_data[field_name].dtype != object:
+            continue
+        try:
+            excel_data[field_name] = pd.to_numeric(excel_data[field_name])
+        except (ValueError, TypeError):
+            continue
+
+    return _missing_to_none(excel_data)
+
+
+def read_excel_data(excel_file:str, columns:List[str] = None) -> pd.DataFrame:
+    '''
+    Rows of the first sheet, limited to the columns given (FIELD_MAPPING
+    columns by default) in their worksheet order, typed the same as a
+    full pd.read_excel of the columns. Blank rows are skipped.
+
+    The cell values go through the same text parser pd.read_excel uses,
+    so blanks and 'N/A' style values are missing as they would be from a
+    full read. Rows are typed in blocks of BLOCK_ROWS, which keeps fewer
+    raw cell values around than typing them all at the end; the result
+    is still the whole extract. Numbers stored as text are converted
+    once the whole column is read.
+    '''
+    if columns is None:
+        columns = list(cfg.FIELD_MAPPING.keys())
+
+    if not os.path.exists(excel_file):
+        raise FileNotFoundError('Unable to find lease data Excel file')
+
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+
+        header = next(rows, ())
+        column_positions = {}
+        for position, heading in enumerate(header):
+            if heading in columns and heading not in column_positions:
+                column_positions[heading] = position
+
+        missing_columns = [column for column in columns if column not in column_positions]
+        if missing_columns:
+            raise ValueError(f'Columns missing from the Excel file: {missing_columns}')
+
+        positions = list(column_positions.values())
+        blocks = []
+        block_rows = []
+
+        for row in rows:
+            values = [row[position] if position < len(row) else None for position in positions]
+            if all(value is None for value in values):
+                continue
+
+            block_rows.append(values)
+            if len(block_rows) == BLOCK_ROWS:
+                blocks.append(_get_block_df(block_rows, list(column_positions)))
+                block_rows = []
+
+        if block_rows or not blocks:
+            blocks.append(_get_block_df(block_rows, list(column_positions)))
+    finally:
+        workbook.close()
+
+    return _set_numeric_columns(pd.concat(blocks, ignore_index=True))
+
+
+def _get_block_df(block_rows:List[list], columns:List[str]) -> pd.DataFrame:
+    '''
+    Typed DataFrame of a block of rows, through the same text parser
+    pd.read_excel uses
+    '''
+    if not block_rows:
+        return pd.DataFrame(columns=columns)
+
+    return convert_excel_datatypes(TextParser(block_rows, names=columns, header=None, dtype=object).read())
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class ExcelSnapshotCache:
+    '''
+    Snapshots of the normalized Excel DataFrame, one file per workbook
+    content and reader config. The least recently used snapshots are
+    removed once the folder is over max_bytes.
+
+    The DataFrames are pickled rather than written to Parquet/Feather as
+    their object columns mix types (e.g. Section# numbers and text, date
+    values, None) that those formats would coerce. Snapshots are read
+    through a memory map.
+    '''
+    SUFFIX = '.snapshot'
+
+    def __init__(self, snapshot_folder:str, max_bytes:int):
+        self.snapshot_folder = snapshot_folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(snapshot_folder, exist_ok=True)
+
+    def __str__(self):
+        return f'snapshot_folder: {self.snapshot_folder}; hits: {self.hits}; misses: {self.misses}'
+
+    @staticmethod
+    def get_snapshot_key(excel_file:str) -> str:
+        '''
+        Hash of the workbook content and the config that shapes the DataFrame
+        '''
+        file_hash = hashlib.sha256()
+        with open(excel_file, 'rb') as source_file:
+            for block in iter(lambda: source_file.read(1 << 20), b''):
+                file_hash.update(block)
+
+        reader_config = json.dumps(
+            {
+                'field_mapping': cfg.FIELD_MAPPING,
+                'datatypes': cfg.EXCEL_DATATYPES,
+                'version': SNAPSHOT_VERSION,
+                'pandas': pd.__version__
+            },
+            sort_keys=True
+            )
+        file_hash.update(reader_config.encode('utf-8'))
+
+        return file_hash.hexdigest()
+
+    def _get_snapshot_file(self, snapshot_key:str) -> str:
+        return os.path.join(self.snapshot_folder, f'{snapshot_key}{self.SUFFIX}')
+
+    def load(self, snapshot_key:str) -> Union[pd.DataFrame, None]:
+        '''
+        The stored DataFrame, or None if there is no usable snapshot
+        '''
+        snapshot_file = self._get_snapshot_file(snapshot_key)
+
+        try:
+            with open(snapshot_file, 'rb') as pickle_file:
+                with mmap.mmap(pickle_file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot_map:
+                    excel_data = pickle.loads(snapshot_map)
+            # Marks the snapshot as recently used for the eviction
+            os.utime(snapshot_file)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return excel_data
+
+    def save(self, snapshot_key:str, excel_data:pd.DataFrame) -> None:
+        '''
+        Store the DataFrame, then trim the folder to max_bytes. A snapshot
+        that cannot be written is skipped.
+        '''
+        snapshot_file = self._get_snapshot_file(snapshot_key)
+        temp_file = f'{snapshot_file}.{os.getpid()}.tmp'
+
+        try:
+            with open(temp_file, 'wb') as pickle_file:
+                pickle.dump(excel_data, pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, snapshot_file)
+        except OSError:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            return
+
+        self._evict(keep_file=snapshot_file)
+
+    def _evict(self, keep_file:str) -> None:
+        '''
+        Remove the least recently used snapshots until the folder fits
+        max_bytes. The snapshot just written is kept regardless.
+        '''
+        snapshots = []
+        for file_name in os.listdir(self.snapshot_folder):
+            if file_name.endswith(self.SUFFIX):
+                snapshot_file = os.path.join(self.snapshot_folder, file_name)
+                file_stat = os.stat(snapshot_file)
+                snapshots.append((file_stat.st_mtime, file_stat.st_size, snapshot_file))
+
+        total_bytes = sum(file_size for _, file_size, _ in snapshots)
+
+        for _, file_size, snapshot_file in sorted(snapshots):
+            if total_bytes <= self.max_bytes:
+                break
+            if snapshot_file == keep_file:
+                continue
+            try:
+                os.remove(snapshot_file)
+                total_bytes -= file_size
+            except OSError:
+                pass
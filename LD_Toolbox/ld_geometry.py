@@ -0,0 +1,326 @@
+'''
+Plain Python polygons for the local feature store
+
+Polygons are read from and written to WKB, and dissolved by cancelling
+the edges that neighbouring polygons share, which is how PLSS cells fit
+together. Rings are kept as lists of (x, y) tuples, closed (last point
+equal to the first), exteriors counterclockwise and holes clockwise.
+'''
+import math
+import struct
+from collections import Counter, defaultdict
+from typing import Iterable, List, Tuple
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+Point = Tuple[float, float]
+Ring = List[Point]
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def signed_area(ring:Ring) -> float:
+    '''
+    Shoelace area of a closed ring, positive when counterclockwise
+    '''
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        area += x1 * y2 - x2 * y1
+
+    return area / 2
+
+
+def _close_ring(ring:Iterable[Point]) -> Ring:
+    closed_ring = [(float(x), float(y)) for x, y in ring]
+    if closed_ring and closed_ring[0] != closed_ring[-1]:
+        closed_ring.append(closed_ring[0])
+
+    return closed_ring
+
+
+def _orient_ring(ring:Ring, counterclockwise:bool) -> Ring:
+    if (signed_area(ring) > 0) != counterclockwise:
+        return ring[::-1]
+
+    return ring
+
+
+def point_in_ring(point:Point, ring:Ring) -> bool:
+    '''
+    Ray casting test; points on the boundary may go either way
+    '''
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            if x < x_cross:
+                inside = not inside
+
+    return inside
+
+
+class Polygon:
+    '''
+    Polygon of one or more parts. Each part is a list of rings, the
+    exterior first, then its holes.
+    '''
+    __slots__ = ('parts',)
+
+    def __init__(self, parts:List[List[Ring]]):
+        self.parts = []
+        for part in parts:
+            if not part:
+                continue
+            exterior = _orient_ring(_close_ring(part[0]), counterclockwise=True)
+            holes = [_orient_ring(_close_ring(hole), counterclockwise=False) for hole in part[1:]]
+            self.parts.append([exterior] + holes)
+
+    def __repr__(self):
+        return f'Polygon(parts={len(self.parts)}, points={self.point_count}, area={self.area})'
+
+    def __eq__(self, other:object) -> bool:
+        if not isinstance(other, Polygon):
+            return NotImplemented
+        return self.canonical_key() == other.canonical_key()
+
+    def __hash__(self) -> int:
+        return hash(self.canonical_key())
+
+    @property
+    def area(self) -> float:
+        return sum(signed_area(ring) for part in self.parts for ring in part)
+
+    @property
+    def point_count(self) -> int:
+        return sum(len(ring) for part in self.parts for ring in part)
+
+    @property
+    def extent(self) -> Tuple[float, float, float, float]:
+        ''' (xmin, ymin, xmax, ymax) '''
+        x_values = [x for part in self.parts for x, _ in part[0]]
+        y_values = [y for part in self.parts for _, y in part[0]]
+
+        return (min(x_values), min(y_values), max(x_values), max(y_values))
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.parts) == 0
+
+    def rings(self) -> Iterable[Ring]:
+        for part in self.parts:
+            yield from part
+
+    def canonical_key(self) -> tuple:
+        '''
+        Same for polygons with the same rings, whatever the start point
+        of each ring or the order of the parts
+        '''
+        ring_keys = []
+        for ring in self.rings():
+            points = ring[:-1]
+            start = points.index(min(points))
+            ring_keys.append(tuple(points[start:] + points[:start]))
+
+        return tuple(sorted(ring_keys))
+
+    def to_wkb(self) -> bytes:
+        '''
+        Little endian WKB, a Polygon for one part, else a MultiPolygon
+        '''
+        part_wkbs = []
+        for part in self.parts:
+            part_wkb = [struct.pack('<BII', 1, WKB_POLYGON, len(part))]
+            for ring in part:
+                part_wkb.append(struct.pack('<I', len(ring)))
+                part_wkb.append(struct.pack(f'<{len(ring) * 2}d', *[value for point in ring for value in point]))
+            part_wkbs.append(b''.join(part_wkb))
+
+        if len(part_wkbs) == 1:
+            return part_wkbs[0]
+
+        return struct.pack('<BII', 1, WKB_MULTIPOLYGON, len(part_wkbs)) + b''.join(part_wkbs)
+
+    @classmethod
+    def from_wkb(cls, wkb:bytes) -> 'Polygon':
+        '''
+        Polygon or MultiPolygon WKB, either byte order. Z and M values
+        (ISO or EWKB flags) are dropped.
+        '''
+        parts, _ = _read_wkb(memoryview(bytes(wkb)), 0)
+
+        return cls(parts)
+
+
+def _read_wkb(wkb:memoryview, offset:int) -> Tuple[List[List[Ring]], int]:
+    '''
+    Parts of the geometry starting at offset, and the offset after it
+    '''
+    byte_order = '<' if wkb[offset] == 1 else '>'
+    geometry_type, = struct.unpack_from(f'{byte_order}I', wkb, offset + 1)
+    offset += 5
+
+    dimensions = 2
+    if geometry_type & 0x80000000:
+        dimensions += 1
+    if geometry_type & 0x40000000:
+        dimensions += 1
+    if geometry_type & 0x20000000:
+        offset += 4
+    geometry_type &= 0x0FFFFFFF
+    if geometry_type > 1000:
+        dimensions += {1: 1, 2: 1, 3: 2}[geometry_type // 1000]
+        geometry_type %= 1000
+
+    if geometry_type == WKB_MULTIPOLYGON:
+        part_count, = struct.unpack_from(f'{byte_order}I', wkb, offset)
+        offset += 4
+        parts = []
+        for _ in range(part_count):
+            polygon_parts, offset = _read_wkb(wkb, offset)
+            parts.extend(polygon_parts)
+        return parts, offset
+
+    if geometry_type != WKB_POLYGON:
+        raise ValueError(f'Unsupported WKB geometry type: {geometry_type}')
+
+    ring_count, = struct.unpack_from(f'{byte_order}I', wkb, offset)
+    offset += 4
+    rings = []
+    for _ in range(ring_count):
+        point_count, = struct.unpack_from(f'{byte_order}I', wkb, offset)
+        offset += 4
+        values = struct.unpack_from(f'{byte_order}{point_count * dimensions}d', wkb, offset)
+        offset += point_count * dimensions * 8
+        rings.append([(values[index], values[index + 1]) for index in range(0, len(values), dimensions)])
+
+    return [rings], offset
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def remove_collinear_points(ring:Ring) -> Ring:
+    '''
+    Drop points in the middle of a straight run of the ring
+    '''
+    points = ring[:-1]
+    changed = True
+    while changed and len(points) > 3:
+        changed = False
+        kept_points = []
+        for index, point in enumerate(points):
+            (x1, y1), (x3, y3) = points[index - 1], points[(index + 1) % len(points)]
+            x2, y2 = point
+            cross = (x2 - x1) * (y3 - y2) - (y2 - y1) * (x3 - x2)
+            dot = (x2 - x1) * (x3 - x2) + (y2 - y1) * (y3 - y2)
+            if cross == 0 and dot > 0:
+                changed = True
+                continue
+            kept_points.append(point)
+        points = kept_points
+
+    return points + points[:1]
+
+
+def _turn_angle(incoming:Point, outgoing:Point) -> float:
+    '''
+    Signed turn from the incoming to the outgoing direction, left positive
+    '''
+    cross = incoming[0] * outgoing[1] - incoming[1] * outgoing[0]
+    dot = incoming[0] * outgoing[0] + incoming[1] * outgoing[1]
+
+    return math.atan2(cross, dot)
+
+
+def rings_from_edges(edges:Counter) -> List[Ring]:
+    '''
+    Walk directed edges into closed rings. Where several edges leave a
+    point, the sharpest left turn is taken, so regions that only touch
+    at a corner come out as separate rings.
+    '''
+    outgoing = defaultdict(list)
+    for (start, end), count in edges.items():
+        outgoing[start].extend([end] * count)
+
+    rings = []
+    for first_point in list(outgoing):
+        while outgoing[first_point]:
+            ring = [first_point]
+            previous_point = first_point
+            current_point = outgoing[first_point].pop()
+
+            while current_point != first_point:
+                ring.append(current_point)
+                candidates = outgoing[current_point]
+                if not candidates:
+                    break
+                incoming = (current_point[0] - previous_point[0], current_point[1] - previous_point[1])
+                next_index = max(range(len(candidates)), key=lambda index: _turn_angle(
+                    incoming, (candidates[index][0] - current_point[0], candidates[index][1] - current_point[1])))
+                previous_point, current_point = current_point, candidates.pop(next_index)
+
+            ring.append(first_point)
+            if len(ring) >= 4:
+                rings.append(ring)
+
+    return rings
+
+
+def polygon_from_rings(rings:List[Ring]) -> Polygon:
+    '''
+    Group rings into parts: counterclockwise rings are exteriors,
+    clockwise ones holes of the smallest exterior around them
+    '''
+    exteriors = []
+    holes = []
+    for ring in rings:
+        ring = remove_collinear_points(ring)
+        if len(ring) < 4:
+            continue
+        ring_area = signed_area(ring)
+        if ring_area > 0:
+            exteriors.append((ring_area, ring))
+        elif ring_area < 0:
+            holes.append(ring)
+
+    exteriors.sort(key=lambda exterior: exterior[0])
+    parts = [[ring] for _, ring in exteriors]
+
+    for hole in holes:
+        for part_index, (_, exterior) in enumerate(exteriors):
+            if any(point_in_ring(point, exterior) for point in hole[:-1]):
+                parts[part_index].append(hole)
+                break
+
+    return Polygon(parts)
+
+
+def dissolve_polygons(polygons:Iterable[Polygon]) -> Polygon:
+    '''
+    Union of polygons that meet along shared edges. Identical polygons
+    are used once; edges running both ways cancel out and the rest are
+    walked into the rings of the result.
+    '''
+    unique_polygons = {polygon.canonical_key(): polygon for polygon in polygons if not polygon.is_empty}
+
+    edges = Counter()
+    for polygon in unique_polygons.values():
+        for ring in polygon.rings():
+            for start, end in zip(ring, ring[1:]):
+                if start != end:
+                    edges[(start, end)] += 1
+
+    for start, end in list(edges):
+        shared_count = min(edges[(start, end)], edges.get((end, start), 0))
+        if shared_count:
+            edges[(start, end)] -= shared_count
+            edges[(end, start)] -= shared_count
+
+    edges = Counter({edge: count for edge, count in edges.items() if count > 0})
+
+    return polygon_from_rings(rings_from_edges(edges))
+
+
+def polygon_from_extent(xmin:float, ymin:float, xmax:float, ymax:float) -> Polygon:
+    ''' Rectangle polygon '''
+    return Polygon([[[(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)]]])
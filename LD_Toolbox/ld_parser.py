@@ -1,11 +1,20 @@
 '''
 '''
+import functools
+import hashlib
+import json
 import re
-from typing import Dict, List, Tuple
+import time
+from fractions import Fraction
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
 
-import ld_patterns
+import ld_pattern_table
+from ld_divisions import SecondDivSet
 
 #<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Bump when a parser change alters results, so stored parses are dropped
+PARSER_VERSION = 4
+
 EXCEPTIONS_FOR_ALLS = [
     'except',
     'execpt',
@@ -20,6 +29,111 @@ EXCEPTIONS_FOR_ALLS = [
 ]
 
 
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class _PatternMatcher:
+    '''
+    Trie built once from a list of words. A string is scanned in a
+    single pass, taking the longest word at each position (so 'E2NE4'
+    wins over 'E2').
+
+    With whole_words set, a match needs a word boundary on both sides,
+    same as wrapping the word in a \\b regex.
+
+    A trie already built by ld_pattern_table.build_trie can be passed
+    in place of the words.
+    '''
+    _END = ld_pattern_table.TRIE_END
+
+    def __init__(self, words:List[str] = None, whole_words:bool = True, trie:dict = None):
+        self.whole_words = whole_words
+        self._root = trie if trie is not None else ld_pattern_table.build_trie(words)
+
+    @staticmethod
+    def _is_word_char(char:str) -> bool:
+        return char.isalnum() or char == '_'
+
+    def _longest_at(self, test_str:str, start:int) -> Tuple[int, str]:
+        '''
+        Longest word starting at the position. Returns (end, word), or
+        (start, None) if nothing matches.
+        '''
+        found = (start, None)
+        node = self._root
+        str_len = len(test_str)
+        position = start
+
+        while position < str_len:
+            node = node.get(test_str[position])
+            if node is None:
+                break
+            position += 1
+            word = node.get(self._END)
+            if word is not None:
+                if not self.whole_words or position == str_len or not self._is_word_char(test_str[position]):
+                    found = (position, word)
+
+        return found
+
+    def find_all(self, test_str:str) -> List[Tuple[int, int, str]]:
+        '''
+        Non-overlapping (start, end, word) matches, left to right
+        '''
+        matches = []
+        str_len = len(test_str)
+        position = 0
+
+        while position < str_len:
+            if self.whole_words and position > 0 and self._is_word_char(test_str[position - 1]):
+                position += 1
+                continue
+
+            end, word = self._longest_at(test_str, position)
+            if word is None:
+                position += 1
+            else:
+                matches.append((position, end, word))
+                position = end
+
+        return matches
+
+    def contains_any(self, test_str:str) -> bool:
+        '''
+        True if any of the words is found in the string
+        '''
+        for position in range(len(test_str)):
+            if self.whole_words and position > 0 and self._is_word_char(test_str[position - 1]):
+                continue
+            if self._longest_at(test_str, position)[1] is not None:
+                return True
+
+        return False
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Aliquot parts, e.g. 'NE', 'NE4', 'NE1/4', 'N', 'N2', 'N1/2'. Quarters
+# are tried before halves so 'NENW' reads as NE of NW.
+R_ALIQUOT_PART = re.compile(r'(NE|NW|SE|SW)(1/4|4)?|([NSEW])(1/2|2)?')
+R_ALIQUOT_TOKEN = re.compile(r'(?<![\w/])[NSEW][\w/]*')
+
+# (east, north) position of each quarter in a 2 x 2 split
+QUARTER_POSITIONS = {
+    'NE': (1, 1),
+    'NW': (0, 1),
+    'SE': (1, 0),
+    'SW': (0, 0)
+    }
+QUARTER_NAMES = {position:name for name, position in QUARTER_POSITIONS.items()}
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Built once at import, shared by every parse. The pattern table is
+# compiled from ld_patterns and stored, so it is only rebuilt on change.
+_PATTERN_TABLE = ld_pattern_table.load_pattern_table()
+_PATTERN_MASKS = _PATTERN_TABLE['masks']
+_KNOWN_PATTERNS = _PatternMatcher(trie=_PATTERN_TABLE['trie'])
+_ALL_EXCEPTIONS = _PatternMatcher(EXCEPTIONS_FOR_ALLS, whole_words=False)
+
+
 #<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
 def _has_exceptions_in_alls(str_to_check:str) -> bool:
     '''
@@ -38,10 +152,7 @@ def _has_exceptions_in_alls(str_to_check:str) -> bool:
 
 
     if 'all' in test_str_lower.lower():
-        for exception in EXCEPTIONS_FOR_ALLS:
-            if exception in test_str_lower:
-                test_results = True
-                break
+        test_results = _ALL_EXCEPTIONS.contains_any(test_str_lower)
     else:
         test_results = False
 
@@ -81,16 +192,122 @@ def _known_pattern_search(test_str:str) -> Tuple[str, List[str]]:
     '''
     '''
     found_patterns = []
-    return_string = test_str
+    remaining_parts = []
+    last_end = 0
 
-    for word in ld_patterns.PATTERNS.keys():
-        if word in test_str:
-            r_key_check = re.compile(rf'\b{word}\b')
-            results = r_key_check.findall(test_str)
+    for start, end, word in _KNOWN_PATTERNS.find_all(test_str):
+        if word not in found_patterns:
+            found_patterns.append(word)
+        remaining_parts.append(test_str[last_end:start])
+        last_end = end
 
-            if results:
-                found_patterns.append(word)
-                return_string = r_key_check.sub('', return_string)
+    remaining_parts.append(test_str[last_end:])
+    return_string = ''.join(remaining_parts)
+
+    return (return_string, found_patterns)
+
+
+def _split_aliquot(token:str) -> Union[List[str], None]:
+    '''
+    Split a chain like 'E2NE4' into its parts ['E', 'NE'], or None if
+    the token is not an aliquot chain. Without any '2'/'4' marker only
+    quarters are accepted, so words like 'NEW' do not resolve.
+    '''
+    parts = []
+    has_marker = False
+    has_half = False
+    position = 0
+
+    while position < len(token):
+        part_match = R_ALIQUOT_PART.match(token, position)
+        if part_match is None or part_match.end() == position:
+            return None
+
+        if part_match.group(1):
+            parts.append(part_match.group(1))
+            has_marker = has_marker or part_match.group(2) is not None
+        else:
+            parts.append(part_match.group(3))
+            has_marker = has_marker or part_match.group(4) is not None
+            has_half = True
+
+        position = part_match.end()
+
+    if has_half and not has_marker:
+        return None
+
+    return parts
+
+
+@functools.lru_cache(maxsize=None)
+def _evaluate_aliquot(token:str) -> Union[Tuple[str, ...], None]:
+    '''
+    Resolve an aliquot chain to the quarter-quarters it covers by
+    subdividing the section, last part first ('E2NE4' is the east half
+    of the NE quarter).
+
+    None if the token is not an aliquot chain, or if the chain goes
+    below a quarter-quarter ('S2NWSE'): it only covers part of those, so
+    it is left for the fall outs rather than resolved to whole ones.
+    '''
+    parts = _split_aliquot(token)
+    if not parts:
+        return None
+
+    # Section as the unit square, x to the east and y to the north
+    west, east, south, north = Fraction(0), Fraction(1), Fraction(0), Fraction(1)
+
+    for part in reversed(parts):
+        mid_x = (west + east) / 2
+        mid_y = (south + north) / 2
+
+        if part in QUARTER_POSITIONS:
+            east_side, north_side = QUARTER_POSITIONS[part]
+            west, east = (mid_x, east) if east_side else (west, mid_x)
+            south, north = (mid_y, north) if north_side else (south, mid_y)
+        elif part == 'N':
+            south = mid_y
+        elif part == 'S':
+            north = mid_y
+        elif part == 'E':
+            west = mid_x
+        else:
+            east = mid_x
+
+    if any((value * 4).denominator != 1 for value in (west, east, south, north)):
+        return None
+
+    # Quarter-quarters are a 4 x 4 grid over the section
+    quarter_quarters = []
+    for row in range(int(north * 4) - 1, int(south * 4) - 1, -1):
+        for col in range(int(west * 4), int(east * 4)):
+            quarter_quarters.append(QUARTER_NAMES[(col % 2, row % 2)] + QUARTER_NAMES[(col // 2, row // 2)])
+
+    return tuple(quarter_quarters)
+
+
+def _aliquot_search(test_str:str) -> Tuple[str, List[str]]:
+    '''
+    Resolve the aliquot chains not in the patterns table, e.g.
+    'E2E2W2NE' or 'E1/2NE1/4'. Returns the remaining string and the
+    quarter-quarters found. Chains smaller than a quarter-quarter stay
+    in the string.
+    '''
+    found_patterns = []
+    remaining_parts = []
+    last_end = 0
+
+    for token_match in R_ALIQUOT_TOKEN.finditer(test_str):
+        quarter_quarters = _evaluate_aliquot(token_match.group())
+        if quarter_quarters is None:
+            continue
+
+        found_patterns.extend(quarter_quarters)
+        remaining_parts.append(test_str[last_end:token_match.start()])
+        last_end = token_match.end()
+
+    remaining_parts.append(test_str[last_end:])
+    return_string = ''.join(remaining_parts)
 
     return (return_string, found_patterns)
 
@@ -127,7 +344,7 @@ def _evaluate_remaining_words(test_str:str) -> Tuple[List[str], List[str], List[
     for word in results:
         if word.isdigit():
             lot_numbers.append(int(word))
-        elif word in ld_patterns.PATTERNS.keys():
+        elif word in _PATTERN_MASKS:
             found_patterns.append(word)
         else:
             fall_out_words.append(word)
@@ -135,36 +352,15 @@ def _evaluate_remaining_words(test_str:str) -> Tuple[List[str], List[str], List[
     return (lot_numbers, found_patterns, fall_out_words)
 
 
-def _fractional_pattern_search(test_str:str) -> Tuple[str, List[str]]:
-    '''
-    '''
-    found_patterns = []
-    return_string = test_str
-
-    r_fractional = re.compile(r'[NSEW]+[1]\/[2,4]')
-
-    results = r_fractional.findall(test_str)
-    found_patterns.extend(results)
-    return_string = r_fractional.sub('', test_str)
-
-    return (return_string, found_patterns)
-
-
 def _parse_for_search_items(test_str:str) -> Dict[str, list]:
     '''
     '''
     lookup_batch = []
+    quarter_quarter_batch = []
     lot_number_batch = []
-    fractional_batch = []
     fall_out_batch = []
 
-    new_str = test_str
-
-    if '½' in new_str:
-        new_str = new_str.replace('½', '1/2')
-    if '¼' in new_str:
-        new_str = new_str.replace('¼', '1/4')
-
+    new_str = canonicalize_description(test_str)
 
     # Searching for patterns that have already been identified
     lookup_results = _known_pattern_search(new_str)
@@ -172,11 +368,10 @@ def _parse_for_search_items(test_str:str) -> Dict[str, list]:
     lookup_batch.extend(lookup_results[1])
 
 
-    # Looks for lookup strings with the format like 'NE1/4', etc.
-    # Drop into the fractional batch for review
-    fractional_results = _fractional_pattern_search(new_str)
-    new_str = fractional_results[0]
-    fractional_batch.extend(fractional_results[1])
+    # Nested halves/quarters the patterns do not list, e.g. 'E2E2W2NE'
+    aliquot_results = _aliquot_search(new_str)
+    new_str = aliquot_results[0]
+    quarter_quarter_batch.extend(aliquot_results[1])
 
 
     # Looks for strings like '1-4', lot/track numbers
@@ -195,29 +390,63 @@ def _parse_for_search_items(test_str:str) -> Dict[str, list]:
 
     return {
             'lookups': lookup_batch,
+            'quarter_quarters': quarter_quarter_batch,
             'lots': lot_number_batch,
-            'fractionals': fractional_batch,
             'fall_outs': fall_out_batch
             }
 
 
+def canonicalize_description(search_str:str) -> str:
+    '''
+    Normalize the legal description to the form the parser works on.
+    Descriptions with the same canonical form parse the same.
+    '''
+    canonical_str = search_str
+
+    if '½' in canonical_str:
+        canonical_str = canonical_str.replace('½', '1/2')
+    if '¼' in canonical_str:
+        canonical_str = canonical_str.replace('¼', '1/4')
+    if '1/' in canonical_str:
+        canonical_str = ld_pattern_table.R_FRACTION_ALIAS.sub(r'\1\2', canonical_str)
+
+    return canonical_str
+
+
+def get_source_hash() -> str:
+    '''
+    Content hash of the patterns, the 'all' exceptions and the parser
+    version. Changes whenever stored parse results may be stale.
+    '''
+    source = json.dumps(
+        {
+            'patterns': ld_pattern_table.get_source_hash(),
+            'exceptions': EXCEPTIONS_FOR_ALLS,
+            'version': PARSER_VERSION
+        },
+        sort_keys=True
+        )
+
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
 def get_2nd_div(search_str:str) -> dict:
     '''
     Parse the legal description from Netsuite.
 
-    Dictionary returned provides a list of lookups ('ALL' if
-    full section), a list of fractional outputs that could not
-    be parsed, and a list of fall outs that do not fit the
-    established patterns.
+    Dictionary returned provides the lookups as a SecondDivSet
+    (SecondDivSet.ALL if full section) and a list of fall outs that
+    do not fit the established patterns (aliquots smaller than a
+    quarter-quarter among them). Fractions like 'NE1/4' are folded to
+    'NE4' by canonicalize_description and resolved with the aliquots.
 '''
     results = {
-        'lookups': [],
-        'fractionals': [],
+        'lookups': SecondDivSet(),
         'fall_outs': []
         }
 
     if _check_for_all_values(search_str):
-        results['lookups'] = ['ALL']
+        results['lookups'] = SecondDivSet.ALL
         return results
 
     # Need to exclude the 'all excepts' from the 2nd div search/parsing
@@ -226,22 +455,177 @@ def get_2nd_div(search_str:str) -> dict:
 
     search_results = _parse_for_search_items(search_str)
 
-    lookup_list = []
+    lookups = SecondDivSet()
 
-    results['fractionals'] = search_results['fractionals']
     results['fall_outs'] = search_results['fall_outs']
 
-    if len(search_results['lookups']) > 0:
-        for lookup_key in search_results['lookups']:
-            lookup_list.extend(ld_patterns.PATTERNS[lookup_key])
+    for lookup_key in search_results['lookups']:
+        lookups |= _PATTERN_MASKS[lookup_key]
 
-    for lot_num in search_results['lots']:
-        lookup_list.append(str(lot_num))
+    lookups |= SecondDivSet.from_elements(search_results['quarter_quarters'])
+    lookups |= SecondDivSet.from_elements(search_results['lots'])
 
-    # Creating a set to remove duplicates, then casting as a list
-    results['lookups'] = list({item for item in lookup_list if item is not None and len(item) > 0})
+    results['lookups'] = lookups
 
-    if len(results['lookups']) == 0:
+    if not lookups:
         raise ValueError('Unable to parse 2nd Division number for this Legal Description')
 
     return results
+
+
+def get_2nd_div_many(search_strs:Iterable[str], parser:Callable[[str], dict] = None) -> Dict[str, list]:
+    '''
+    Parse a batch of legal descriptions, e.g. a pandas Series. Each
+    distinct description is parsed only once.
+
+    Returns columns in the same order as the input: 'lookups' (None
+    when the parse failed), 'warnings' for the fall outs to review,
+    and 'errors'. Nothing is raised; parse errors end up in the
+    'errors' column. The parser defaults to get_2nd_div.
+    '''
+    if parser is None:
+        parser = get_2nd_div
+
+    parsed = {}
+    columns = {
+        'lookups': [],
+        'warnings': [],
+        'errors': []
+        }
+
+    for search_str in search_strs:
+        if search_str not in parsed:
+            lookups = None
+            warning_msg = ''
+            error_msg = None
+
+            try:
+                results = parser(search_str)
+            except ValueError as results_err:
+                error_msg = str(results_err)
+            else:
+                lookups = results['lookups']
+                if len(results['fall_outs']) > 0:
+                    warning_msg = f"{warning_msg}; Review these remnants not processed: {results['fall_outs']}"
+
+            # removed leading '; '
+            parsed[search_str] = (lookups, warning_msg[2:] or None, error_msg)
+
+        lookups, warning_msg, error_msg = parsed[search_str]
+        columns['lookups'].append(lookups)
+        columns['warnings'].append(warning_msg)
+        columns['errors'].append(error_msg)
+
+    return columns
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Opt-in instrumentation of the parse stages. When enabled, the stage
+# functions are swapped for timed wrappers; when disabled the originals
+# run untouched, so there is no cost.
+INSTRUMENTED_STAGES = [
+    'canonicalize_description',
+    '_known_pattern_search',
+    '_aliquot_search',
+    '_lot_list_search',
+    '_evaluate_remaining_words'
+    ]
+
+_original_stages = {}
+_instrumentation = {'stages': {}, 'pattern_keys': {}}
+
+
+def _instrument_stage(stage_name:str, stage_func:Callable[[str], Any]) -> Callable[[str], Any]:
+    '''
+    Wrap a stage to count calls, time and input bytes. Pattern keys
+    found by the stage are counted as well.
+    '''
+    stage_stats = _instrumentation['stages'].setdefault(stage_name, {'calls': 0, 'total_sec': 0.0, 'input_bytes': 0})
+    key_counts = _instrumentation['pattern_keys']
+
+    @functools.wraps(stage_func)
+    def timed_stage(test_str:str) -> Any:
+        start = time.perf_counter()
+        results = stage_func(test_str)
+        stage_stats['total_sec'] += time.perf_counter() - start
+        stage_stats['calls'] += 1
+        stage_stats['input_bytes'] += len(test_str.encode('utf-8'))
+
+        if stage_name in ('_known_pattern_search', '_evaluate_remaining_words'):
+            for pattern_key in results[1]:
+                key_counts[pattern_key] = key_counts.get(pattern_key, 0) + 1
+
+        return results
+
+    return timed_stage
+
+
+def enable_instrumentation() -> None:
+    '''
+    Start collecting stage statistics, from zero
+    '''
+    reset_instrumentation()
+    for stage_name in INSTRUMENTED_STAGES:
+        if stage_name not in _original_stages:
+            _original_stages[stage_name] = globals()[stage_name]
+            globals()[stage_name] = _instrument_stage(stage_name, _original_stages[stage_name])
+
+
+def disable_instrumentation() -> None:
+    '''
+    Put the original stage functions back. Collected statistics are kept.
+    '''
+    for stage_name, stage_func in _original_stages.items():
+        globals()[stage_name] = stage_func
+    _original_stages.clear()
+
+
+def is_instrumented() -> bool:
+    '''
+    True while the stage statistics are being collected
+    '''
+    return len(_original_stages) > 0
+
+
+def reset_instrumentation() -> None:
+    '''
+    Zero the collected statistics
+    '''
+    for stage_stats in _instrumentation['stages'].values():
+        stage_stats.update({'calls': 0, 'total_sec': 0.0, 'input_bytes': 0})
+    _instrumentation['pattern_keys'].clear()
+
+
+def get_instrumentation() -> Dict[str, dict]:
+    '''
+    Copy of the statistics: per stage calls, total_sec and input_bytes,
+    and how often each pattern key matched (most frequent first)
+    '''
+    key_counts = sorted(_instrumentation['pattern_keys'].items(), key=lambda item: (-item[1], item[0]))
+
+    return {
+        'stages': {stage_name:dict(stage_stats) for stage_name, stage_stats in _instrumentation['stages'].items()},
+        'pattern_keys': dict(key_counts)
+        }
+
+
+def merge_instrumentation(stats:Dict[str, dict]) -> None:
+    '''
+    Add statistics collected elsewhere, e.g. in a worker process
+    '''
+    for stage_name, stage_stats in stats['stages'].items():
+        totals = _instrumentation['stages'].setdefault(stage_name, {'calls': 0, 'total_sec': 0.0, 'input_bytes': 0})
+        for stat_name, value in stage_stats.items():
+            totals[stat_name] += value
+
+    key_counts = _instrumentation['pattern_keys']
+    for pattern_key, count in stats['pattern_keys'].items():
+        key_counts[pattern_key] = key_counts.get(pattern_key, 0) + count
+
+
+def dump_instrumentation(json_file:str) -> None:
+    '''
+    Write the statistics to a JSON file
+    '''
+    with open(json_file, 'w', encoding='UTF-8') as stats_file:
+        json.dump(get_instrumentation(), stats_file, indent=2)
@@ -0,0 +1,160 @@
+'''
+Build step for the pattern table used by ld_parser
+
+The PATTERNS in ld_patterns are validated, canonicalized (upper case,
+'½'/'¼' and 'E1/2' style fractions folded to 'E2') and compiled into the
+matcher trie and SecondDivSet masks. The result is stored as a pickle next
+to ld_patterns and reused while the source hash matches; it is rebuilt
+automatically after PATTERNS or ld_divisions change.
+
+Run this module directly to force a rebuild.
+'''
+import hashlib
+import json
+import os
+import pickle
+import re
+from typing import Dict, List, Tuple
+
+import ld_divisions
+import ld_patterns
+from ld_divisions import SecondDivSet
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Bump when the build or the canonical form changes
+TABLE_VERSION = 1
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(ld_patterns.__file__)), 'ld_patterns.table')
+
+R_FRACTION_ALIAS = re.compile(r'([NSEW])1/([24])')
+TRIE_END = None
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def canonicalize_key(key:str) -> str:
+    '''
+    Canonical form of an aliquot, e.g. 'ne1/4' and 'NE¼' become 'NE4'
+    '''
+    canonical_key = key.upper().replace('½', '1/2').replace('¼', '1/4')
+    return R_FRACTION_ALIAS.sub(r'\1\2', canonical_key)
+
+
+def build_trie(words:List[str]) -> dict:
+    '''
+    Character trie of the words; the TRIE_END entry of a node holds the
+    word ending there
+    '''
+    root = {}
+
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[TRIE_END] = word
+
+    return root
+
+
+def get_source_hash(patterns:Dict[str, list] = None) -> str:
+    '''
+    Content hash of the patterns, the table version and the source of
+    ld_divisions. The table holds pickled SecondDivSet masks, so a change
+    to their layout rebuilds it as well.
+    '''
+    if patterns is None:
+        patterns = ld_patterns.PATTERNS
+
+    with open(ld_divisions.__file__, 'rb') as divisions_file:
+        divisions_hash = hashlib.sha256(divisions_file.read()).hexdigest()
+
+    source = json.dumps({'patterns': patterns, 'version': TABLE_VERSION, 'divisions': divisions_hash}, sort_keys=True)
+
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _validate_patterns(patterns:Dict[str, list]) -> Dict[str, Tuple[str, list]]:
+    '''
+    Check the patterns and fold them to their canonical keys. Returns the
+    canonical key mapped to (source key, elements).
+    '''
+    canonical_patterns = {}
+
+    for key, value in patterns.items():
+        if not isinstance(value, list):
+            raise TypeError('Pattern values must be list of elements')
+
+        for element in value:
+            if not isinstance(element, str) or len(element) > 4:
+                raise ValueError(f'Element(s) seems to be misformed: {key}:{value}. Check that each is a separate string')
+
+        canonical_key = canonicalize_key(key)
+        if canonical_key in canonical_patterns:
+            other_key, other_value = canonical_patterns[canonical_key]
+            if sorted(other_value) != sorted(value):
+                raise ValueError(f'Patterns {other_key} and {key} are the same aliquot with different elements')
+        else:
+            canonical_patterns[canonical_key] = (key, value)
+
+    return canonical_patterns
+
+
+def build_pattern_table(patterns:Dict[str, list] = None) -> dict:
+    '''
+    Validate and compile the patterns. The table holds the source hash,
+    the canonical keys with their SecondDivSet masks and the matcher trie.
+    '''
+    if patterns is None:
+        patterns = ld_patterns.PATTERNS
+
+    canonical_patterns = _validate_patterns(patterns)
+
+    masks = {}
+    for canonical_key, (key, value) in canonical_patterns.items():
+        try:
+            masks[canonical_key] = SecondDivSet.from_elements(value)
+        except ValueError as element_err:
+            raise ValueError(f'Pattern {key}: {element_err}') from element_err
+
+    return {
+        'source_hash': get_source_hash(patterns),
+        'masks': masks,
+        'trie': build_trie(list(masks.keys()))
+        }
+
+
+def load_pattern_table(table_file:str = TABLE_FILE) -> dict:
+    '''
+    Load the stored pattern table, rebuilding it if it is missing or out
+    of date. A table that cannot be saved is still returned.
+    '''
+    source_hash = get_source_hash()
+
+    try:
+        with open(table_file, 'rb') as pickle_file:
+            pattern_table = pickle.load(pickle_file)
+        if pattern_table.get('source_hash') == source_hash:
+            return pattern_table
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    pattern_table = build_pattern_table()
+
+    # Written to a temp file first so a concurrent load never sees half a table
+    temp_file = f'{table_file}.{os.getpid()}.tmp'
+    try:
+        with open(temp_file, 'wb') as pickle_file:
+            pickle.dump(pattern_table, pickle_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, table_file)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    return pattern_table
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+if __name__ == '__main__':
+    if os.path.exists(TABLE_FILE):
+        os.remove(TABLE_FILE)
+    table = load_pattern_table()
+    print(f'{len(ld_patterns.PATTERNS)} patterns compiled to {len(table["masks"])} canonical keys: {TABLE_FILE}')
@@ -0,0 +1,188 @@
+'''
+PLSS lookups for the new records
+
+PLSSIndex keeps the PLSS features in memory by (FRSTDIVID, SECDIVNO).
+A first division is read the first time a record asks for it, together
+with the rest of its batch (the next first divisions the records need,
+read with one FRSTDIVID IN (...) query), so the records of a township
+mostly never go back to the PLSS layer. The least recently used first
+divisions are dropped once the index is over its memory cap.
+'''
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+import ld_store
+from ld_divisions import SecondDivSet
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+FIRST_DIV_FIELD = 'FRSTDIVID'
+SECOND_DIV_FIELD = 'SECDIVNO'
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+def _sql_list(values:Iterable[str]) -> str:
+    ''' Quoted, comma separated values for an IN clause '''
+    return ', '.join("'" + str(value).replace("'", "''") + "'" for value in values)
+
+
+def get_record_query(first_div:str, second_div:SecondDivSet) -> str:
+    '''
+    Where clause for the PLSS features of one record, as used in the
+    messages of the records not found
+    '''
+    first_div_query = f'{FIRST_DIV_FIELD} = {_sql_list([first_div])}'
+    second_div_values = second_div.to_list()
+
+    if second_div.is_all:
+        return first_div_query
+    elif len(second_div_values) == 1:
+        return f'{first_div_query} AND {SECOND_DIV_FIELD} = {_sql_list(second_div_values)}'
+
+    return f'{first_div_query} AND {SECOND_DIV_FIELD} IN ({_sql_list(second_div_values)})'
+
+
+class PLSSIndex:
+    '''
+    PLSS features by (FRSTDIVID, SECDIVNO), loaded a first division at a
+    time and kept up to max_bytes (estimated geometry size). Counters:
+    hits and misses of first division lookups, evictions, and queries
+    made on the PLSS layer.
+    '''
+    def __init__(self, store:ld_store.FeatureStore, plss_path:str, max_bytes:int, batch_size:int):
+        self.store = store
+        self.plss_path = plss_path
+        self.max_bytes = max_bytes
+        self.batch_size = max(1, batch_size)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.query_count = 0
+        self.loaded_bytes = 0
+
+        # (FRSTDIVID, SECDIVNO): [(layer row number, geometry)]
+        self._features = {}
+        # FRSTDIVID: (SECDIVNO values, bytes), least recently used first
+        self._first_divs = OrderedDict()
+        self._errors = {}
+        self._batches = {}
+        self._row_number = 0
+
+    def __str__(self):
+        return (f'plss_path: {self.plss_path}; hits: {self.hits}; misses: {self.misses}; '
+                f'evictions: {self.evictions}; queries: {self.query_count}; loaded: {self.loaded_bytes} bytes')
+
+    def plan_batches(self, first_divs:Iterable[str]) -> None:
+        '''
+        Group the first divisions the records will ask for, in order of
+        first need, into the batches read together
+        '''
+        ordered_first_divs = list(dict.fromkeys(first_divs))
+        for start in range(0, len(ordered_first_divs), self.batch_size):
+            batch = ordered_first_divs[start:start + self.batch_size]
+            for first_div in batch:
+                self._batches[first_div] = batch
+
+    def _read_first_divs(self, first_divs:List[str]) -> Dict[str, list]:
+        '''
+        (SECDIVNO, row number, geometry) rows of each first division
+        '''
+        rows = {first_div: [] for first_div in first_divs}
+        where = f'{FIRST_DIV_FIELD} IN ({_sql_list(first_divs)})'
+
+        self.query_count += 1
+        for first_div, second_div, shape in self.store.search(self.plss_path, [FIRST_DIV_FIELD, SECOND_DIV_FIELD, ld_store.SHAPE_TOKEN], where):
+            rows[first_div].append((second_div, self._row_number, shape))
+            self._row_number += 1
+
+        return rows
+
+    def _add_first_div(self, first_div:str, rows:list, first_div_bytes:int) -> None:
+        second_div_values = []
+        for second_div, row_number, shape in rows:
+            key = (first_div, second_div)
+            if key not in self._features:
+                self._features[key] = []
+                second_div_values.append(second_div)
+            self._features[key].append((row_number, shape))
+
+        self._first_divs[first_div] = (second_div_values, first_div_bytes)
+        self.loaded_bytes += first_div_bytes
+
+    def _evict(self, keep_first_div:str) -> None:
+        ''' Drop the least recently used first divisions down to max_bytes '''
+        for first_div in list(self._first_divs):
+            if self.loaded_bytes <= self.max_bytes:
+                break
+            if first_div == keep_first_div:
+                continue
+
+            second_div_values, first_div_bytes = self._first_divs.pop(first_div)
+            for second_div in second_div_values:
+                del self._features[(first_div, second_div)]
+            self.loaded_bytes -= first_div_bytes
+            self.evictions += 1
+
+    def _load(self, first_div:str) -> None:
+        '''
+        Read the first division with the rest of its batch not in memory.
+        If the batch query fails, the first divisions are read one at a
+        time, and the errors of those that fail on their own are kept.
+        '''
+        batch = [batch_first_div for batch_first_div in self._batches.get(first_div, [first_div])
+                 if batch_first_div not in self._first_divs and batch_first_div not in self._errors]
+        if first_div not in batch:
+            batch.append(first_div)
+
+        try:
+            batch_rows = self._read_first_divs(batch)
+        except RuntimeError as run_err:
+            if len(batch) == 1:
+                self._errors[first_div] = str(run_err)
+                return
+            batch_rows = {}
+            for batch_first_div in batch:
+                try:
+                    batch_rows.update(self._read_first_divs([batch_first_div]))
+                except RuntimeError as run_err:
+                    self._errors[batch_first_div] = str(run_err)
+
+        # The rest of the batch is only kept while it fits, it does not
+        # push out first divisions already in use
+        for batch_first_div, rows in batch_rows.items():
+            rows_bytes = sum(self.store.geometry_size(shape) for _, _, shape in rows)
+            if batch_first_div == first_div:
+                first_div_bytes = rows_bytes
+            elif self.loaded_bytes + rows_bytes <= self.max_bytes:
+                self._add_first_div(batch_first_div, rows, rows_bytes)
+        if first_div in batch_rows:
+            self._add_first_div(first_div, batch_rows[first_div], first_div_bytes)
+
+        self._evict(keep_first_div=first_div)
+
+    def get_shapes(self, first_div:str, second_div:SecondDivSet) -> list:
+        '''
+        PLSS geometries of the first division's second divisions (all of
+        them for ALL), in PLSS layer order. Raises RuntimeError if the
+        first division could not be read.
+        '''
+        if first_div in self._first_divs:
+            self.hits += 1
+            self._first_divs.move_to_end(first_div)
+        else:
+            self.misses += 1
+            if first_div not in self._errors:
+                self._load(first_div)
+            if first_div in self._errors:
+                raise RuntimeError(self._errors[first_div])
+
+        if second_div.is_all:
+            second_div_values = self._first_divs[first_div][0]
+        else:
+            second_div_values = second_div.to_list()
+
+        features = []
+        for second_div_value in second_div_values:
+            features.extend(self._features.get((first_div, second_div_value), []))
+
+        return [shape for _, shape in sorted(features, key=lambda feature: feature[0])]
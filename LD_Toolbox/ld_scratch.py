@@ -0,0 +1,224 @@
+'''
+Temp layers of a run
+
+ScratchWorkspace gives each temp layer a name unique to the run, so runs
+against the same geodatabase do not collide. Layers go in the memory
+workspace of the store while the run's temp layers fit in its memory
+budget; past that they go in a scratch workspace made for the run next
+to the output geodatabase. A layer filling up in memory is moved to the
+scratch workspace as it passes the budget. All the layers, and the
+scratch workspace, are deleted when the run leaves the with block, also
+on an error.
+'''
+import os
+import time
+from datetime import datetime as dt
+from typing import Callable, Dict, List, Tuple
+
+import ld_store
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+MEMORY = 'memory'
+SCRATCH = 'scratch'
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class ScratchLayer:
+    '''
+    One temp layer: where it is, its estimated geometry size in bytes and
+    when it was made
+    '''
+    def __init__(self, name:str, path:str, location:str):
+        self.name = name
+        self.path = path
+        self.location = location
+        self.size = 0
+        self.created = time.perf_counter()
+        self.seconds = None
+
+    def __str__(self):
+        return f'{self.name}: {self.location}, {self.size} bytes'
+
+
+class _ScratchInsertCursor:
+    '''
+    Insert cursor on a temp layer that adds the size of each geometry
+    inserted to the layer, and moves the layer to the scratch workspace
+    when the memory budget is passed
+    '''
+    def __init__(self, scratch:'ScratchWorkspace', layer:ScratchLayer, fields:List[str]):
+        self._scratch = scratch
+        self._layer = layer
+        self._fields = fields
+        self._shape_position = fields.index(ld_store.SHAPE_TOKEN) if ld_store.SHAPE_TOKEN in fields else None
+        self._cursor = None
+
+    def __enter__(self):
+        self._open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._cursor.__exit__(exc_type, exc_value, traceback)
+
+    def _open(self) -> None:
+        self._cursor = self._scratch.store.insert_cursor(self._layer.path, self._fields)
+        self._cursor.__enter__()
+
+    def insertRow(self, row:list):
+        if self._shape_position is not None and row[self._shape_position] is not None:
+            shape_size = self._scratch.store.geometry_size(row[self._shape_position])
+            if self._layer.location == MEMORY and not self._scratch.fits_in_memory(shape_size):
+                self._cursor.__exit__(None, None, None)
+                self._scratch.spill(self._layer)
+                self._open()
+            self._scratch.add_size(self._layer, shape_size)
+
+        return self._cursor.insertRow(row)
+
+
+class ScratchWorkspace:
+    '''
+    Temp layers of one run, made in the memory workspace up to
+    max_memory_bytes (estimated geometry size of all the run's layers in
+    memory) and in a scratch workspace in scratch_folder past that. Use
+    in a with block; the layers are deleted on leaving it. log, if given,
+    is called with the messages on where the layers went.
+    '''
+    def __init__(self, store:ld_store.FeatureStore, scratch_folder:str, max_memory_bytes:int, log:Callable[[str], None] = None):
+        self.store = store
+        self.scratch_folder = scratch_folder
+        self.max_memory_bytes = max_memory_bytes
+        self.log = log
+
+        self.run_name = f'{dt.now().strftime("%Y%m%d_%H%M%S")}_{os.getpid()}'
+        self.scratch_workspace = None
+        self.memory_bytes = 0
+        self.spill_count = 0
+
+        self._layers = {}
+        # Deleted layers: (name, location, bytes, seconds kept)
+        self.history = []
+
+    def __str__(self):
+        return (f'run: {self.run_name}; layers: {len(self._layers)}; memory: {self.memory_bytes} bytes; '
+                f'spills: {self.spill_count}; scratch_workspace: {self.scratch_workspace}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def fits_in_memory(self, size:int) -> bool:
+        return self.store.memory_workspace is not None and self.memory_bytes + size <= self.max_memory_bytes
+
+    def _get_scratch_workspace(self) -> str:
+        if self.scratch_workspace is None:
+            self.scratch_workspace = self.store.create_scratch_workspace(self.scratch_folder, f'LD_Scratch_{self.run_name}')
+            self._log(f'Scratch workspace created: {self.scratch_workspace}')
+
+        return self.scratch_workspace
+
+    def _log(self, msg:str) -> None:
+        if self.log is not None:
+            self.log(msg)
+
+    def _new_layer(self, base_name:str, size_estimate:int) -> ScratchLayer:
+        name = f'{base_name}_{self.run_name}_{len(self._layers) + len(self.history) + 1}'
+        if self.fits_in_memory(size_estimate):
+            layer = ScratchLayer(name, os.path.join(self.store.memory_workspace, name), MEMORY)
+        else:
+            layer = ScratchLayer(name, os.path.join(self._get_scratch_workspace(), name), SCRATCH)
+        self._layers[name] = layer
+        self.add_size(layer, size_estimate)
+
+        return layer
+
+    def create_layer(self, base_name:str, template:str = None, fields:List[Tuple[str, str]] = None) -> ScratchLayer:
+        '''
+        New, empty temp layer with the fields of the template or the
+        given fields. Starts in memory if there is any memory budget left.
+        '''
+        layer = self._new_layer(base_name, 0)
+        self.store.create_feature_class(layer.path, template=template, fields=fields)
+
+        return layer
+
+    def output_layer(self, base_name:str, size_estimate:int) -> ScratchLayer:
+        '''
+        Temp layer for a tool to write to (not created here), in memory if
+        the estimated size fits
+        '''
+        return self._new_layer(base_name, size_estimate)
+
+    def insert_cursor(self, layer:ScratchLayer, fields:List[str]) -> _ScratchInsertCursor:
+        '''
+        Insert cursor on the temp layer that tracks its size. layer.path
+        changes if the layer is moved out of memory.
+        '''
+        return _ScratchInsertCursor(self, layer, fields)
+
+    def add_size(self, layer:ScratchLayer, size:int) -> None:
+        layer.size += size
+        if layer.location == MEMORY:
+            self.memory_bytes += size
+
+    def spill(self, layer:ScratchLayer) -> None:
+        '''
+        Move a layer from memory to the scratch workspace
+        '''
+        scratch_path = os.path.join(self._get_scratch_workspace(), layer.name)
+        ld_store.copy_feature_class(self.store, layer.path, self.store, scratch_path)
+        self.store.delete(layer.path)
+
+        self.memory_bytes -= layer.size
+        layer.path = scratch_path
+        layer.location = SCRATCH
+        self.spill_count += 1
+        self._log(f'Temp layer {layer.name} moved to the scratch workspace at {layer.size} bytes')
+
+    def delete_layer(self, layer:ScratchLayer) -> None:
+        '''
+        Delete a temp layer now rather than at the end of the run
+        '''
+        self._layers.pop(layer.name, None)
+        if layer.location == MEMORY:
+            self.memory_bytes -= layer.size
+        layer.seconds = time.perf_counter() - layer.created
+        self.history.append((layer.name, layer.location, layer.size, layer.seconds))
+
+        if self.store.exists(layer.path):
+            self.store.delete(layer.path)
+
+    def get_summary(self) -> Dict[str, dict]:
+        ''' Count, bytes and seconds kept of the deleted layers, by location '''
+        summary = {}
+        for _, location, size, seconds in self.history:
+            location_summary = summary.setdefault(location, {'layers': 0, 'bytes': 0, 'seconds': 0.0})
+            location_summary['layers'] += 1
+            location_summary['bytes'] += size
+            location_summary['seconds'] += seconds
+
+        return summary
+
+    def close(self) -> None:
+        '''
+        Delete every temp layer left and the scratch workspace. A layer
+        that cannot be deleted is logged and the rest still go.
+        '''
+        for layer in list(self._layers.values()):
+            try:
+                self.delete_layer(layer)
+            except Exception as del_err:
+                self._log(f'Could not delete temp layer {layer.path}: {del_err}')
+
+        if self.scratch_workspace is not None:
+            try:
+                self.store.delete_scratch_workspace(self.scratch_workspace)
+            except Exception as del_err:
+                self._log(f'Could not delete scratch workspace {self.scratch_workspace}: {del_err}')
+            self.scratch_workspace = None
+
+        for location, location_summary in self.get_summary().items():
+            self._log(f"Temp layers in {location}: {location_summary['layers']}, {location_summary['bytes']} bytes, "
+                      f"{location_summary['seconds']:.2f} seconds kept")
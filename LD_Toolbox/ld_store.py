@@ -0,0 +1,861 @@
+'''
+Feature store backends: where the script reads and writes its layers
+
+ArcpyFeatureStore works on geodatabases through arcpy and is what the
+toolbox uses. SQLiteFeatureStore keeps feature classes as tables of a
+SQLite file, with the geometry as WKB and an R-tree of the extents, so
+the whole script can run (and be profiled) without ArcGIS Pro.
+
+Both take the same paths form (workspace, then the feature class name),
+the same SQL where clauses, and the same field tokens: 'SHAPE@' for the
+geometry object, 'SHAPE@WKB' for its WKB and 'OID@' for the object id.
+'''
+import abc
+import datetime
+import os
+import sqlite3
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import ld_geometry
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# Field types of the store, as used by field_definitions/create_feature_class
+TEXT = 'TEXT'
+DOUBLE = 'DOUBLE'
+LONG = 'LONG'
+DATE = 'DATE'
+
+SHAPE_TOKEN = 'SHAPE@'
+WKB_TOKEN = 'SHAPE@WKB'
+OID_TOKEN = 'OID@'
+
+# Geometry and geodatabase managed fields, never copied or updated
+SKIP_FIELD_NAMES = ['shape_length', 'shape_area', 'shape']
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+class FeatureStore(abc.ABC):
+    '''
+    What the script needs from a store of feature classes. A store has
+    to implement every abstract method to be made.
+    '''
+    name = None
+    # Workspace of in-memory feature classes, gone when the process ends
+    memory_workspace = None
+
+    @abc.abstractmethod
+    def exists(self, path:str) -> bool:
+        ''' True if the feature class or workspace is there '''
+
+    @abc.abstractmethod
+    def delete(self, path:str) -> None:
+        ''' Remove the feature class '''
+
+    @abc.abstractmethod
+    def configure_environment(self, workspace:str, template_path:str) -> None:
+        ''' Set up the workspace, with the coordinate system of the template '''
+
+    @abc.abstractmethod
+    def create_scratch_workspace(self, folder:str, name:str) -> str:
+        ''' New, empty workspace in the folder for temp layers, returns its path '''
+
+    @abc.abstractmethod
+    def delete_scratch_workspace(self, workspace:str) -> None:
+        ''' Remove a scratch workspace with its feature classes '''
+
+    @abc.abstractmethod
+    def field_definitions(self, path:str) -> List[Tuple[str, str]]:
+        ''' (name, type) of the attribute fields, less geometry/gdb fields '''
+
+    def field_names(self, path:str) -> List[str]:
+        ''' Names of the attribute fields, less geometry/gdb fields '''
+        return [field_name for field_name, _ in self.field_definitions(path)]
+
+    def field_lengths(self, path:str) -> Dict[str, int]:
+        ''' Lengths of the text fields that have a limit '''
+        return {}
+
+    @abc.abstractmethod
+    def create_feature_class(self, path:str, template:str = None, fields:List[Tuple[str, str]] = None) -> None:
+        '''
+        New, empty polygon feature class with the fields of the template
+        (same store) or the given (name, type) fields, (name, type,
+        length) for text fields with a length limit. Replaces any
+        feature class already at the path.
+        '''
+
+    @abc.abstractmethod
+    def add_index(self, path:str, field_name:str) -> None:
+        ''' Attribute index on the field, for where clauses on it '''
+
+    @abc.abstractmethod
+    def search(self, path:str, fields:List[str], where:str = None, extent:Tuple[float, float, float, float] = None) -> Iterator[tuple]:
+        '''
+        Rows of the fields, optionally filtered by a where clause and by
+        an (xmin, ymin, xmax, ymax) extent. Query errors are raised as
+        RuntimeError.
+        '''
+
+    def scan_keys(self, path:str, field_name:str) -> set:
+        ''' Distinct values of the field '''
+        return set(row[0] for row in self.search(path, [field_name]))
+
+    @abc.abstractmethod
+    def insert_cursor(self, path:str, fields:List[str]):
+        '''
+        Context manager with an insertRow method taking the row values
+        in the order of the fields
+        '''
+
+    def insert_rows(self, path:str, fields:List[str], rows:Iterable[list]) -> int:
+        ''' Insert the rows, returns the number inserted '''
+        insert_count = 0
+        with self.insert_cursor(path, fields) as cursor:
+            for row in rows:
+                cursor.insertRow(row)
+                insert_count += 1
+
+        return insert_count
+
+    @abc.abstractmethod
+    def update_cursor(self, path:str, fields:List[str], where:str = None):
+        '''
+        Context manager to iterate over the rows of the fields, with an
+        updateRow method writing new values to the current row and a
+        deleteRow method removing it
+        '''
+
+    @abc.abstractmethod
+    def dissolve(self, in_path:str, out_path:str, dissolve_field:str) -> None:
+        '''
+        One feature per value of the dissolve field, the union of its
+        geometries. The output has the dissolve field only.
+        '''
+
+    @abc.abstractmethod
+    def get_source_stamp(self, path:str) -> str:
+        '''
+        Text that changes when the feature class (or the coordinate
+        system it is read in) changes, for caches of what was read from it
+        '''
+
+    @abc.abstractmethod
+    def to_wkb(self, geometry) -> bytes:
+        ''' WKB of a geometry object of the store '''
+
+    @abc.abstractmethod
+    def from_wkb(self, wkb:bytes):
+        ''' Geometry object of the store from WKB '''
+
+    def geometry_size(self, geometry) -> int:
+        ''' Approximate memory held by a geometry object, in bytes '''
+        return len(self.to_wkb(geometry))
+
+    def close(self) -> None:
+        pass
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+# arcpy field types to store types
+ARCPY_FIELD_TYPES = {
+    'String': TEXT,
+    'Double': DOUBLE,
+    'Single': DOUBLE,
+    'Integer': LONG,
+    'SmallInteger': LONG,
+    'BigInteger': LONG,
+    'Date': DATE,
+    'DateOnly': DATE
+    }
+
+
+class ArcpyFeatureStore(FeatureStore):
+    '''
+    Geodatabase feature classes through arcpy
+    '''
+    name = 'arcpy'
+    memory_workspace = 'memory'
+
+    def __init__(self):
+        if arcpy is None:
+            raise RuntimeError('The arcpy feature store needs ArcGIS Pro (arcpy could not be imported)')
+        self.spatial_reference = None
+
+    def exists(self, path:str) -> bool:
+        return arcpy.Exists(path)
+
+    def delete(self, path:str) -> None:
+        arcpy.Delete_management(path)
+
+    def configure_environment(self, workspace:str, template_path:str) -> None:
+        arcpy.env.workspace = workspace
+        arcpy.overwriteOutputs = True
+        arcpy.env.overwriteOutput = True
+        self.spatial_reference = arcpy.Describe(template_path).spatialReference
+        arcpy.env.outputCoordinateSystem = self.spatial_reference
+
+    def create_scratch_workspace(self, folder:str, name:str) -> str:
+        return str(arcpy.CreateFileGDB_management(folder, f'{name}.gdb')[0])
+
+    def delete_scratch_workspace(self, workspace:str) -> None:
+        if arcpy.Exists(workspace):
+            arcpy.Delete_management(workspace)
+
+    def field_definitions(self, path:str) -> List[Tuple[str, str]]:
+        field_list = arcpy.ListFields(path)
+        field_list = [field_obj for field_obj in field_list if field_obj.type not in ['Geometry','GlobalID', 'OID', 'Guid']]
+        field_list = [field_obj for field_obj in field_list if field_obj.name.lower() not in SKIP_FIELD_NAMES]
+
+        return [(field_obj.name, ARCPY_FIELD_TYPES.get(field_obj.type, TEXT)) for field_obj in field_list]
+
+    def field_lengths(self, path:str) -> Dict[str, int]:
+        return {field_obj.name: field_obj.length for field_obj in arcpy.ListFields(path) if field_obj.type == 'String'}
+
+    def create_feature_class(self, path:str, template:str = None, fields:List[Tuple[str, str]] = None) -> None:
+        if arcpy.Exists(path):
+            arcpy.Delete_management(path)
+
+        arcpy.CreateFeatureclass_management(
+            out_path=os.path.dirname(path),
+            out_name=os.path.basename(path),
+            geometry_type='POLYGON',
+            template=template,
+            spatial_reference=self.spatial_reference
+            )
+
+        for field_name, field_type, *field_length in fields or []:
+            arcpy.AddField_management(path, field_name, field_type, field_length=field_length[0] if field_length else None)
+
+    def add_index(self, path:str, field_name:str) -> None:
+        arcpy.AddIndex_management(path, field_name, f'{field_name}_idx')
+
+    def search(self, path:str, fields:List[str], where:str = None, extent:Tuple[float, float, float, float] = None) -> Iterator[tuple]:
+        cursor_args = {}
+        if extent is not None:
+            cursor_args['spatial_filter'] = arcpy.Extent(*extent)
+        # Geometries come back in the output coordinate system, as they
+        # were when inserted into a layer of the template
+        if self.spatial_reference is not None:
+            cursor_args['spatial_reference'] = self.spatial_reference
+
+        with arcpy.da.SearchCursor(path, fields, where, **cursor_args) as search_cursor:
+            yield from search_cursor
+
+    def insert_cursor(self, path:str, fields:List[str]):
+        return arcpy.da.InsertCursor(path, fields)
+
+    def update_cursor(self, path:str, fields:List[str], where:str = None):
+        return arcpy.da.UpdateCursor(path, fields, where)
+
+    def dissolve(self, in_path:str, out_path:str, dissolve_field:str) -> None:
+        if arcpy.Exists(out_path):
+            arcpy.Delete_management(out_path)
+
+        arcpy.PairwiseDissolve_analysis(
+            in_features = in_path,
+            out_feature_class = out_path,
+            dissolve_field = dissolve_field
+        )
+
+    def get_source_stamp(self, path:str) -> str:
+        # Reading every geometry for a checksum would cost what the caches
+        # save, so the feature count and extent are used with the last
+        # change to the feature class's table files
+        describe = arcpy.Describe(path)
+        extent = describe.extent
+        feature_count = int(arcpy.GetCount_management(path)[0])
+
+        # Feature classes in a feature dataset are a level down
+        workspace = describe.path
+        if not workspace.lower().endswith('.gdb'):
+            workspace = os.path.dirname(workspace)
+        modified = ''
+        if os.path.isdir(workspace):
+            modified = ','.join(f'{entry.stat().st_mtime}:{entry.stat().st_size}' for entry in self._get_table_files(workspace, describe))
+
+        spatial_reference = self.spatial_reference.factoryCode if self.spatial_reference is not None else None
+
+        return f'{feature_count}|{extent.XMin},{extent.YMin},{extent.XMax},{extent.YMax}|{modified}|{spatial_reference}'
+
+    @staticmethod
+    def _get_table_files(workspace:str, describe) -> List[os.DirEntry]:
+        '''
+        Table files of the feature class in a file gdb: a0000000N.gdbtable
+        and .gdbtablx, N being its dataset id in hex. If those are not
+        there, the table files of the whole gdb. Lock files are left
+        out, they change each time the gdb is opened.
+        '''
+        table_files = [entry for entry in os.scandir(workspace)
+                       if entry.is_file() and os.path.splitext(entry.name)[1].lower() in ('.gdbtable', '.gdbtablx')]
+
+        table_name = f'a{getattr(describe, "DSID", -1):08x}'
+        own_files = [entry for entry in table_files if os.path.splitext(entry.name)[0].lower() == table_name]
+
+        return sorted(own_files or table_files, key=lambda entry: entry.name)
+
+    def to_wkb(self, geometry) -> bytes:
+        return bytes(geometry.WKB)
+
+    def from_wkb(self, wkb:bytes):
+        return arcpy.FromWKB(bytearray(wkb), self.spatial_reference)
+
+    def geometry_size(self, geometry) -> int:
+        # Coordinates are held natively, about as in the WKB
+        return geometry.pointCount * 16 + 100
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+SQLITE_COLUMN_TYPES = {
+    TEXT: 'TEXT',
+    DOUBLE: 'REAL',
+    LONG: 'INTEGER',
+    DATE: 'TEXT'
+    }
+
+
+def _to_sqlite_value(value, field_type:str, field_length:int = None):
+    '''
+    Value as stored for the field type; dates as ISO text. Values that do
+    not fit the field (type or text length) raise RuntimeError, as arcpy
+    cursors do.
+    '''
+    if value is None or value != value:
+        return None
+
+    try:
+        if field_type == DATE:
+            return value.isoformat()
+        elif field_type == DOUBLE:
+            return float(value)
+        elif field_type == LONG:
+            return int(value)
+        else:
+            value = str(value)
+    except (AttributeError, TypeError, ValueError) as value_err:
+        raise RuntimeError(f'The value type is incompatible with the field type. [{value!r}: {field_type}]') from value_err
+
+    if field_length and len(value) > field_length:
+        raise RuntimeError(f'The value is too long for the field. [{len(value)} characters: {field_type}({field_length})]')
+
+    return value
+
+
+class _SQLiteInsertCursor:
+    '''
+    Insert cursor on a SQLite feature class, committed on exit
+    '''
+    def __init__(self, store:'SQLiteFeatureStore', path:str, fields:List[str]):
+        self._conn = store._get_connection(path)
+        self._table = store._get_table(path)
+        self._rtree = store._get_rtree(path)
+
+        field_types = dict(store.field_definitions(path))
+        field_lengths = store.field_lengths(path)
+        columns = []
+        self._converters = []
+        for field in fields:
+            if field in [SHAPE_TOKEN, WKB_TOKEN]:
+                columns.append('SHAPE')
+                self._converters.append(None)
+            elif field in field_types:
+                columns.append(field)
+                self._converters.append((field_types[field], field_lengths.get(field)))
+            else:
+                raise RuntimeError(f'Cannot find field {field} in {path}')
+
+        self._shape_position = columns.index('SHAPE') if 'SHAPE' in columns else None
+        self._sql = f'INSERT INTO "{self._table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+
+    def insertRow(self, row:list) -> int:
+        values = [value if converter is None else _to_sqlite_value(value, *converter) for value, converter in zip(row, self._converters)]
+
+        polygon = None
+        if self._shape_position is not None:
+            shape = values[self._shape_position]
+            if isinstance(shape, ld_geometry.Polygon):
+                polygon = shape
+                values[self._shape_position] = shape.to_wkb()
+            elif shape is not None:
+                polygon = ld_geometry.Polygon.from_wkb(shape)
+                values[self._shape_position] = bytes(shape)
+
+        try:
+            object_id = self._conn.execute(self._sql, values).lastrowid
+            if polygon is not None and not polygon.is_empty:
+                xmin, ymin, xmax, ymax = polygon.extent
+                self._conn.execute(f'INSERT INTO "{self._rtree}" VALUES (?, ?, ?, ?, ?)', (object_id, xmin, xmax, ymin, ymax))
+        except sqlite3.Error as sql_err:
+            raise RuntimeError(str(sql_err)) from sql_err
+
+        return object_id
+
+
+class _SQLiteUpdateCursor:
+    '''
+    Update cursor on the attribute fields of a SQLite feature class,
+    committed on exit. The rows are read up front, as SQLite does not
+    allow for changes to a table while a query on it is open.
+    '''
+    def __init__(self, store:'SQLiteFeatureStore', path:str, fields:List[str], where:str = None):
+        self._conn = store._get_connection(path)
+        self._rows = [(row[0], list(row[1:])) for row in store.search(path, [OID_TOKEN] + list(fields), where)]
+        self._object_id = None
+
+        field_types = dict(store.field_definitions(path))
+        field_lengths = store.field_lengths(path)
+        self._converters = [(field_types[field], field_lengths.get(field)) for field in fields]
+        set_columns = ', '.join(f'"{field}" = ?' for field in fields)
+        self._sql = f'UPDATE "{store._get_table(path)}" SET {set_columns} WHERE OBJECTID = ?'
+        self._delete_sqls = [f'DELETE FROM "{store._get_table(path)}" WHERE OBJECTID = ?', f'DELETE FROM "{store._get_rtree(path)}" WHERE id = ?']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+
+    def __iter__(self):
+        for self._object_id, values in self._rows:
+            yield values
+        self._object_id = None
+
+    def updateRow(self, row:list) -> None:
+        if self._object_id is None:
+            raise RuntimeError('No current row to update')
+
+        values = [_to_sqlite_value(value, *converter) for value, converter in zip(row, self._converters)]
+        try:
+            self._conn.execute(self._sql, values + [self._object_id])
+        except sqlite3.Error as sql_err:
+            raise RuntimeError(str(sql_err)) from sql_err
+
+    def deleteRow(self) -> None:
+        if self._object_id is None:
+            raise RuntimeError('No current row to delete')
+
+        try:
+            for delete_sql in self._delete_sqls:
+                self._conn.execute(delete_sql, (self._object_id,))
+        except sqlite3.Error as sql_err:
+            raise RuntimeError(str(sql_err)) from sql_err
+
+
+class SQLiteFeatureStore(FeatureStore):
+    '''
+    Feature classes as tables of a SQLite file. The workspace is the
+    file and a feature class path is the file path joined with the table
+    name. Each table has an OBJECTID key, its attribute fields and the
+    SHAPE as WKB, plus an R-tree table of the shape extents. The field
+    types are kept in the ld_fields table, the text field length limits
+    in ld_field_lengths, and counts of the changes to each table (by
+    triggers) in ld_changes.
+    '''
+    name = 'sqlite'
+    memory_workspace = ':memory:'
+
+    def __init__(self):
+        self._connections = {}
+
+    @staticmethod
+    def _get_table(path:str) -> str:
+        return os.path.basename(path)
+
+    @staticmethod
+    def _get_rtree(path:str) -> str:
+        return f'rtree_{os.path.basename(path)}_SHAPE'
+
+    def _get_connection(self, path:str) -> sqlite3.Connection:
+        '''
+        Connection to the workspace file of the path (or the workspace itself)
+        '''
+        workspace = self._get_workspace(path)
+
+        if workspace not in self._connections:
+            if workspace == self.memory_workspace:
+                conn = sqlite3.connect(workspace)
+                conn.execute('CREATE TABLE ld_fields (table_name TEXT, field_name TEXT, field_type TEXT, position INTEGER)')
+                self._connections[workspace] = conn
+            elif not os.path.isfile(workspace):
+                raise RuntimeError(f'Cannot find the workspace {workspace}')
+            else:
+                self._connections[workspace] = sqlite3.connect(workspace)
+
+        return self._connections[workspace]
+
+    def _get_workspace(self, path:str) -> str:
+        if path == self.memory_workspace or os.path.dirname(path) == self.memory_workspace:
+            return self.memory_workspace
+
+        return os.path.abspath(path if os.path.isfile(path) else os.path.dirname(path))
+
+    @staticmethod
+    def create_workspace(workspace:str) -> None:
+        ''' Create an empty workspace file, replacing any existing one '''
+        if os.path.exists(workspace):
+            os.remove(workspace)
+
+        with sqlite3.connect(workspace) as conn:
+            conn.execute('CREATE TABLE ld_fields (table_name TEXT, field_name TEXT, field_type TEXT, position INTEGER)')
+        conn.close()
+
+    def exists(self, path:str) -> bool:
+        if os.path.isfile(path) or path == self.memory_workspace:
+            return True
+        if not os.path.isfile(os.path.dirname(path)) and os.path.dirname(path) != self.memory_workspace:
+            return False
+
+        conn = self._get_connection(path)
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self._get_table(path),)).fetchone()
+
+        return row is not None
+
+    def delete(self, path:str) -> None:
+        conn = self._get_connection(path)
+        table = self._get_table(path)
+        with conn:
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            conn.execute(f'DROP TABLE IF EXISTS "{self._get_rtree(path)}"')
+            conn.execute('DELETE FROM ld_fields WHERE table_name = ?', (table,))
+
+    def configure_environment(self, workspace:str, template_path:str) -> None:
+        self._get_connection(workspace)
+
+    def create_scratch_workspace(self, folder:str, name:str) -> str:
+        workspace = os.path.join(folder, f'{name}.sqlite')
+        self.create_workspace(workspace)
+
+        return workspace
+
+    def delete_scratch_workspace(self, workspace:str) -> None:
+        conn = self._connections.pop(self._get_workspace(workspace), None)
+        if conn is not None:
+            conn.close()
+        if os.path.isfile(workspace):
+            os.remove(workspace)
+
+    def field_definitions(self, path:str) -> List[Tuple[str, str]]:
+        conn = self._get_connection(path)
+        rows = conn.execute('SELECT field_name, field_type FROM ld_fields WHERE table_name = ? ORDER BY position', (self._get_table(path),))
+
+        return [(field_name, field_type) for field_name, field_type in rows]
+
+    def create_feature_class(self, path:str, template:str = None, fields:List[Tuple[str, str]] = None) -> None:
+        field_defs = []
+        field_lengths = {}
+        if template is not None:
+            field_defs.extend(self.field_definitions(template))
+            field_lengths.update(self.field_lengths(template))
+        for field_name, field_type, *field_length in fields or []:
+            field_defs.append((field_name, field_type))
+            if field_length:
+                field_lengths[field_name] = field_length[0]
+
+        if self.exists(path):
+            self.delete(path)
+
+        conn = self._get_connection(path)
+        table = self._get_table(path)
+        columns = ['OBJECTID INTEGER PRIMARY KEY']
+        columns.extend(f'"{field_name}" {SQLITE_COLUMN_TYPES[field_type]}' for field_name, field_type in field_defs)
+        columns.append('SHAPE BLOB')
+
+        with conn:
+            conn.execute(f'CREATE TABLE "{table}" ({", ".join(columns)})')
+            conn.execute(f'CREATE VIRTUAL TABLE "{self._get_rtree(path)}" USING rtree(id, minx, maxx, miny, maxy)')
+            conn.executemany(
+                'INSERT INTO ld_fields VALUES (?, ?, ?, ?)',
+                [(table, field_name, field_type, position) for position, (field_name, field_type) in enumerate(field_defs)]
+                )
+            conn.execute('CREATE TABLE IF NOT EXISTS ld_field_lengths (table_name TEXT, field_name TEXT, field_length INTEGER)')
+            conn.execute('DELETE FROM ld_field_lengths WHERE table_name = ?', (table,))
+            conn.executemany('INSERT INTO ld_field_lengths VALUES (?, ?, ?)', [(table, field_name, field_length) for field_name, field_length in field_lengths.items()])
+            self._track_changes(conn, table)
+
+    @staticmethod
+    def _track_changes(conn:sqlite3.Connection, table:str) -> None:
+        '''
+        Count the inserts, updates and deletes of the table's rows in
+        ld_changes, with triggers. The table gets a new table_id, so a
+        table made again under the same name does not get the stamp of
+        the old one.
+        '''
+        conn.execute('CREATE TABLE IF NOT EXISTS ld_changes (table_name TEXT PRIMARY KEY, table_id TEXT, change_count INTEGER)')
+        conn.execute('INSERT OR REPLACE INTO ld_changes VALUES (?, ?, 0)', (table, uuid.uuid4().hex))
+
+        table_value = table.replace("'", "''")
+        for operation in ['INSERT', 'UPDATE', 'DELETE']:
+            conn.execute(
+                f'CREATE TRIGGER IF NOT EXISTS "ld_changes_{table}_{operation.lower()}" AFTER {operation} ON "{table}" '
+                f"BEGIN UPDATE ld_changes SET change_count = change_count + 1 WHERE table_name = '{table_value}'; END"
+                )
+
+    def field_lengths(self, path:str) -> Dict[str, int]:
+        # Workspaces made before the lengths were kept have no limits
+        conn = self._get_connection(path)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ld_field_lengths'").fetchone() is None:
+            return {}
+        rows = conn.execute('SELECT field_name, field_length FROM ld_field_lengths WHERE table_name = ?', (self._get_table(path),))
+
+        return {field_name: field_length for field_name, field_length in rows}
+
+    def _get_columns(self, path:str, fields:List[str]) -> Tuple[List[str], list]:
+        '''
+        Select columns for the fields, and how to convert each value read
+        '''
+        field_types = dict(self.field_definitions(path))
+        columns = []
+        readers = []
+        for field in fields:
+            if field == SHAPE_TOKEN:
+                columns.append('SHAPE')
+                readers.append(lambda value: None if value is None else ld_geometry.Polygon.from_wkb(value))
+            elif field == WKB_TOKEN:
+                columns.append('SHAPE')
+                readers.append(None)
+            elif field == OID_TOKEN:
+                columns.append('OBJECTID')
+                readers.append(None)
+            elif field in field_types:
+                columns.append(f'"{field}"')
+                if field_types[field] == DATE:
+                    readers.append(lambda value: None if value is None else datetime.datetime.fromisoformat(value))
+                else:
+                    readers.append(None)
+            else:
+                raise RuntimeError(f'Cannot find field {field} in {path}')
+
+        return columns, readers
+
+    def add_index(self, path:str, field_name:str) -> None:
+        table = self._get_table(path)
+        with self._get_connection(path) as conn:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{field_name}_idx" ON "{table}" ("{field_name}")')
+
+    def search(self, path:str, fields:List[str], where:str = None, extent:Tuple[float, float, float, float] = None) -> Iterator[tuple]:
+        if isinstance(fields, str):
+            fields = [fields]
+
+        conn = self._get_connection(path)
+        table = self._get_table(path)
+        columns, readers = self._get_columns(path, fields)
+
+        sql = f'SELECT {", ".join(columns)} FROM "{table}"'
+        conditions = []
+        parameters = []
+        if where:
+            conditions.append(f'({where})')
+        if extent is not None:
+            xmin, ymin, xmax, ymax = extent
+            conditions.append(f'OBJECTID IN (SELECT id FROM "{self._get_rtree(path)}" WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?)')
+            parameters.extend([xmax, xmin, ymax, ymin])
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY OBJECTID'
+
+        try:
+            for row in conn.execute(sql, parameters):
+                yield tuple(value if reader is None else reader(value) for value, reader in zip(row, readers))
+        except sqlite3.Error as sql_err:
+            raise RuntimeError(f'{sql_err} [{sql}]') from sql_err
+
+    def insert_cursor(self, path:str, fields:List[str]) -> _SQLiteInsertCursor:
+        return _SQLiteInsertCursor(self, path, fields)
+
+    def update_cursor(self, path:str, fields:List[str], where:str = None) -> '_SQLiteUpdateCursor':
+        return _SQLiteUpdateCursor(self, path, fields, where)
+
+    def dissolve(self, in_path:str, out_path:str, dissolve_field:str) -> None:
+        polygons = defaultdict(list)
+        for key, polygon in self.search(in_path, [dissolve_field, SHAPE_TOKEN]):
+            if polygon is not None:
+                polygons[key].append(polygon)
+
+        field_type = dict(self.field_definitions(in_path))[dissolve_field]
+        self.create_feature_class(out_path, fields=[(dissolve_field, field_type)])
+
+        self.insert_rows(
+            out_path,
+            [dissolve_field, SHAPE_TOKEN],
+            ([key, ld_geometry.dissolve_polygons(key_polygons)] for key, key_polygons in polygons.items())
+            )
+        self.add_index(out_path, dissolve_field)
+
+    def get_source_stamp(self, path:str) -> str:
+        # The workspace file also changes with the other tables in it, and
+        # a checksum would read every row, so the row count and last
+        # OBJECTID are used with the change count of the table's triggers
+        conn = self._get_connection(path)
+        table = self._get_table(path)
+        try:
+            trigger = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f'ld_changes_{table}_insert',)).fetchone()
+            if trigger is None:
+                with conn:
+                    self._track_changes(conn, table)
+            table_id, change_count = conn.execute('SELECT table_id, change_count FROM ld_changes WHERE table_name = ?', (table,)).fetchone()
+            row_count, last_object_id = conn.execute(f'SELECT COUNT(*), MAX(OBJECTID) FROM "{table}"').fetchone()
+        except sqlite3.Error as sql_err:
+            raise RuntimeError(str(sql_err)) from sql_err
+
+        return f'{table_id}|{change_count}|{row_count}|{last_object_id}'
+
+    def to_wkb(self, geometry:ld_geometry.Polygon) -> bytes:
+        return geometry.to_wkb()
+
+    def from_wkb(self, wkb:bytes) -> ld_geometry.Polygon:
+        return ld_geometry.Polygon.from_wkb(wkb)
+
+    def geometry_size(self, geometry:ld_geometry.Polygon) -> int:
+        # A point is a tuple of two floats in a list
+        return geometry.point_count * 112 + 200
+
+    def close(self) -> None:
+        for conn in self._connections.values():
+            conn.close()
+        self._connections = {}
+
+
+#<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
+FEATURE_STORES = {
+    ArcpyFeatureStore.name: ArcpyFeatureStore,
+    SQLiteFeatureStore.name: SQLiteFeatureStore
+    }
+
+
+def get_feature_store(store_name:str) -> FeatureStore:
+    '''
+    Feature store for the FEATURE_STORE config value
+    '''
+    if store_name not in FEATURE_STORES:
+        raise ValueError(f'Unknown feature store: {store_name}. Use one of {list(FEATURE_STORES)}')
+
+    return FEATURE_STORES[store_name]()
+
+
+def _normalize_value(value):
+    '''
+    Value in the form compared by sync_attributes: missing values as None,
+    numpy scalars as Python values, and datetimes at midnight as dates
+    '''
+    if value is None:
+        return None
+    try:
+        if value != value:
+            return None
+    except (TypeError, ValueError):
+        pass
+
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        value = value.item()
+    if isinstance(value, datetime.datetime) and value.tzinfo is None and value.time() == datetime.time():
+        return value.date()
+
+    return value
+
+
+def values_match(current_value, new_value) -> bool:
+    '''
+    True when writing the new value would not change the stored value:
+    a date matches the same day as a datetime at midnight or ISO text,
+    and a text field matches the text of the new value
+    '''
+    current_value = _normalize_value(current_value)
+    new_value = _normalize_value(new_value)
+
+    if isinstance(current_value, datetime.date) and isinstance(new_value, str):
+        try:
+            new_value = _normalize_value(datetime.datetime.fromisoformat(new_value))
+        except ValueError:
+            return False
+    elif isinstance(current_value, str) and isinstance(new_value, datetime.date):
+        try:
+            current_value = _normalize_value(datetime.datetime.fromisoformat(current_value))
+        except ValueError:
+            return False
+    elif isinstance(current_value, str) and new_value is not None and not isinstance(new_value, str):
+        new_value = str(new_value)
+
+    return current_value == new_value
+
+
+def sync_attributes(store:FeatureStore, path:str, key_field:str, fields:List[str], values_by_key:dict) -> dict:
+    '''
+    Bring the fields of the features up to date with the new values by
+    key, in one pass of one update cursor. Only features with a value
+    that differs are written. Returns the counts of features 'updated'
+    and 'unchanged', and of keys 'missing' from the layer.
+    '''
+    counts = {'updated': 0, 'unchanged': 0, 'missing': 0}
+    found_keys = set()
+
+    with store.update_cursor(path, [key_field] + list(fields)) as update_cursor:
+        for row in update_cursor:
+            new_values = values_by_key.get(row[0])
+            if new_values is None:
+                continue
+            found_keys.add(row[0])
+
+            if all(values_match(current_value, new_value) for current_value, new_value in zip(row[1:], new_values)):
+                counts['unchanged'] += 1
+            else:
+                update_cursor.updateRow([row[0]] + list(new_values))
+                counts['updated'] += 1
+
+    counts['missing'] = len(set(values_by_key) - found_keys)
+
+    return counts
+
+
+def delete_features(store:FeatureStore, path:str, key_field:str, keys:Iterable) -> int:
+    '''
+    Delete the features whose key is one of the keys, in one pass of one
+    update cursor. Returns the number of features deleted.
+    '''
+    keys = set(keys)
+    delete_count = 0
+    if not keys:
+        return delete_count
+
+    with store.update_cursor(path, [key_field]) as update_cursor:
+        for row in update_cursor:
+            if row[0] in keys:
+                update_cursor.deleteRow()
+                delete_count += 1
+
+    return delete_count
+
+
+def copy_feature_class(source_store:FeatureStore, source_path:str, target_store:FeatureStore, target_path:str, where:str = None) -> int:
+    '''
+    Copy a feature class (fields, rows and geometry) between stores, e.g.
+    the PLSS layer from a geodatabase to a SQLite file for an offline run.
+    Returns the number of features copied.
+    '''
+    field_lengths = source_store.field_lengths(source_path)
+    field_defs = [(field_name, field_type, field_lengths[field_name]) if field_name in field_lengths else (field_name, field_type)
+                  for field_name, field_type in source_store.field_definitions(source_path)]
+    field_names = [field_name for field_name, *_ in field_defs]
+
+    target_store.create_feature_class(target_path, fields=field_defs)
+
+    rows = (list(row[:-1]) + [None if row[-1] is None else target_store.from_wkb(row[-1])] for row in source_store.search(source_path, field_names + [WKB_TOKEN], where))
+
+    return target_store.insert_rows(target_path, field_names + [SHAPE_TOKEN], rows)
@@ -1,21 +1,36 @@
 '''
 Module to support toolbox
 
-Code assumes Python >=v3.6 and that it is an ArcGIS Pro environment
+Code assumes Python >=v3.6. The layers are read and written through the
+feature store set by FEATURE_STORE in config.py: arcpy (ArcGIS Pro
+environment) or a local SQLite file for offline runs.
 '''
 import os
-import csv
+from collections import Counter
 from datetime import datetime as dt
 import logging
-import numpy as np
 import pandas as pd
 import string
-from typing import List, Union, Tuple
+from typing import Callable, Tuple
 
-import arcpy
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
 
 import config as cfg
+import ld_audit
+import ld_cache
+import ld_checks
+import ld_consolidate
+import ld_delta
+import ld_dissolve
+import ld_excel
 import ld_parser
+import ld_plss
+import ld_scratch
+import ld_store
+from ld_divisions import SecondDivSet
 
 #<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
 
@@ -31,8 +46,8 @@ if IS_GCS_DEV:
     GIS_LAYER = r'C:\Users\logans1\Legal_Description_to_Feature\Monthly Lease Update.gdb\Sample_Test_7_3_2023'
     REPORT_FOLDER = r'C:\Users\logans1\Legal_Description_to_Feature\temp'
 
-FIRST_DIV = 'First_Div'
-SECOND_DIV = 'Second_Div'
+FIRST_DIV = ld_checks.FIRST_DIV
+SECOND_DIV = ld_checks.SECOND_DIV
 
 #<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
 class DualLogger:
@@ -81,514 +96,267 @@ class DualLogger:
     def info(self, msg:str) -> None:
         ''' Log info message'''
         self._log.info(msg)
-        if self.arcpy_msg:
+        if self.arcpy_msg and arcpy is not None:
             arcpy.AddMessage(msg)
 
     def warning(self, msg:str) -> None:
         ''' Log warning message'''
         self._log.warning(msg)
-        if self.arcpy_msg:
+        if self.arcpy_msg and arcpy is not None:
             arcpy.AddWarning(msg)
 
     def error(self, msg:str) -> None:
         ''' Log a error message'''
         self._log.error(msg)
-        if self.arcpy_msg:
+        if self.arcpy_msg and arcpy is not None:
             arcpy.AddError(msg)
 
     def critcal(self, msg:str) -> None:
         ''' Log a critical message; error level in arcpy'''
         self._log.critical(msg)
-        if self.arcpy_msg:
+        if self.arcpy_msg and arcpy is not None:
             arcpy.AddError(msg)
 
 
 def get_excel_data(excel_file:str) -> pd.DataFrame:
     '''
-    Get the lease data from the Excel file
+    Get the lease data from the Excel file, only the FIELD_MAPPING columns.
+    Reuses the stored snapshot of the workbook if snapshots are on.
     '''
-    if os.path.exists(excel_file):
-        excel_data = pd.read_excel(excel_file)
-    else:
+    if not os.path.exists(excel_file):
         raise FileNotFoundError('Unable to find lease data Excel file')
 
-    for field_name, data_type in cfg.EXCEL_DATATYPES.items():
-        if data_type == 'Timestamp':
-            excel_data[field_name] = excel_data[field_name].apply(lambda x: x.date())
-        else:
-            excel_data[field_name] = excel_data[field_name].astype(data_type)
-
-    excel_data = excel_data.replace({np.nan:None})
-
-    return excel_data
-
-
-def _check_lease_update_data(data_df:pd.DataFrame) -> Tuple[pd.DataFrame, List[list]]:
-    '''
-    Check the data file records to make sure each transaction
-    has consistent data. Send mismatches to the error output.
-    '''
-    error_records = []
-    excel_keys = list(data_df[cfg.DISSOLVE_FIELD].unique())
+    snapshot_cache = None
+    if cfg.USE_EXCEL_SNAPSHOTS:
+        snapshot_folder = os.path.join(cfg.LOG_FILE_FOLDER, cfg.EXCEL_SNAPSHOT_FOLDER)
+        snapshot_cache = ld_excel.ExcelSnapshotCache(snapshot_folder, cfg.EXCEL_SNAPSHOT_MAX_MB * 1024 * 1024)
+        snapshot_key = snapshot_cache.get_snapshot_key(excel_file)
 
-    for key in excel_keys:
-        records_to_check = data_df.loc[data_df[cfg.DISSOLVE_FIELD] == key]
+        excel_data = snapshot_cache.load(snapshot_key)
+        if excel_data is not None:
+            log.info('Excel data loaded from snapshot')
+            return excel_data
 
-        valid_update = True
-        mismatched_fields = []
-        for field in cfg.UPDATE_FIELDS:
-            field_values = list(records_to_check[field].unique())
-            if len(field_values) > 1:
-                valid_update = False
-                mismatched_fields.append(field)
+    if cfg.EXCEL_STREAMING:
+        excel_data = ld_excel.read_excel_data(excel_file, list(cfg.FIELD_MAPPING.keys()))
+    else:
+        excel_data = pd.read_excel(excel_file, usecols=lambda column: column in cfg.FIELD_MAPPING)
+        excel_data = ld_excel.convert_excel_datatypes(excel_data)
 
-        if not valid_update:
-            record_list = records_to_check.values
-            record_list = record_list.tolist()
-            for record in record_list:
-                record.append(f'Fields mismatch: {mismatched_fields}')
-                error_records.append(record)
-                error_log.info(record)
-            data_df = data_df.loc[data_df[cfg.DISSOLVE_FIELD] != key]
+    if snapshot_cache is not None:
+        snapshot_cache.save(snapshot_key, excel_data)
 
-    return (data_df, error_records)
+    return excel_data
 
 
-def get_table_field_objects(tbl_name:str) -> List[arcpy.Field]:
+def insert_new_data(target_lyr:str, dissolve_shapes:dict, source_data:pd.DataFrame) -> Tuple[int, list, list]:
     '''
-    Provides a list of field objects for the table, less geometry/gdb
-    related fields. Table name needs to be either full path or
-    name within context of the workspace.
-    '''
-    field_list = arcpy.ListFields(tbl_name)
-    field_list = [field_obj for field_obj in field_list if field_obj.type not in ['Geometry','GlobalID', 'OID', 'Guid']]
-    field_list = [field_obj for field_obj in field_list if field_obj.name.lower() not in ['shape_length','shape_area', 'shape']]
-
-    return field_list
+    Merges the dissolved PLSS geometries with the new data into the gis
+    layer. dissolve_shapes maps the transaction number (as text) to its
+    dissolved geometries; source_data is the consolidated data, one row
+    per transaction number.
 
-
-def insert_new_data(target_lyr:str, source_feature_lyr:str, source_data:dict) -> None:
-    '''
-    Merges the data from the PLSS dissolve layer current gis layer data
+    Returns the number of features inserted, the transactions with no
+    dissolved geometry, and the dissolved transactions with no data.
+    Transactions without a number are not matched.
     '''
     # Hard setting the Transactio field in the gis layer
     insert_fields = [] #['Transactio'] #<< Dropping the field
     insert_fields.extend(list(cfg.FIELD_MAPPING.values()))
     insert_fields.append('SHAPE@')
 
-    with arcpy.da.InsertCursor(target_lyr, insert_fields) as insert_cursor:
-        for key, data_values in source_data.items():
-            # Hard setting the Transactio field in the gis layer
-            insert_row = [] # ['Lease'] #<< Dropping the default value
-            insert_row.extend(data_values[:])
-            query = f"{cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD]} = '{key}'"
-            with arcpy.da.SearchCursor(source_feature_lyr, 'SHAPE@', query) as source_cursor:
-                for source_row in source_cursor:
-                    insert_row.append(source_row[0])
-                    insert_cursor.insertRow(insert_row)
+    insert_count = 0
+    missing_shape_keys = []
+    data_keys = set()
 
+    with store.insert_cursor(target_lyr, insert_fields) as insert_cursor:
+        for key, data_values in zip(source_data.index, source_data.itertuples(index=False, name=None)):
+            shapes = dissolve_shapes.get(str(key)) if key is not None else None
+            if not shapes:
+                missing_shape_keys.append(key)
+                continue
+            data_keys.add(str(key))
 
-def get_meridian(meridian_num:Union[int, str]) -> str:
-    '''
-    Normalize the meridian number.
-    '''
-    if meridian_num is None:
-        raise ValueError('Empty value value in meridian number')
-
-    meridian = str(meridian_num)
-
-    if not meridian.isdigit():
-        raise ValueError('Improper value in meridian number')
-    elif len(meridian) > 2:
-        raise ValueError('Meridian greater than two digits presented. Unable to process.')
+            for shape in shapes:
+                # Hard setting the Transactio field in the gis layer
+                insert_row = [] # ['Lease'] #<< Dropping the default value
+                insert_row.extend(data_values[:])
+                insert_row.append(shape)
+                insert_cursor.insertRow(insert_row)
+                insert_count += 1
 
-    if len(meridian) == 1:
-        meridian = "0" + meridian
+    missing_data_keys = [key for key in dissolve_shapes if key not in data_keys]
 
-    return meridian
+    return insert_count, missing_shape_keys, missing_data_keys
 
 
-def get_township(township_field:str) -> str:
+def get_cached_shapes(geometry_cache:ld_cache.GeometryCache, plss_index:ld_plss.PLSSIndex, first_div:str, second_div:SecondDivSet) -> list:
     '''
-    Normalize the township number
+    The record's PLSS features dissolved into one geometry (none if there
+    are no features), from the geometry cache, or looked up, dissolved
+    and added to it. Lookup errors are raised as RuntimeError and not
+    cached.
     '''
-    if township_field is None or not isinstance(township_field, str):
-        raise ValueError('Non-string value presented in township data')
-    elif len(township_field) == 0:
-        raise ValueError('Empty string presented in township data')
+    cache_key = geometry_cache.get_key(first_div, second_div)
+    wkb = geometry_cache.get(cache_key)
 
-    test_string = township_field.lower()
-    test_string = test_string.replace(' ', '')
+    if wkb is None:
+        plss_shapes = plss_index.get_shapes(first_div, second_div)
+        wkb = b''
+        if plss_shapes:
+            polygon, _ = ld_dissolve.dissolve_pieces([ld_dissolve.to_polygon(store, plss_shape) for plss_shape in plss_shapes],
+                                                     cfg.DISSOLVE_XY_RESOLUTION, cfg.DISSOLVE_XY_TOLERANCE)
+            if not polygon.is_empty:
+                wkb = polygon.to_wkb()
+        geometry_cache.put(cache_key, wkb)
 
-    if 'n' not in test_string and 's' not in test_string:
-        raise ValueError('No directional value provided in township data')
-
-    if 'n' in test_string:
-        township_direction = 'N'
-        test_string = test_string.replace('n', '')
-    else:
-        township_direction = 'S'
-        test_string = test_string.replace('s', '')
-
-    if '.5' in test_string:
-        township_fraction = '2'
-        test_string = test_string.replace('.5', '')
-    else:
-        township_fraction = '0'
+    if wkb == b'':
+        return []
 
-    if not test_string.isdigit():
-        raise ValueError('Unknown characters in township data')
+    return [store.from_wkb(wkb)]
 
-    padding = 3 - len(test_string)
-    township_num = '0' * padding
-    township_num = township_num + test_string
 
-    # format of ID: NNNFD
-        # NNN 3 digits, starting with zero
-        # F fractional - either 0, 2
-        # D directional - either N or S
-
-    township_id = township_num + township_fraction + township_direction
-
-    return township_id
-
-
-def get_range(range_field:str) -> str:
+def get_plss_features(data_records:list, audit_store:ld_audit.AuditStore, add_features:Callable[[dict, list], None], geometry_cache:ld_cache.GeometryCache = None) -> int:
     '''
-    Normalize the range number
-    '''
-    if range_field is None or not isinstance(range_field, str):
-        raise ValueError('Non-string value presented in range data')
-    elif len(range_field) == 0:
-        raise ValueError('Empty string presented in reange data')
-
-    test_string = range_field.lower()
-    test_string = test_string.replace(' ', '')
-
-    if 'e' not in test_string and 'w' not in test_string:
-        raise ValueError('No directional value provided in range data')
+    Get the PLSS features for the given data records. add_features is
+    called once for each record with the record and its PLSS geometries
+    (none if the lookup failed).
+    Return the number of error records written to the audit store
 
-    if 'e' in test_string:
-        range_direction = 'E'
-        test_string = test_string.replace('e', '')
-    else:
-        range_direction = 'W'
-        test_string = test_string.replace('w', '')
-
-    if '.5' in test_string:
-        range_fraction = '2'
-        test_string = test_string.replace('.5', '')
-    else:
-        range_fraction = '0'
-
-    if not test_string.isdigit():
-        raise ValueError('Unknown characters in range data')
-
-    padding = 3 - len(test_string)
-    range_num = '0' * padding
-    range_num = range_num + test_string
-
-    # format of ID: NNNFD
-        # NNN 3 digits, starting with zero
-        # F fractional - either 0, 2
-        # D directional - either N or S
-
-    range_id = range_num + range_fraction + range_direction
-
-    return range_id
-
-
-def get_section(section_num:Union[int, str]) -> str:
-    '''
-    Normalize the section number. Can accept either
-    string or integer input
-    '''
-    if section_num is None:
-        raise ValueError('Empty value value in section number')
-
-    section = str(section_num)
-
-    if not section.isdigit():
-        raise ValueError('Unable to resolve section number to a digit')
-    elif len(section) > 2:
-        raise ValueError('Section greater than two digits presented. Unable to process.')
-
-    if len(section) == 1:
-        section = "0" + section
-
-    return section
-
-
-def write_error_file(error_records:List[list], field_names:list, output_folder:str) -> None:
-    '''
-    Write the error records out to a csv file
+    The PLSS features are looked up in a PLSSIndex, which reads the
+    PLSS layer in batches of first divisions (see PLSS_QUERY_BATCH_SIZE
+    and PLSS_INDEX_MAX_MB in config.py), not once per record. With a
+    geometry cache, a record's features come dissolved into one geometry,
+    and the records found in the cache are not looked up.
     '''
-    time_stamp = dt.now().strftime('%Y%m%d_%H%M')
-    audit_file_name = f'{cfg.AUDIT_FILE_NAME}_{time_stamp}.csv'
-    audit_file = os.path.join(output_folder, audit_file_name)
-
-    with open(audit_file, 'w', encoding='UTF-8', newline ='') as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow(field_names)
-        writer.writerows(error_records)
+    error_count = 0
 
+    total_records = len(data_records)
+    log.info(f'{total_records} to check for PLSS')
 
-def check_first_div(data_to_check:pd.DataFrame) -> Tuple[pd.DataFrame, list]:
-    '''
-    Parse the PLSS first div entry out of the data in the dataframe.
-    Return an updated data frame with a First_Div column added. Post
-    any records that will not parse to the error log. Also return a
-    list of these error records.
-    '''
-    error_records = []
-    index_to_drop = []
-    updated_df = data_to_check.assign(First_Div = None, ErrorMsg = '')
-
-    for index, data_row in updated_df.iterrows():
-        error_msg = ''
-        try:
-            meridian_num = get_meridian(data_row['Meridian'])
-        except ValueError as err:
-            error_msg = f'{error_msg}; {str(err)}'
+    cached_keys = set()
+    if geometry_cache is not None:
+        cached_keys = geometry_cache.load(geometry_cache.get_key(data_record[FIRST_DIV], data_record[SECOND_DIV]) for data_record in data_records)
 
-        try:
-            township_num = get_township(data_row['Township'])
-        except ValueError as err:
-            error_msg = f'{error_msg}; {str(err)}'
+    plss_index = ld_plss.PLSSIndex(store, cfg.PLSS, cfg.PLSS_INDEX_MAX_MB * 1024 * 1024, cfg.PLSS_QUERY_BATCH_SIZE)
+    plss_index.plan_batches(data_record[FIRST_DIV] for data_record in data_records
+                            if geometry_cache is None or geometry_cache.get_key(data_record[FIRST_DIV], data_record[SECOND_DIV]) not in cached_keys)
 
-        try:
-            range_num = get_range(data_row['Range'])
-        except ValueError as err:
-            error_msg = f'{error_msg}; {str(err)}'
+    for record_count, data_record in enumerate(data_records,1):
+        plss_shapes = []
 
         try:
-            section_num = get_section(data_row['Section#'])
-        except ValueError as err:
-            error_msg = f'{error_msg}; {str(err)}'
-
-        if len(error_msg) > 0:
-            error_msg = error_msg[2:] # remove leading '; '
-            updated_df.at[index, ['ErrorMsg']] = (error_msg)
-            index_to_drop.append(index)
-
-        else:
-            first_div = f'CO{meridian_num}{township_num}{range_num}0SN{section_num}0'
-            updated_df.at[index, [FIRST_DIV]] = (first_div)
-
-    if len(index_to_drop) > 0:
-        error_df = updated_df.loc[updated_df['ErrorMsg'] != '']
-        # error_df.drop(columns=FIRST_DIV, inplace=True)
-        error_df = error_df.drop(columns=FIRST_DIV)
-        error_records = error_df.values.tolist()
+            if geometry_cache is None:
+                plss_shapes = plss_index.get_shapes(data_record[FIRST_DIV], data_record[SECOND_DIV])
+            else:
+                plss_shapes = get_cached_shapes(geometry_cache, plss_index, data_record[FIRST_DIV], data_record[SECOND_DIV])
+        except RuntimeError as run_err:
+            err_msg = f"Runtime error. Transaction number: {data_record['Transaction Number']} ERROR: {run_err}"
+            log.error(err_msg)
+            error_record = [value for key, value in data_record.items() if key not in [FIRST_DIV, SECOND_DIV]]
+            audit_store.add(ld_audit.STAGE_PLSS, ld_audit.ERROR, 'PLSS_QUERY_FAILED', error_record, err_msg)
+            error_count += 1
 
-        updated_df.drop(index_to_drop, inplace=True)
+        add_features(data_record, plss_shapes)
 
-    updated_df.drop(columns='ErrorMsg', inplace=True)
+        if len(plss_shapes) == 0:
+            plss_query = ld_plss.get_record_query(data_record[FIRST_DIV], data_record[SECOND_DIV])
+            err_msg = f"No PLSS records found for query: {plss_query}"
+            log.error(f"{err_msg} Transaction number: {data_record['Transaction Number']}")
+            error_record = [value for key, value in data_record.items() if key not in [FIRST_DIV, SECOND_DIV]]
+            audit_store.add(ld_audit.STAGE_PLSS, ld_audit.ERROR, 'PLSS_NOT_FOUND', error_record, err_msg)
+            error_count += 1
 
-    return updated_df, error_records
+        if record_count % 1000 == 0:
+            log.info(f'{record_count} of {total_records} processed by PLSS check')
 
+    log.info(f'PLSS index: {plss_index.hits} hits, {plss_index.misses} misses, {plss_index.evictions} evictions, {plss_index.query_count} queries for {total_records} records')
+    if geometry_cache is not None:
+        log.info(f'Geometry cache: {geometry_cache.hits} hits, {geometry_cache.misses} misses')
 
-def check_second_div(data_to_check:pd.DataFrame) -> Tuple[dict, list, list]:
-    '''
-    Check the second div entries and compile list for PLSS check and audit
-    report
-    '''
-    index_to_drop = []
-    index_of_warnings = []
+    return error_count
 
-    data_records = data_to_check.to_dict('index')
 
-    for index, data_record in data_records.items():
-        if data_record['Legal Description'] is None or len(data_record['Legal Description']) == 0:
-            data_record[SECOND_DIV] = ['ALL']
-        else:
-            try:
-                results_2nd_div = ld_parser.get_2nd_div(data_record['Legal Description'])
-            except ValueError as results_err:
-                data_record['ErrorMsg'] = str(results_err)
-                index_to_drop.append(index)
-            else:
-                data_record[SECOND_DIV] = results_2nd_div['lookups']
-                warning_msg = ''
-                if len(results_2nd_div['fractionals']) > 0:
-                    warning_msg = f"{warning_msg}; Review these fractionals not processed: {results_2nd_div['fractionals']}"
-                if len(results_2nd_div['fall_outs']) > 0:
-                    warning_msg = f"{warning_msg}; Review these remnants not processed: {results_2nd_div['fall_outs']}"
-                if len(warning_msg) > 0:
-                    warning_msg = f'AUDIT ONLY: {warning_msg[2:]}' # removed leading '; '
-                    warning_msg = f"{warning_msg} >> First_Div value: {data_record[FIRST_DIV]} Second_Div value(s): {results_2nd_div['lookups']}"
-                    data_record['WarningMsg'] = warning_msg
-                    index_of_warnings.append(index)
-
-    return (data_records, index_to_drop, index_of_warnings)
-
-
-def get_2nd_div_error_records(err_type:str, records:dict, col_names:list) -> list:
+def get_dissolve_fc(scratch:ld_scratch.ScratchWorkspace, plss_layer:ld_scratch.ScratchLayer) -> ld_scratch.ScratchLayer:
     '''
-    Parse out the records that have error or warning messages. Reorder data
-    to match original data attribute sequence.
+    Dissolve the PLSS features into one record per transaction, in a
+    temp layer of the scratch workspace
     '''
-    if err_type not in ['WarningMsg', 'ErrorMsg']:
-        raise KeyError(f'Unknown error type presented: {err_type}')
+    dissolve_layer = scratch.output_layer('temp_Dissolve_lyr', plss_layer.size)
 
-    records_with_errors = []
+    store.dissolve(plss_layer.path, dissolve_layer.path, cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD])
 
-    second_div_warnings = {index:value for index, value in records.items() if value.get(err_type)}
+    return dissolve_layer
 
-    for data_record in second_div_warnings.values():
-        error_record = [data_record.get(key, None) for key in col_names]
-        error_record.append(data_record[err_type])
-        records_with_errors.append(error_record)
 
-    return records_with_errors
-
-
-def get_plss_features(output_lyr_name:str, output_gdb:str, template_lyr:str, data_records:dict) -> Tuple[str, list]:
+def get_dissolve_shapes(output_gdb:str, template_lyr:str, data_records:list, audit_store:ld_audit.AuditStore, geometry_cache:ld_cache.GeometryCache = None) -> Tuple[dict, int]:
     '''
-    Get the PLSS features for the given data record
-    Return the path to the temp PLSS feature layer and a list
-    of error records
+    Look up the PLSS features of the records and dissolve them by
+    transaction number, with the engine set by DISSOLVE_ENGINE in
+    config.py:
+      'inprocess' dissolves each transaction as its last record is
+                  looked up (see ld_dissolve)
+      'pairwise'  writes the temp PLSS layer and dissolves it with the
+                  feature store (PairwiseDissolve in ArcGIS Pro). The
+                  temp layers go through a ScratchWorkspace, in memory
+                  up to SCRATCH_MEMORY_MB, else in a scratch workspace
+                  next to the output gdb.
+    With a geometry cache (inprocess only), each record's features are
+    dissolved, or taken from the cache, before the transaction is.
+    Return the dissolved geometries by transaction number (as text) and
+    the number of PLSS error records
     '''
-    error_records = []
-    reverse_lookup = {value:key for key, value in cfg.FIELD_MAPPING.items()}
-    insert_fields = list(cfg.FIELD_MAPPING.values())
-    insert_fields.append('SHAPE@')
-
-    temp_plss_lyr = os.path.join(output_gdb, output_lyr_name)
-
-    if arcpy.Exists(temp_plss_lyr):
-        arcpy.Delete_management(temp_plss_lyr)
-
-    arcpy.CreateFeatureclass_management(
-        out_path=output_gdb,
-        out_name=output_lyr_name,
-        geometry_type='POLYGON',
-        template=template_lyr
-        )
-
-    total_records = len(data_records)
-    log.info(f'{total_records} to check for PLSS')
+    data_records = list(data_records)
 
-    with arcpy.da.InsertCursor(temp_plss_lyr, insert_fields) as plss_insert:
-        for record_count, data_record in enumerate(data_records,1):
-            insert_count = 0
+    if cfg.DISSOLVE_ENGINE == 'pairwise':
+        reverse_lookup = {value:key for key, value in cfg.FIELD_MAPPING.items()}
+        insert_fields = list(cfg.FIELD_MAPPING.values())
+        insert_fields.append('SHAPE@')
 
-            first_div_value = data_record[FIRST_DIV]
-            if data_record[SECOND_DIV][0] == 'ALL':
-                plss_query = f"FRSTDIVID = '{first_div_value}'"
-            elif len(data_record[SECOND_DIV]) == 1:
-                plss_query = f"FRSTDIVID = '{first_div_value}' AND SECDIVNO = '{data_record[SECOND_DIV][0]}'"
-            else:
-                second_div_tuple = tuple(data_record[SECOND_DIV])
-                plss_query = f"FRSTDIVID = '{first_div_value}' AND SECDIVNO IN {second_div_tuple}"
+        with ld_scratch.ScratchWorkspace(store, os.path.dirname(output_gdb), cfg.SCRATCH_MEMORY_MB * 1024 * 1024, log.info) as scratch:
+            plss_layer = scratch.create_layer('temp_PLSS_features', template=template_lyr)
 
-            try:
-                with arcpy.da.SearchCursor(cfg.PLSS, 'SHAPE@', plss_query) as plss_cursor:
-                    for plss_row in plss_cursor:
+            with scratch.insert_cursor(plss_layer, insert_fields) as plss_insert:
+                def add_features(data_record:dict, plss_shapes:list) -> None:
+                    for plss_shape in plss_shapes:
                         new_row = [data_record[reverse_lookup[field]] for field in insert_fields[:-1]] # trap for missing key?
-                        new_row.append(plss_row[0])
-
+                        new_row.append(plss_shape)
                         plss_insert.insertRow(new_row)
-                        insert_count += 1
-            except RuntimeError as run_err:
-                err_msg = f"Runtime error. Transaction number: {data_record['Transaction Number']} ERROR: {run_err}"
-                log.error(err_msg)
-                error_record = [value for key, value in data_record.items() if key not in [FIRST_DIV, SECOND_DIV]]
-                error_record.append(err_msg)
-                error_records.append(error_record)
-
-                # TODO make that 2nd div list a set somewhere as I am seeing duplicate elements
-
-            if insert_count == 0:
-                err_msg = f"No PLSS records found for query: {plss_query}"
-                log.error(f"{err_msg} Transaction number: {data_record['Transaction Number']}")
-                error_record = [value for key, value in data_record.items() if key not in [FIRST_DIV, SECOND_DIV]]
-                error_record.append(err_msg)
-                error_records.append(error_record)
-
-            if record_count % 1000 == 0:
-                log.info(f'{record_count} of {total_records} processed by PLSS check')
-
-    return temp_plss_lyr, error_records
-
-
-def get_dissolve_fc(plss_lyr:str, target_gdb:str ) -> str:
-    '''
-    Dissolve the PLSS features into one record per
-    '''
-    dissolve_name = "temp_Dissolve_lyr"
-    dissolve_fc = os.path.join(target_gdb, dissolve_name)
-
-    if arcpy.Exists(dissolve_fc):
-        arcpy.Delete_management(dissolve_fc)
-
-    arcpy.PairwiseDissolve_analysis(
-        in_features = plss_lyr,
-        out_feature_class = dissolve_fc,
-        dissolve_field = cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD]
-    )
-
-    return dissolve_fc
 
+                error_count = get_plss_features(data_records, audit_store, add_features)
 
-def consolidate_new_data(records_to_check:dict, acres_index:int) -> dict:
-    '''
-    Consolidate the data down to one record per key, summing the acres
-    '''
-    #TODO Issue: In test data, potentially different Legal Description, TRS for multiple records. What gets put into GIS Layer?
+            log.info(f'Performing dissolve of PLSS features using {cfg.DISSOLVE_FIELD} field')
+            dissolve_layer = get_dissolve_fc(scratch, plss_layer)
+            scratch.delete_layer(plss_layer)
 
-    keys_to_add = []
-    data_to_insert = {}
+            dissolve_shapes = {}
+            for key, shape in store.search(dissolve_layer.path, [cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD], 'SHAPE@']):
+                if key is not None:
+                    dissolve_shapes.setdefault(str(key), []).append(shape)
 
-    for data_record in records_to_check.values():
-        key_field_value = data_record[cfg.DISSOLVE_FIELD]
-        if key_field_value not in keys_to_add:
-            keys_to_add.append(key_field_value)
-            insert_data = [data_record[field_name] for field_name in cfg.FIELD_MAPPING]
-            data_to_insert[key_field_value] = insert_data
-        else:
-            data_to_insert[key_field_value][acres_index] = add_acres(data_to_insert[key_field_value][acres_index], data_record[cfg.ACRES_FIELD])
+        return dissolve_shapes, error_count
 
-    return data_to_insert
+    elif cfg.DISSOLVE_ENGINE != 'inprocess':
+        raise ValueError(f'Unknown DISSOLVE_ENGINE: {cfg.DISSOLVE_ENGINE}')
 
+    # Records without a transaction number are looked up but not dissolved
+    def get_key(data_record:dict) -> str:
+        key = data_record[cfg.DISSOLVE_FIELD]
+        return None if pd.isna(key) else str(key)
 
-def add_acres(x:Union[float, None], y:Union[float, None]) -> Union[float, None]:
-    '''
-    Add the acres up, taking into account None values
-    '''
-    if x is None and y is None:
-        return None
-    elif x is None:
-        return y
-    elif y is None:
-        return x
-    else:
-        return float(x) + float(y)
+    record_counts = Counter(get_key(data_record) for data_record in data_records)
+    dissolver = ld_dissolve.TransactionDissolver(store, record_counts, cfg.DISSOLVE_XY_RESOLUTION, cfg.DISSOLVE_XY_TOLERANCE)
 
+    def add_features(data_record:dict, plss_shapes:list) -> None:
+        key = get_key(data_record)
+        if key is not None:
+            dissolver.add_record(key, plss_shapes)
 
-def check_acres(original_data:pd.DataFrame, data_to_insert:dict, new_records:dict, acres_index:int) -> list:
-    '''
-    Check the consolidated acres after the 2nd Div and PLSS processing against the
-    original data import. If any records were dropped due to errors, it will be
-    flagged here
-    '''
-    error_records = []
-    col_names = original_data.columns.to_list()
-    for key, data_values in data_to_insert.items():
-        total_original_acres = original_data.loc[original_data[cfg.DISSOLVE_FIELD] == key, cfg.ACRES_FIELD].sum()
-        if total_original_acres != data_values[acres_index]:
-            warning_msg = f'WARNING: Acres mismatch on {key}. Original:{total_original_acres} Insert: {data_values[acres_index]}'
+    log.info(f'Dissolving PLSS features in process using {cfg.DISSOLVE_FIELD} field')
+    error_count = get_plss_features(data_records, audit_store, add_features, geometry_cache)
+    log.info(f'In-process dissolve: {dissolver}')
 
-            # Need to get the data in a consistent order, so going back to this source
-            for data_record in new_records.values():
-                if data_record[cfg.DISSOLVE_FIELD] == key:
-                    error_record = [data_value for data_key, data_value in data_record.items() if data_key in col_names]
-                    break
-
-            error_record.append(warning_msg)
-            error_records.append(error_record)
-
-    return error_records
+    return {key: [shape] for key, shape in dissolver.shapes.items()}, error_count
 
 
 def main(excel_file, output_gdb, gis_layer, output_folder):
@@ -596,7 +364,7 @@ def main(excel_file, output_gdb, gis_layer, output_folder):
     Create new lease layer combination of Excel data and PLSS
     polygons
     '''
-    if not arcpy.Exists(gis_layer):
+    if not store.exists(gis_layer):
         log.error(f'Cannot find the target GIS layer {gis_layer}')
         return
 
@@ -608,130 +376,204 @@ def main(excel_file, output_gdb, gis_layer, output_folder):
         log.error(f'Cannot locate report folder for output: {output_folder}')
         return
 
-    if not arcpy.Exists(cfg.PLSS):
+    if not store.exists(cfg.PLSS):
         log.error(f'Cannot locate PLSS layer: {cfg.PLSS}')
         return
 
-    if not arcpy.Exists(output_gdb):
+    if not store.exists(output_gdb):
         log.error(f'Cannot locate output GDB: {output_gdb}')
         return
 
-    arcpy.env.workspace = output_gdb
-    arcpy.overwriteOutputs = True
-    arcpy.env.overwriteOutput = True
-    spatial_ref = arcpy.Describe(gis_layer).spatialReference
-    arcpy.env.outputCoordinateSystem = spatial_ref
+    store.configure_environment(output_gdb, gis_layer)
+
+    # Rules that do not fit the GIS layer would fail the insert at the end of the run
+    rule_problems = ld_consolidate.check_rule_fields(store.field_definitions(gis_layer))
+    if rule_problems:
+        for rule_problem in rule_problems:
+            log.error(f'{rule_problem}. Correct CONSOLIDATION_RULES in config.py and rerun script.')
+        return
 
-    error_file_entries = []
+    if cfg.PARSER_INSTRUMENTATION:
+        ld_parser.enable_instrumentation()
 
     log.info('Getting excel data')
     lease_data_df = get_excel_data(excel_file)
     excel_col_names = lease_data_df.columns.to_list()
 
+    # Records are written to the audit file as they are found
+    time_stamp = dt.now().strftime('%Y%m%d_%H%M')
+    audit_file = os.path.join(output_folder, f'{cfg.AUDIT_FILE_NAME}_{time_stamp}.csv')
+    audit_store = ld_audit.AuditStore(audit_file, excel_col_names, mirror_log=error_log.info)
+    log.info(f'Writing error and audit records to {audit_file}')
+
     log.info('Checking the Excel data for errors')
-    lease_data_df, error_file_entries = _check_lease_update_data(lease_data_df)
-    log.info(f'{len(error_file_entries)} records removed from the Excel data. See error file.')
+    lease_data_df, error_records = ld_checks.check_lease_update_data(lease_data_df)
+    audit_store.add_records(ld_audit.STAGE_LEASE_DATA, ld_audit.ERROR, 'FIELDS_MISMATCH', error_records)
+    log.info(f'{len(error_records)} records removed from the Excel data. See error file.')
 
     log.info('Checking for updates and adds to GIS layer')
-    gis_lyr_keys = set(row[0] for row in arcpy.da.SearchCursor(gis_layer, cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD]))
+    gis_lyr_keys = store.scan_keys(gis_layer, cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD])
 
     records_to_update_df = lease_data_df[lease_data_df[cfg.DISSOLVE_FIELD].isin(gis_lyr_keys)]
     records_to_add_df = lease_data_df[~lease_data_df[cfg.DISSOLVE_FIELD].isin(gis_lyr_keys)]
 
+    replace_keys = set()
+    replaced_keys = set()
+    if cfg.DELTA_MODE:
+        # Records not in the GIS layer are always offered to the adds, as in a
+        # full run, so earlier failures are retried. Only the updates are cut down.
+        delta_state_file = os.path.join(cfg.LOG_FILE_FOLDER, cfg.DELTA_STATE_NAME)
+        previous_hashes = ld_delta.load_delta_state(delta_state_file)
+        transaction_hashes = ld_delta.get_transaction_hashes(lease_data_df)
+        transaction_status, disappeared_keys = ld_delta.classify_transactions(transaction_hashes, previous_hashes)
+
+        for status, status_count in transaction_status.value_counts().items():
+            log.info(f'Delta mode: {status_count} transactions {status}')
+        log.info(f'Delta mode: {len(disappeared_keys)} transactions no longer in the extract')
+        log.debug(f'Transactions no longer in the extract: {disappeared_keys}')
+
+        update_status = ld_delta.get_record_status(records_to_update_df, transaction_status)
+        legal_changed_df = records_to_update_df[update_status == ld_delta.LEGAL_CHANGED]
+        records_to_update_df = records_to_update_df[update_status != ld_delta.UNCHANGED]
+
+        # Geometry of transactions already in the layer whose legal description
+        # changed is rebuilt through the adds, and replaces their features
+        replace_keys = set(legal_changed_df[cfg.DISSOLVE_FIELD])
+        records_to_add_df = lease_data_df[lease_data_df.index.isin(records_to_add_df.index) | lease_data_df.index.isin(legal_changed_df.index)]
+
     log.debug(f'{records_to_update_df.shape[0]} possible update records')
     log.debug(f'{records_to_add_df.shape[0]} possible records to add')
 
     log.info('Processing updates...')
     records_to_update_df = records_to_update_df.drop_duplicates()
-    gis_fields = [cfg.FIELD_MAPPING[field] for field in cfg.FIELD_MAPPING if field in cfg.UPDATE_FIELDS]
+    excel_update_fields = [field for field in cfg.FIELD_MAPPING if field in cfg.UPDATE_FIELDS]
+    gis_fields = [cfg.FIELD_MAPPING[field] for field in excel_update_fields]
 
     update_fields = [cfg.DISSOLVE_FIELD]
-    update_fields.extend(cfg.UPDATE_FIELDS)
+    update_fields.extend(excel_update_fields)
     update_values_only_df = records_to_update_df[update_fields]
 
-    log.info('Applying updates against GIS data')
-    record_count = 0
-    for data_row in update_values_only_df.itertuples(index=False):
-        data_to_update = list(data_row)
+    # The last record of a transaction wins, as when each record was written in turn
+    update_values = {data_row[0]: data_row[1:] for data_row in update_values_only_df.itertuples(index=False, name=None)}
 
-        query = f"{cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD]} = '{data_to_update[0]}'"
-        with arcpy.da.UpdateCursor(gis_layer, gis_fields, query) as update_cursor:
-            for gis_row in update_cursor:
-                record_count += 1
-                update_cursor.updateRow(data_to_update[1:])
+    log.info('Applying updates against GIS data')
+    sync_counts = ld_store.sync_attributes(store, gis_layer, cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD], gis_fields, update_values)
 
-    log.info(f'{record_count} records updated in GIS layer')
+    log.info(f"{sync_counts['updated']} records updated in GIS layer, {sync_counts['unchanged']} already up to date")
+    if sync_counts['missing'] > 0:
+        log.warning(f"{sync_counts['missing']} transactions to update were not found in the GIS layer")
 
     log.info('Processing new additions...')
-    new_records_df, error_records = check_first_div(records_to_add_df)
-    error_file_entries.extend(error_records)
-
+    parse_cache = None
+    if cfg.USE_PARSE_CACHE:
+        parse_cache = ld_cache.ParseCache(os.path.join(cfg.LOG_FILE_FOLDER, cfg.PARSE_CACHE_NAME))
+
+    try:
+        new_records_df, error_records = ld_checks.check_divisions(records_to_add_df, parse_cache, cfg.DIVISION_CHECK_WORKERS)
+    finally:
+        if parse_cache is not None:
+            parse_cache.close()
+            log.info(f'Parse cache: {parse_cache.hits} hits, {parse_cache.misses} misses')
+
+    audit_store.add_records(ld_audit.STAGE_FIRST_DIV, ld_audit.ERROR, 'FIRST_DIV_INVALID', error_records)
     log.info(f'{len(error_records)} errors found in First Division check')
-    for record in error_records:
-        error_log.info(record)
-
-    new_records, index_to_drop, index_of_warnings = check_second_div(new_records_df)
-
-    error_records = []
-    if len(index_to_drop) > 0:
-        error_records = get_2nd_div_error_records('ErrorMsg', new_records, excel_col_names)
-        error_file_entries.extend(error_records)
-
-        # new_records = {index:value for index, value in new_records.items() if value.get('ErrorMsg') is not None}
-        new_records = {index:value for index, value in new_records.items() if value.get('ErrorMsg') is None}
 
+    error_records = ld_checks.get_2nd_div_error_records('ErrorMsg', new_records_df, excel_col_names)
+    audit_store.add_records(ld_audit.STAGE_SECOND_DIV, ld_audit.ERROR, 'SECOND_DIV_UNPARSED', error_records)
+    new_records_df = new_records_df.loc[new_records_df['ErrorMsg'].isna()]
     log.info(f'{len(error_records)} errors found in Second Division check')
-    for record in error_records:
-        error_log.info(record)
-
-    error_records = []
-    if len(index_of_warnings) > 0:
-        error_records = get_2nd_div_error_records('WarningMsg', new_records, excel_col_names)
-        error_file_entries.extend(error_records)
-
-        for index, value in new_records.items():
-            new_records[index] = {key:data_record for key, data_record in value.items() if key != 'WarningMsg'}
 
+    error_records = ld_checks.get_2nd_div_error_records('WarningMsg', new_records_df, excel_col_names)
+    audit_store.add_records(ld_audit.STAGE_SECOND_DIV, ld_audit.AUDIT, 'SECOND_DIV_REVIEW', error_records)
     log.info(f'{len(error_records)} records with audit data to review in Second Division check')
-    for record in error_records:
-        error_log.info(record)
+
+    new_records = new_records_df.drop(columns=['WarningMsg', 'ErrorMsg']).to_dict('index')
 
     if len(new_records) > 0:
         log.info('Getting PLSS features for the additional records')
-        plss_features_lyr_name = 'temp_PLSS_features'
-
-        plss_features_lyr, error_records = get_plss_features(plss_features_lyr_name,
-                                                                output_gdb,
-                                                                template_lyr=gis_layer,
-                                                                data_records=new_records.values())
-
-        log.info(f'{len(error_records)} errors occured in the PLSS lookup')
-        error_file_entries.extend(error_records)
-
-        log.info(f'Performing dissolve of PLSS features using {cfg.DISSOLVE_FIELD} field')
-        dissolve_fc = get_dissolve_fc(plss_features_lyr, output_gdb)
-
-        acres_index = list(cfg.FIELD_MAPPING.keys()).index(cfg.ACRES_FIELD)
+        geometry_cache = None
+        if cfg.USE_GEOMETRY_CACHE and cfg.DISSOLVE_ENGINE == 'inprocess':
+            # A change of resolution or tolerance changes the dissolved geometries too
+            source_stamp = f'{store.get_source_stamp(cfg.PLSS)}|{cfg.DISSOLVE_XY_RESOLUTION}|{cfg.DISSOLVE_XY_TOLERANCE}'
+            geometry_cache = ld_cache.GeometryCache(os.path.join(cfg.LOG_FILE_FOLDER, cfg.GEOMETRY_CACHE_NAME),
+                                                    source_stamp,
+                                                    cfg.GEOMETRY_CACHE_MAX_MB * 1024 * 1024)
+        try:
+            dissolve_shapes, error_count = get_dissolve_shapes(output_gdb,
+                                                               template_lyr=gis_layer,
+                                                               data_records=new_records.values(),
+                                                               audit_store=audit_store,
+                                                               geometry_cache=geometry_cache)
+        finally:
+            if geometry_cache is not None:
+                geometry_cache.close()
+                log.info(f'Geometry cache: {geometry_cache.evictions} evicted')
+
+        log.info(f'{error_count} errors occured in the PLSS lookup')
 
         log.info('Consolidating the attribute data from new records to get total acres')
-        data_to_insert = consolidate_new_data(new_records, acres_index)
-
-        error_records = check_acres(lease_data_df, data_to_insert, new_records, acres_index)
-        error_file_entries.extend(error_records)
-        for error_msg in error_records:
-            log.info(error_msg)
-            error_log.info(error_msg)
+        first_record_index = ld_consolidate.get_first_record_index(new_records_df)
+        data_to_insert = ld_consolidate.consolidate_new_data(new_records_df, first_record_index)
+
+        original_acres = ld_consolidate.get_original_acres(lease_data_df)
+        error_records = ld_consolidate.check_acres(original_acres, data_to_insert[cfg.ACRES_FIELD], new_records_df, first_record_index, excel_col_names)
+        audit_store.add_records(ld_audit.STAGE_ACRES, ld_audit.WARNING, 'ACRES_MISMATCH', error_records)
+        for error_record in error_records:
+            log.info(error_record[-1])
+
+        # Checked before the GIS layer is changed
+        rule_problems = ld_consolidate.check_rule_lengths(data_to_insert, store.field_lengths(gis_layer))
+        if rule_problems:
+            for rule_problem in rule_problems:
+                log.error(f'{rule_problem}. Correct CONSOLIDATION_RULES in config.py or widen the field and rerun script.')
+            audit_store.close()
+            return
+
+        if replace_keys:
+            # Old features are only removed where the new geometry is ready
+            replaced_keys = {key for key in data_to_insert.index if key in replace_keys and dissolve_shapes.get(str(key))}
+            delete_count = ld_store.delete_features(store, gis_layer, cfg.FIELD_MAPPING[cfg.DISSOLVE_FIELD], replaced_keys)
+            log.info(f'{delete_count} features removed from the GIS layer for {len(replaced_keys)} transactions with a changed legal description')
 
         log.info('Merging data into gis layer')
-        insert_new_data(gis_layer, dissolve_fc, data_to_insert)
+        insert_count, missing_shape_keys, missing_data_keys = insert_new_data(gis_layer, dissolve_shapes, data_to_insert)
+        log.info(f'{insert_count} features added to the GIS layer')
+        if missing_shape_keys:
+            log.info(f'{len(missing_shape_keys)} transactions with no PLSS geometry were not added')
+            log.debug(f'Transactions with no PLSS geometry: {missing_shape_keys}')
+        if missing_data_keys:
+            log.warning(f'{len(missing_data_keys)} dissolved transactions had no data to add: {missing_data_keys}')
 
     else:
         log.info('No new records now available to be added')
 
-    log.info('Creating CSV file of error records')
-    field_names = excel_col_names[:]
-    field_names.append('Error/Audit Messages')
-    write_error_file(error_file_entries, field_names, output_folder)
+    if cfg.DELTA_MODE:
+        # Changed transactions that could not be rebuilt keep their old geometry,
+        # and their old hashes so they are tried again on the next run
+        kept_keys = replace_keys - replaced_keys
+        for record in legal_changed_df[legal_changed_df[cfg.DISSOLVE_FIELD].isin(kept_keys)].values.tolist():
+            audit_store.add(ld_audit.STAGE_DELTA, ld_audit.AUDIT, 'LEGAL_DESCRIPTION_CHANGED', record,
+                            'AUDIT ONLY: Legal description changed since the last applied extract. GIS geometry not updated.')
+        transaction_hashes = ld_delta.keep_previous_hashes(transaction_hashes, previous_hashes, kept_keys)
+
+    audit_store.close()
+    for (stage, severity, code), record_count in audit_store.get_counts().items():
+        log.info(f'Audit file: {record_count} {severity} records from {stage} ({code})')
+
+    if cfg.AUDIT_XLSX_SUMMARY:
+        summary_file = os.path.join(output_folder, f'{cfg.AUDIT_FILE_NAME}_{time_stamp}.xlsx')
+        audit_store.write_summary(summary_file)
+        log.info(f'Audit summary written to {summary_file}')
+
+    if cfg.DELTA_MODE:
+        ld_delta.save_delta_state(delta_state_file, transaction_hashes)
+        log.info(f'Delta state saved to {delta_state_file}')
+
+    if cfg.PARSER_INSTRUMENTATION:
+        stats_file = os.path.join(output_folder, f'LD_Parser_Stats_{time_stamp}.json')
+        ld_parser.dump_instrumentation(stats_file)
+        ld_parser.disable_instrumentation()
+        log.info(f'Parser statistics written to {stats_file}')
 
     log.info('Processing completed')
 
@@ -739,6 +581,7 @@ def main(excel_file, output_gdb, gis_layer, output_folder):
 #<<<<<<<<<<<<<<<     >>>>>>>>>>>>>>>
 log = DualLogger(cfg.LOG_FILE_FOLDER, cfg.LOG_FILE_NAME, 'DEBUG')
 error_log = DualLogger(cfg.LOG_FILE_FOLDER, cfg.AUDIT_FILE_NAME, 'INFO', plain_format=True, arcpy_msg=False)
+store = ld_store.get_feature_store(cfg.FEATURE_STORE)
 
 if __name__ == '__main__':
 
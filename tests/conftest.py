@@ -0,0 +1,8 @@
+'''
+The toolbox modules import each other from the LD_Toolbox folder, as
+they do when run from the Pro toolbox
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'LD_Toolbox'))
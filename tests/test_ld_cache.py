@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ld_cache
+import ld_geometry
+from ld_divisions import SecondDivSet
+
+WKB = ld_geometry.polygon_from_extent(0, 0, 1, 1).to_wkb()
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / 'geometry_cache.sqlite')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ''' time.time of ld_cache, moved on with clock.now '''
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ld_cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_get_key_ignores_order():
+    key = ld_cache.GeometryCache.get_key('CO060010N0010W0SN010', SecondDivSet.from_elements(['SWSW', 'NENE']))
+
+    assert key == ld_cache.GeometryCache.get_key('CO060010N0010W0SN010', SecondDivSet.from_elements(['NENE', 'SWSW']))
+
+
+def test_saved_on_close(cache_file):
+    with ld_cache.GeometryCache(cache_file, 'stamp', 10 ** 6) as cache:
+        cache.put(('A', 'NENE'), WKB)
+        cache.put(('B', 'NENE'), b'')
+
+    with ld_cache.GeometryCache(cache_file, 'stamp', 10 ** 6) as cache:
+        assert cache.load([('A', 'NENE'), ('B', 'NENE'), ('C', 'NENE')]) == {('A', 'NENE'), ('B', 'NENE')}
+        assert cache.get(('A', 'NENE')) == WKB
+        assert cache.get(('B', 'NENE')) == b''
+        assert cache.get(('C', 'NENE')) is None
+        assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_cleared_when_the_source_stamp_changes(cache_file):
+    with ld_cache.GeometryCache(cache_file, 'stamp', 10 ** 6) as cache:
+        cache.put(('A', 'NENE'), WKB)
+
+    with ld_cache.GeometryCache(cache_file, 'new stamp', 10 ** 6) as cache:
+        assert cache.load([('A', 'NENE')]) == set()
+        cache.put(('A', 'NENE'), WKB)
+
+    with ld_cache.GeometryCache(cache_file, 'new stamp', 10 ** 6) as cache:
+        assert cache.load([('A', 'NENE')]) == {('A', 'NENE')}
+
+
+def test_least_recently_used_evicted(cache_file, clock):
+    max_bytes = len(WKB) * 2
+
+    with ld_cache.GeometryCache(cache_file, 'stamp', max_bytes) as cache:
+        cache.put(('A', 'NENE'), WKB)
+        cache.put(('B', 'NENE'), WKB)
+
+    # A is used again, so B is the one to go when C is added
+    clock.now += 1
+    with ld_cache.GeometryCache(cache_file, 'stamp', max_bytes) as cache:
+        cache.load([('A', 'NENE')])
+        cache.get(('A', 'NENE'))
+        cache.put(('C', 'NENE'), WKB)
+    assert cache.evictions == 1
+
+    with ld_cache.GeometryCache(cache_file, 'stamp', max_bytes) as cache:
+        assert cache.load([('A', 'NENE'), ('B', 'NENE'), ('C', 'NENE')]) == {('A', 'NENE'), ('C', 'NENE')}
+
+
+def test_read_only_parse_cache_hands_back_new_parses(tmp_path):
+    cache_file = str(tmp_path / 'parse_cache.sqlite')
+
+    with ld_cache.ParseCache(cache_file) as parse_cache:
+        parse_cache.get_2nd_div('NE4')
+
+    with ld_cache.ParseCache(cache_file, read_only=True) as worker_cache:
+        worker_cache.get_2nd_div('NE4')
+        worker_cache.get_2nd_div('SW4')
+        new_rows = worker_cache.get_new_rows()
+    assert (worker_cache.hits, worker_cache.misses) == (1, 1)
+    assert list(new_rows) == ['SW4']
+
+    # Nothing was written by the worker; the owner saves its parses
+    with ld_cache.ParseCache(cache_file) as parse_cache:
+        parse_cache.get_2nd_div('SW4')
+        assert parse_cache.misses == 1
+        parse_cache.add_new_rows(new_rows)
+    with ld_cache.ParseCache(cache_file) as parse_cache:
+        assert parse_cache.get_2nd_div('SW4')['lookups'] == ld_cache.ld_parser.get_2nd_div('SW4')['lookups']
+        assert parse_cache.hits == 1
+
+
+def test_read_only_parse_cache_skips_a_stale_file(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / 'parse_cache.sqlite')
+    with ld_cache.ParseCache(cache_file) as parse_cache:
+        parse_cache.get_2nd_div('NE4')
+
+    monkeypatch.setattr(ld_cache.ld_parser, 'get_source_hash', lambda: 'changed')
+    with ld_cache.ParseCache(cache_file, read_only=True) as worker_cache:
+        worker_cache.get_2nd_div('NE4')
+    assert worker_cache.misses == 1
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+import config as cfg
+import ld_consolidate
+import ld_store
+
+LEASE_FIELDS = [('Section', ld_store.LONG), ('GIS_Legal', ld_store.TEXT), ('Acreage', ld_store.DOUBLE), ('Lease_Star', ld_store.DATE)]
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    def set_rules(consolidation_rules):
+        monkeypatch.setattr(cfg, 'CONSOLIDATION_RULES', consolidation_rules)
+    return set_rules
+
+
+def test_default_rules_fit_the_lease_layer():
+    assert ld_consolidate.check_rule_fields(LEASE_FIELDS) == []
+
+
+def test_rules_that_do_not_fit_the_field_type(rules):
+    rules({'Section#': 'join_unique', 'Lease Status': 'join_unique', 'Legal Description': 'sum', 'Start Date (Letter Merge)': 'min'})
+
+    problems = ld_consolidate.check_rule_fields(LEASE_FIELDS)
+
+    # Lease_Stat is not in the layer, min keeps the Excel values
+    assert len(problems) == 2
+    assert 'Section' in problems[0] and 'GIS_Legal' in problems[1]
+
+
+def test_unknown_rule(rules):
+    rules({'Acreage': 'average'})
+
+    assert ld_consolidate.check_rule_fields(LEASE_FIELDS) == ['Unknown consolidation rule for Acreage: average']
+
+
+def test_joined_values_longer_than_the_field(rules):
+    rules({'Legal Description': 'join_unique'})
+    data_to_insert = pd.DataFrame({'Legal Description': ['A' * 10, 'B' * 30, None, 'C' * 25]}, index=['T1', 'T2', 'T3', 'T4'])
+
+    assert ld_consolidate.check_rule_lengths(data_to_insert, {'GIS_Legal': 30}) == []
+    problems = ld_consolidate.check_rule_lengths(data_to_insert, {'GIS_Legal': 20})
+
+    assert len(problems) == 1
+    assert '2 values' in problems[0] and 'longest 30' in problems[0] and 'T2' in problems[0]
+    # No limit known for the field
+    assert ld_consolidate.check_rule_lengths(data_to_insert, {}) == []
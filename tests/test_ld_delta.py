@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+import config as cfg
+import ld_delta
+
+
+@pytest.fixture
+def extract():
+    records = {field: ['X', 'X', 'Y'] for field in cfg.FIELD_MAPPING}
+    records.update({
+        cfg.DISSOLVE_FIELD: ['AG-1', 'AG-1', 'AG-2'],
+        'Acreage': [40.0, 80.0, 160.0],
+        'Section#': [16, 16, 36],
+        'Legal Description': ['NE4', 'S2', 'ALL']
+        })
+    return pd.DataFrame(records)
+
+
+def classify(previous_df, current_df):
+    previous_hashes = ld_delta.get_transaction_hashes(previous_df)
+    previous = {key: list(values) for key, values in zip(previous_hashes.index, previous_hashes[['attributes', 'legal']].to_numpy())}
+
+    return ld_delta.classify_transactions(ld_delta.get_transaction_hashes(current_df), previous)[0]
+
+
+def test_legal_fields_are_the_geometry_fields():
+    _, legal_fields = ld_delta.get_hash_fields()
+
+    assert sorted(legal_fields) == sorted(['Meridian', 'Township', 'Range', 'Section#', 'Legal Description'])
+
+
+@pytest.mark.parametrize('field, value, status', [
+    ('Legal Description', 'N2', ld_delta.LEGAL_CHANGED),
+    ('Section#', 17, ld_delta.LEGAL_CHANGED),
+    ('Lessee(s)', 'NEW LESSEE', ld_delta.ATTRIBUTES_CHANGED),
+    ('Acreage', 41.0, ld_delta.UNCHANGED),
+    ('Lease Status', 'Expired', ld_delta.UNCHANGED)
+    ])
+def test_change_status(extract, field, value, status):
+    changed = extract.copy()
+    changed.loc[0, field] = value
+
+    transaction_status = classify(extract, changed)
+
+    assert transaction_status['AG-1'] == status
+    assert transaction_status['AG-2'] == ld_delta.UNCHANGED
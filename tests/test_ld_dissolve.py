@@ -0,0 +1,146 @@
+import math
+
+import pytest
+
+import ld_dissolve
+import ld_geometry
+
+RESOLUTION = 0.0001
+TOLERANCE = 0.001
+
+
+def square(x, y, width=400.0, height=400.0):
+    return ld_geometry.polygon_from_extent(x, y, x + width, y + height)
+
+
+def rotate(polygon, degrees):
+    angle = math.radians(degrees)
+    cos, sin = math.cos(angle), math.sin(angle)
+    return ld_geometry.Polygon([[[(x * cos - y * sin, x * sin + y * cos) for x, y in ring] for ring in part] for part in polygon.parts])
+
+
+def dissolve(polygons):
+    return ld_dissolve.dissolve_pieces(polygons, RESOLUTION, TOLERANCE)
+
+
+def test_shared_edges_cancel():
+    polygon, stats = dissolve([square(x * 400, y * 400) for x in range(4) for y in range(4)])
+
+    assert len(polygon.parts) == 1
+    assert len(polygon.parts[0]) == 1
+    assert polygon.area == pytest.approx(2560000)
+    # The points along the sides are dropped, the corners are left
+    assert len(ld_geometry.remove_collinear_points(polygon.parts[0][0])) == 5
+    assert stats == {'pieces': 16, 'duplicates': 0, 'fallback': 0}
+
+
+def test_duplicate_pieces_are_used_once():
+    polygon, stats = dissolve([square(0, 0), square(0, 0), square(400, 0)])
+
+    assert polygon.area == pytest.approx(320000)
+    assert stats['duplicates'] == 1
+    assert stats['fallback'] == 0
+
+
+def test_hole_is_kept():
+    pieces = [square(x * 400, y * 400) for x in range(3) for y in range(3) if (x, y) != (1, 1)]
+
+    polygon, stats = dissolve(pieces)
+
+    assert len(polygon.parts) == 1
+    assert len(polygon.parts[0]) == 2
+    assert polygon.area == pytest.approx(1280000)
+    assert stats['fallback'] == 0
+
+
+def test_parts_touching_at_a_corner_stay_apart():
+    polygon, stats = dissolve([square(0, 0), square(400, 400)])
+
+    assert len(polygon.parts) == 2
+    assert polygon.area == pytest.approx(320000)
+    assert stats['fallback'] == 0
+
+
+def test_t_junction():
+    # The vertex at (400, 400) of the top squares is inside the bottom edge
+    polygon, stats = dissolve([square(0, 0, 800, 400), square(0, 400), square(400, 400)])
+
+    assert len(polygon.parts) == 1
+    assert len(polygon.parts[0]) == 1
+    assert polygon.area == pytest.approx(640000)
+    assert stats['fallback'] == 0
+
+
+def test_t_junction_off_the_axes():
+    pieces = [rotate(piece, 7) for piece in [square(0, 0, 800, 400), square(0, 400), square(400, 400)]]
+
+    polygon, stats = dissolve(pieces)
+
+    assert len(polygon.parts) == 1
+    assert len(polygon.parts[0]) == 1
+    assert polygon.area == pytest.approx(640000, rel=1e-6)
+    assert stats['fallback'] == 0
+
+
+@pytest.mark.parametrize('pieces', [
+    [square(0, 0), square(400.0002, 0)],
+    [square(0, 0), ld_geometry.Polygon([[[(400, 0), (800, 0), (800, 400), (400, 400), (400.0003, 200), (400, 0)]]])]
+    ], ids=['gap', 'vertex_off_edge'])
+def test_within_tolerance_is_merged(pieces):
+    polygon, stats = dissolve(pieces)
+
+    assert len(polygon.parts) == 1
+    assert len(polygon.parts[0]) == 1
+    assert polygon.area == pytest.approx(320000, rel=1e-6)
+    assert stats['fallback'] == 0
+
+
+def test_beyond_tolerance_is_not_merged():
+    polygon, _ = dissolve([square(0, 0), square(400.01, 0)])
+
+    assert len(polygon.parts) == 2
+
+
+@pytest.mark.parametrize('pieces, area', [
+    ([square(0, 0), square(200, 0)], 240000),
+    ([square(0, 0), square(100, 100, 100, 100)], 160000),
+    ([rotate(square(0, 0), 13), rotate(square(200, 100), 13)], 260000),
+    ([square(0, 0, 800, 400), square(0, 400), square(400, 400), square(200, 200)], 640000)
+    ], ids=['partial', 'contained', 'rotated', 't_junction'])
+def test_overlaps_take_the_fallback_union(pieces, area):
+    polygon, stats = dissolve(pieces)
+
+    assert len(polygon.parts) == 1
+    assert len(polygon.parts[0]) == 1
+    assert polygon.area == pytest.approx(area, rel=1e-6)
+    assert stats['fallback'] == 1
+
+
+def test_matches_dissolve_polygons_on_a_grid():
+    pieces = [square(x * 400, y * 400) for x in range(3) for y in range(2)] + [square(1600, 0)]
+
+    polygon, _ = dissolve(pieces)
+    area_difference, same_vertices = ld_dissolve.compare_polygons(polygon, ld_geometry.dissolve_polygons(pieces), RESOLUTION)
+
+    assert area_difference == pytest.approx(0)
+    assert same_vertices
+
+
+def test_pieces_that_all_collapse_give_an_empty_polygon():
+    sliver = ld_geometry.Polygon([[[(0, 0), (1e-5, 0), (1e-5, 1e-5), (0, 0)]]])
+
+    polygon, stats = dissolve([sliver, sliver])
+
+    assert polygon.is_empty
+    assert stats == {'pieces': 2, 'duplicates': 0, 'fallback': 0}
+    assert dissolve([])[0].is_empty
+
+
+def test_collapsed_piece_is_left_out():
+    sliver = ld_geometry.Polygon([[[(400, 0), (400.0005, 0), (400.0005, 0.0005), (400, 0)]]])
+
+    polygon, stats = dissolve([square(0, 0), sliver])
+
+    assert len(polygon.parts) == 1
+    assert polygon.area == pytest.approx(160000)
+    assert stats['fallback'] == 0
@@ -0,0 +1,88 @@
+import struct
+from collections import Counter
+
+import pytest
+
+import ld_geometry
+
+
+def square(x, y, size=1.0):
+    return ld_geometry.polygon_from_extent(x, y, x + size, y + size)
+
+
+def ring_edges(ring):
+    return Counter(zip(ring, ring[1:]))
+
+
+def test_rings_from_edges_single_ring():
+    ring = [(0, 0), (2, 0), (2, 1), (0, 1), (0, 0)]
+
+    rings = ld_geometry.rings_from_edges(ring_edges(ring))
+
+    assert len(rings) == 1
+    assert rings[0][0] == rings[0][-1]
+    assert set(rings[0]) == set(ring)
+
+
+def test_rings_from_edges_exterior_and_hole():
+    exterior = [(0, 0), (3, 0), (3, 3), (0, 3), (0, 0)]
+    hole = [(1, 1), (1, 2), (2, 2), (2, 1), (1, 1)]
+
+    rings = ld_geometry.rings_from_edges(ring_edges(exterior) + ring_edges(hole))
+
+    assert sorted(abs(ld_geometry.signed_area(ring)) for ring in rings) == [1, 9]
+
+
+def test_rings_from_edges_splits_at_touching_corner():
+    # Two squares meeting only at (1, 1): the sharpest left turn keeps
+    # them as separate rings
+    edges = ring_edges([(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]) + ring_edges([(1, 1), (2, 1), (2, 2), (1, 2), (1, 1)])
+
+    rings = ld_geometry.rings_from_edges(edges)
+
+    assert len(rings) == 2
+    assert all(abs(ld_geometry.signed_area(ring)) == 1 for ring in rings)
+
+
+def test_rings_from_edges_drops_open_chains():
+    assert ld_geometry.rings_from_edges(Counter({((0, 0), (1, 0)): 1})) == []
+
+
+def test_wkb_round_trip_polygon_with_hole():
+    polygon = ld_geometry.Polygon([[
+        [(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)],
+        [(1, 1), (1, 2), (2, 2), (2, 1), (1, 1)]
+        ]])
+
+    wkb = polygon.to_wkb()
+
+    assert struct.unpack_from('<I', wkb, 1)[0] == ld_geometry.WKB_POLYGON
+    assert ld_geometry.Polygon.from_wkb(wkb).parts == polygon.parts
+
+
+def test_wkb_round_trip_multipart():
+    polygon = ld_geometry.Polygon(square(0, 0).parts + square(5, 5, 2).parts)
+
+    wkb = polygon.to_wkb()
+    round_trip = ld_geometry.Polygon.from_wkb(wkb)
+
+    assert struct.unpack_from('<I', wkb, 1)[0] == ld_geometry.WKB_MULTIPOLYGON
+    assert round_trip.parts == polygon.parts
+    assert round_trip.area == 5
+
+
+def test_wkb_reads_big_endian_and_z_values():
+    ring = [(0.0, 0.0, 7.0), (2.0, 0.0, 7.0), (2.0, 2.0, 7.0), (0.0, 2.0, 7.0), (0.0, 0.0, 7.0)]
+    wkb = struct.pack('>BII', 0, 1003, 1) + struct.pack('>I', len(ring)) + struct.pack(f'>{len(ring) * 3}d', *[value for point in ring for value in point])
+
+    polygon = ld_geometry.Polygon.from_wkb(wkb)
+
+    assert polygon.area == 4
+    assert polygon.parts[0][0][0] == (0.0, 0.0)
+
+
+def test_wkb_rejects_other_geometry_types():
+    point_wkb = struct.pack('<BIdd', 1, 1, 0.0, 0.0)
+
+    with pytest.raises(ValueError):
+        ld_geometry.Polygon.from_wkb(point_wkb)
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import ld_geometry
+import ld_plss
+import ld_store
+from ld_divisions import SecondDivSet
+
+FIRST_DIVS = ['A', 'B', 'C', 'BAD']
+
+
+class FailingStore(ld_store.SQLiteFeatureStore):
+    ''' SQLite store whose queries on the BAD first division fail '''
+    def search(self, path:str, fields:list, where:str = None, extent:tuple = None):
+        if where is not None and "'BAD'" in where:
+            raise RuntimeError(f'Query failed: {where}')
+        return super().search(path, fields, where, extent)
+
+
+@pytest.fixture
+def store():
+    store = FailingStore()
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def plss_path(tmp_path, store):
+    workspace = str(tmp_path / 'plss.sqlite')
+    plss_path = os.path.join(workspace, 'PLSS')
+    ld_store.SQLiteFeatureStore.create_workspace(workspace)
+    store.create_feature_class(plss_path, fields=[(ld_plss.FIRST_DIV_FIELD, ld_store.TEXT), (ld_plss.SECOND_DIV_FIELD, ld_store.TEXT)])
+
+    rows = []
+    for index, first_div in enumerate(FIRST_DIVS):
+        for offset, second_div in enumerate(['NENE', 'NWNE']):
+            rows.append([first_div, second_div, ld_geometry.polygon_from_extent(index * 10 + offset, 0, index * 10 + offset + 1, 1)])
+    store.insert_rows(plss_path, [ld_plss.FIRST_DIV_FIELD, ld_plss.SECOND_DIV_FIELD, ld_store.SHAPE_TOKEN], rows)
+
+    return plss_path
+
+
+def first_div_size(store):
+    return 2 * store.geometry_size(ld_geometry.polygon_from_extent(0, 0, 1, 1))
+
+
+def test_batch_read_with_one_query(store, plss_path):
+    plss_index = ld_plss.PLSSIndex(store, plss_path, 10 ** 6, batch_size=10)
+    plss_index.plan_batches(['A', 'B', 'C'])
+
+    for first_div in ['A', 'B', 'C']:
+        assert len(plss_index.get_shapes(first_div, SecondDivSet(is_all=True))) == 2
+
+    assert plss_index.query_count == 1
+    assert (plss_index.hits, plss_index.misses) == (2, 1)
+
+
+def test_second_divisions_in_layer_order(store, plss_path):
+    plss_index = ld_plss.PLSSIndex(store, plss_path, 10 ** 6, batch_size=10)
+
+    shapes = plss_index.get_shapes('B', SecondDivSet.from_elements(['NWNE', 'NENE']))
+
+    assert [shape.extent[0] for shape in shapes] == [10, 11]
+    assert plss_index.get_shapes('B', SecondDivSet.from_elements(['NWNE'])) == shapes[1:]
+
+
+def test_failed_batch_read_one_at_a_time(store, plss_path):
+    plss_index = ld_plss.PLSSIndex(store, plss_path, 10 ** 6, batch_size=10)
+    plss_index.plan_batches(['A', 'BAD', 'B'])
+
+    assert len(plss_index.get_shapes('A', SecondDivSet(is_all=True))) == 2
+    # The batch query, then each first division on its own
+    assert plss_index.query_count == 4
+    assert len(plss_index.get_shapes('B', SecondDivSet(is_all=True))) == 2
+    with pytest.raises(RuntimeError):
+        plss_index.get_shapes('BAD', SecondDivSet(is_all=True))
+    # The error is kept, the layer is not queried again
+    with pytest.raises(RuntimeError):
+        plss_index.get_shapes('BAD', SecondDivSet(is_all=True))
+    assert plss_index.query_count == 4
+
+
+def test_least_recently_used_evicted(store, plss_path):
+    plss_index = ld_plss.PLSSIndex(store, plss_path, first_div_size(store) * 2, batch_size=1)
+
+    for first_div in ['A', 'B', 'A', 'C']:
+        plss_index.get_shapes(first_div, SecondDivSet(is_all=True))
+
+    assert plss_index.evictions == 1
+    assert plss_index.loaded_bytes == first_div_size(store) * 2
+    assert (plss_index.hits, plss_index.misses) == (1, 3)
+
+    # B went, A (used since) was kept
+    plss_index.get_shapes('A', SecondDivSet(is_all=True))
+    assert plss_index.query_count == 3
+    plss_index.get_shapes('B', SecondDivSet(is_all=True))
+    assert plss_index.query_count == 4
+
+
+def test_batch_does_not_push_out_first_divisions_in_use(store, plss_path):
+    plss_index = ld_plss.PLSSIndex(store, plss_path, first_div_size(store) * 2, batch_size=2)
+    plss_index.plan_batches(['A', 'C', 'B'])
+
+    plss_index.get_shapes('A', SecondDivSet(is_all=True))
+    plss_index.get_shapes('C', SecondDivSet(is_all=True))
+    assert plss_index.query_count == 1
+
+    # B's batch is only B; it replaces the least recently used
+    plss_index.get_shapes('B', SecondDivSet(is_all=True))
+    assert plss_index.evictions == 1
+    assert plss_index.get_shapes('C', SecondDivSet(is_all=True))
+    assert plss_index.query_count == 2
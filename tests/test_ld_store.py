@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+import ld_geometry
+import ld_store
+
+
+@pytest.fixture
+def store():
+    store = ld_store.SQLiteFeatureStore()
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def layer_path(tmp_path, store):
+    workspace = str(tmp_path / 'layers.sqlite')
+    layer_path = os.path.join(workspace, 'Layer')
+    ld_store.SQLiteFeatureStore.create_workspace(workspace)
+    store.create_feature_class(layer_path, fields=[('Name', ld_store.TEXT)])
+    store.insert_rows(layer_path, ['Name', ld_store.SHAPE_TOKEN], [['A', ld_geometry.polygon_from_extent(0, 0, 1, 1)], ['B', None]])
+
+    return layer_path
+
+
+def test_source_stamp_unchanged_without_edits(store, layer_path):
+    stamp = store.get_source_stamp(layer_path)
+
+    # Other tables of the workspace do not count
+    store.create_feature_class(os.path.join(os.path.dirname(layer_path), 'Other'))
+    list(store.search(layer_path, ['Name']))
+
+    assert store.get_source_stamp(layer_path) == stamp
+    assert ld_store.SQLiteFeatureStore().get_source_stamp(layer_path) == stamp
+
+
+def test_source_stamp_changes_with_the_rows(store, layer_path):
+    stamps = [store.get_source_stamp(layer_path)]
+
+    with store.update_cursor(layer_path, ['Name']) as update_cursor:
+        for row in update_cursor:
+            update_cursor.updateRow(['C'])
+            break
+    stamps.append(store.get_source_stamp(layer_path))
+
+    # Same row count and last OBJECTID as before the delete and insert
+    with store.update_cursor(layer_path, ['Name'], "Name = 'B'") as update_cursor:
+        for row in update_cursor:
+            update_cursor.deleteRow()
+    store.insert_rows(layer_path, ['Name', ld_store.SHAPE_TOKEN], [['B', None]])
+    stamps.append(store.get_source_stamp(layer_path))
+
+    assert len(set(stamps)) == 3
+
+
+def test_source_stamp_of_a_table_made_again(store, layer_path):
+    stamp = store.get_source_stamp(layer_path)
+
+    store.create_feature_class(layer_path, fields=[('Name', ld_store.TEXT)])
+    store.insert_rows(layer_path, ['Name', ld_store.SHAPE_TOKEN], [['A', ld_geometry.polygon_from_extent(0, 0, 1, 1)], ['B', None]])
+
+    assert store.get_source_stamp(layer_path) != stamp
+
+
+def test_values_that_do_not_fit_the_field(tmp_path, store):
+    workspace = str(tmp_path / 'lease.sqlite')
+    layer_path = os.path.join(workspace, 'Lease')
+    ld_store.SQLiteFeatureStore.create_workspace(workspace)
+    store.create_feature_class(layer_path, fields=[('Section', ld_store.LONG), ('GIS_Legal', ld_store.TEXT, 10)])
+
+    assert store.field_lengths(layer_path) == {'GIS_Legal': 10}
+    store.insert_rows(layer_path, ['Section', 'GIS_Legal'], [[16, 'NE4']])
+    with pytest.raises(RuntimeError):
+        store.insert_rows(layer_path, ['Section', 'GIS_Legal'], [['16; 36', 'NE4']])
+    with pytest.raises(RuntimeError):
+        store.insert_rows(layer_path, ['Section', 'GIS_Legal'], [[16, 'NE4; SE4SW4']])
+
+    # Copies and layers made from it as a template keep the limit
+    store.create_feature_class(os.path.join(workspace, 'Copy'), template=layer_path)
+    assert store.field_lengths(os.path.join(workspace, 'Copy')) == {'GIS_Legal': 10}
+    ld_store.copy_feature_class(store, layer_path, store, os.path.join(workspace, 'Copy2'))
+    assert store.field_lengths(os.path.join(workspace, 'Copy2')) == {'GIS_Legal': 10}